@@ -0,0 +1,39 @@
+"""Throughput of one file sent between two `AsyncServer`s, next to the threaded `Server`
+
+Both asyncio servers run in one loop, the threaded ones in their own threads.
+"""
+import asyncio
+import time
+
+from common import quiet, work_dir, make_file, start_server, transfer
+from asyncServer import AsyncServer
+
+FILE_SIZE = 32 * 1024 * 1024
+ROUNDS = 3
+
+
+async def async_transfer(path: str) -> float | None:
+    """Send the file and return the throughput in MB/s, measured until the receiver reports it"""
+    async with await AsyncServer.create("127.0.0.1") as sender, await AsyncServer.create("127.0.0.1") as receiver:
+        received = asyncio.ensure_future(anext(receiver.files()))
+        start = time.perf_counter()
+        stats = await sender.send_file(path, *receiver.socket.getsockname(), 64, 1000)
+        if not stats.succeeded:
+            return None
+        await asyncio.wait_for(received, 60)
+        return FILE_SIZE / (time.perf_counter() - start) / 1e6
+
+
+if __name__ == "__main__":
+    quiet()
+    work_dir()
+    path = make_file(FILE_SIZE)
+    for _ in range(ROUNDS):
+        speed = asyncio.run(async_transfer(path))
+        print(f"asyncio  " + ("failed" if speed is None else f"{speed:8.2f} MB/s"))
+    for _ in range(ROUNDS):
+        sender, receiver = start_server(), start_server()
+        speed = transfer(sender, receiver, FILE_SIZE)
+        print(f"threaded " + ("failed" if speed is None else f"{speed:8.2f} MB/s"))
+        sender.close()
+        receiver.close()
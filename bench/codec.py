@@ -0,0 +1,47 @@
+"""Packets per second encoded and decoded by the MRP codec
+
+The previous codec (byte slicing, `int.from_bytes`, an Enum lookup by value and
+concatenation of four `bytes`) is kept here for comparison with the `struct` based one.
+"""
+import time
+
+from common import quiet  # noqa: F401, sets up the import path
+from packetParser import MRP, PacketType, HEADER_SIZE
+
+ROUNDS = 200_000
+PAYLOAD = 500
+
+
+def legacy_serialize(type: PacketType, file_id: int, number_in_window: int, window_number: int,
+                     payload: bytes) -> bytes:
+    first_byte = (type.value << 4) + file_id
+    return bytes([first_byte]) + number_in_window.to_bytes(1, "big") + window_number.to_bytes(4, "big") + payload
+
+
+def legacy_deserialize(data: bytes | memoryview) -> tuple[PacketType, int, int, int, bytes]:
+    flags = int.from_bytes(data[0:1], "big")
+    packet_type = PacketType(flags >> 4)
+    number_in_window = int.from_bytes(data[1:2], "big")
+    window_number = int.from_bytes(data[2:6], "big")
+    return packet_type, flags & 0b1111, number_in_window, window_number, bytes(data[6:])
+
+
+def measure(function, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        function(*args)
+    return ROUNDS / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    payload = bytes(PAYLOAD)
+    # Received datagrams are views of the receive ring
+    datagram = memoryview(bytearray(MRP.serialize(PacketType.Data, 3, 17, 123456, payload)))
+    legacy_datagram = memoryview(bytearray(legacy_serialize(PacketType.Data, 3, 17, 123456, payload)))
+    buffer = bytearray(HEADER_SIZE + PAYLOAD)
+    print(f"serialize    legacy: {measure(legacy_serialize, PacketType.Data, 3, 17, 123456, payload):>12,.0f} packets/s")
+    print(f"serialize    struct: {measure(MRP.serialize, PacketType.Data, 3, 17, 123456, payload):>12,.0f} packets/s")
+    print(f"pack_into    struct: "
+          f"{measure(MRP.serialize_into, buffer, 0, PacketType.Data, 3, 17, 123456, payload):>12,.0f} packets/s")
+    print(f"deserialize  legacy: {measure(legacy_deserialize, legacy_datagram):>12,.0f} packets/s")
+    print(f"deserialize  struct: {measure(MRP.deserialize, datagram):>12,.0f} packets/s")
@@ -0,0 +1,73 @@
+"""Shared helpers for the benchmarks
+
+Benchmarks are plain scripts, run them from the repository root: `python bench/<name>.py`
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from services import log  # noqa: E402
+from MainServer import Server  # noqa: E402
+
+
+def quiet(level: int | str = logging.CRITICAL + 1):
+    """Hide protocol logs so they don't affect the measurements"""
+    log.setLevel(level)
+
+
+def work_dir() -> str:
+    """Change into a fresh temporary directory, received files are saved to the cwd"""
+    path = tempfile.mkdtemp(prefix="mrp-bench-")
+    os.chdir(path)
+    return path
+
+
+def make_file(size: int, name: str = "blob.bin") -> str:
+    path = os.path.join(tempfile.mkdtemp(prefix="mrp-src-"), name)
+    with open(path, "wb") as file:
+        file.write(os.urandom(size))
+    return path
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **kwargs) -> Server:
+    server = Server(host, port, **kwargs)
+    threading.Thread(target=server.start, daemon=True).start()
+    return server
+
+
+def address(server: Server) -> tuple[str, int]:
+    return server.socket.getsockname()
+
+
+def wait_received(name: str, size: int, timeout: float = 60, receiver: Server | None = None) -> float | None:
+    """Wait until the file `name` with `size` bytes appears in the cwd, return elapsed seconds
+
+    Received files are preallocated, so with the `receiver` it also waits until it has no transfers left.
+    """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if (os.path.exists(name) and os.path.getsize(name) == size
+                and (receiver is None or not any(c.transfers for c in list(receiver.connections.values())))):
+            return time.perf_counter() - start
+        time.sleep(0.001)
+    return None
+
+
+def transfer(sender: Server, receiver: Server, size: int, window_len: int = 64, frame_len: int = 1000,
+             timeout: float = 60) -> float | None:
+    """Send a random file of `size` bytes and return the throughput in MB/s"""
+    path = make_file(size)
+    name = os.path.basename(path)
+    if os.path.exists(name):
+        os.remove(name)
+    start = time.perf_counter()
+    sender.send_file(path, *address(receiver), window_len, frame_len)
+    elapsed = wait_received(name, size, timeout, receiver)
+    if elapsed is None:
+        return None
+    return size / (time.perf_counter() - start) / 1e6
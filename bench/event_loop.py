@@ -0,0 +1,35 @@
+"""Idle CPU usage and transfer throughput of the `Server` event loop"""
+import time
+
+from common import quiet, work_dir, start_server, transfer
+
+IDLE_SECONDS = 3
+FILE_SIZE = 4 * 1024 * 1024
+RUNS = 3
+
+
+def idle_cpu() -> float:
+    """CPU usage of the process in % while two servers with an open connection are idle"""
+    sender = start_server()
+    receiver = start_server()
+    transfer(sender, receiver, 1024)
+    time.sleep(0.5)
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    time.sleep(IDLE_SECONDS)
+    return (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+
+
+def throughput() -> list[float | None]:
+    sender = start_server()
+    receiver = start_server()
+    return [transfer(sender, receiver, FILE_SIZE) for _ in range(RUNS)]
+
+
+if __name__ == "__main__":
+    quiet()
+    work_dir()
+    print(f"Idle CPU: {idle_cpu():.1f}%")
+    for speed in throughput():
+        print("Throughput: failed" if speed is None else f"Throughput: {speed:.2f} MB/s")
@@ -0,0 +1,48 @@
+"""Throughput of a transfer with small fragments with the logging off and on
+
+Small fragments in small windows mean many windows, so many per window log records. The records go
+to a temporary file, a terminal is slower still. `DEBUG, direct` is the old way: every record is
+formatted and written by the loop, none are dropped.
+"""
+import tempfile
+
+from common import quiet, work_dir, start_server, transfer
+from services import log, configure_logging, RateLimitFilter
+
+FILE_SIZE = 8 * 1024 * 1024
+FRAME_LEN = 100
+WINDOW = 8
+RUNS = 3
+
+MODES = (
+    ("off", None, True, True),
+    ("DEBUG, direct", "DEBUG", False, False),
+    ("DEBUG, background", "DEBUG", True, True),
+    ("INFO, background", "INFO", True, True),
+)
+"""Name, level, background writing and the rate limit of the hot records"""
+
+
+def set_rate_limit(enabled: bool):
+    for installed in [installed for installed in log.filters if isinstance(installed, RateLimitFilter)]:
+        log.removeFilter(installed)
+    if enabled:
+        log.addFilter(RateLimitFilter())
+
+
+if __name__ == "__main__":
+    work_dir()
+    output = tempfile.TemporaryFile("w")
+    for name, level, background, rate_limit in MODES:
+        configure_logging(level or "INFO", background, output)
+        set_rate_limit(rate_limit)
+        if level is None:
+            quiet()
+        sender = start_server()
+        receiver = start_server()
+        speeds = [transfer(sender, receiver, FILE_SIZE, WINDOW, FRAME_LEN) for _ in range(RUNS)]
+        sender.close()
+        receiver.close()
+        quiet()
+        results = "  ".join("failed" if speed is None else f"{speed:6.2f}" for speed in speeds)
+        print(f"{name:<20} {results}  MB/s")
@@ -0,0 +1,68 @@
+"""Many small files sent to one peer at the same time
+
+Every file is a transfer of its own, so the transfers per connection are limited
+by the id space. Run with the amount of files as an argument: `python bench/many_files.py 10000`
+The two way case sends the same amount back at once, both peers pick the same ids for their transfers.
+Exits with 1 when a case does not receive all files.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from common import quiet, work_dir, start_server, address
+
+FILES = 10_000
+FILE_SIZE = 1024
+WINDOW = 8
+TIMEOUT = 600  # s
+
+
+def make_files(amount: int, prefix: str) -> list[str]:
+    directory = tempfile.mkdtemp(prefix="mrp-src-")
+    paths = [os.path.join(directory, f"{prefix}-{i:06}.bin") for i in range(amount)]
+    for path in paths:
+        with open(path, "wb") as file:
+            file.write(os.urandom(FILE_SIZE))
+    return paths
+
+
+def received(paths: list[str]) -> int:
+    return sum(1 for path in paths
+               if os.path.exists(os.path.basename(path)) and os.path.getsize(os.path.basename(path)) == FILE_SIZE)
+
+
+def run(name: str, amount: int, two_way: bool) -> bool:
+    """Return whether all files were received"""
+    first = start_server()
+    second = start_server()
+    sends = [(first, second, make_files(amount, f"{name.replace(' ', '-')}-forward"))]
+    if two_way:
+        sends.append((second, first, make_files(amount, f"{name.replace(' ', '-')}-back")))
+    paths = [path for _, _, files in sends for path in files]
+
+    start = time.perf_counter()
+    for sender, receiver, files in sends:
+        for path in files:
+            sender.send_file(path, *address(receiver), WINDOW, 1000)
+    done = 0
+    while time.perf_counter() - start < TIMEOUT:
+        done = received(paths)
+        if done == len(paths):
+            break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    first.close()
+    second.close()
+    print(f"{name:<8} Received {done}/{len(paths)} files of {FILE_SIZE} B in {elapsed:.2f} s:"
+          f" {done / elapsed:,.0f} files/s")
+    return done == len(paths)
+
+
+if __name__ == "__main__":
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else FILES
+    quiet()
+    work_dir()
+    ok = run("one way", amount, False)
+    ok = run("two way", amount, True) and ok
+    sys.exit(0 if ok else 1)
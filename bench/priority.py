@@ -0,0 +1,118 @@
+"""Latency of messages and small files by priority while bulk transfers fill a slow link
+
+The sender reaches the receiver through `relay.Relay` limited to `RATE`, so the bulk transfers keep
+the congestion window full and every new packet waits for the scheduler of the connection. A High
+packet goes out with the next confirm, a Bulk one shares the bandwidth with the bulk transfers by
+deficit round robin. The queue of the link delays both the same. Retransmissions bypass the scheduler,
+a resent packet of a bulk transfer goes out before a waiting High packet.
+
+Messages are sent one after another, the time from `send_message` to the receiver's `on_message`
+is measured. Small files are measured until the sender gets their integrity confirm, so the
+receiver's linger after the last packet is not included.
+"""
+import logging
+import os
+import statistics
+import threading
+import time
+
+from common import quiet, work_dir, make_file, start_server, address
+from services import log
+from scheduler import Priority
+from relay import Impairment, Relay
+
+RATE = 500 * 1000  # B/s
+LINK = Impairment(delay=5, rate=RATE, mtu=1500)
+"""From the sender to the receiver, the confirms go back with the delay only. Without the MTU the path MTU
+probes of loopback size hold the link for a hundred milliseconds"""
+BULK_TRANSFERS = 4
+BULK_SIZE = 16 * 1024 * 1024
+SMALL_SIZE = 16 * 1024
+ROUNDS = 20
+
+
+class FileWatcher(logging.Handler):
+    """Wakes the benchmark when the sender reports a small file as sent"""
+
+    def __init__(self) -> None:
+        super().__init__(logging.CRITICAL)
+        self.sent = threading.Event()
+
+    def emit(self, record: logging.LogRecord):
+        if "File sent successfully" in record.getMessage() and "small" in record.getMessage():
+            self.sent.set()
+
+
+def message_latencies(sender, destination: tuple[str, int], receiver, priority: Priority) -> list[float]:
+    received = threading.Event()
+    receiver.on_message = lambda data, source: received.set()
+    result = []
+    for i in range(ROUNDS):
+        received.clear()
+        start = time.perf_counter()
+        sender.send_message(f"ping {i}", *destination, priority=priority)
+        if not received.wait(30):
+            break
+        result.append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def file_latencies(sender, destination: tuple[str, int], watcher: FileWatcher, priority: Priority) -> list[float]:
+    small = make_file(SMALL_SIZE, "small.bin")
+    result = []
+    for _ in range(ROUNDS):
+        watcher.sent.clear()
+        start = time.perf_counter()
+        sender.send_file(small, *destination, 32, 1000, priority=priority)
+        if not watcher.sent.wait(30):
+            break
+        result.append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def report(name: str, values: list[float]):
+    if not values:
+        print(f"{name:<32} nothing received")
+        return
+    print(f"{name:<32} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms"
+          f"   ({len(values)}/{ROUNDS})")
+
+
+def through_link(receiver, measure, bulk: list[str]) -> list[float]:
+    """Run the measurement on a fresh sender and link, with the bulk transfers in progress if any"""
+    sender = start_server()
+    relay = Relay(address(receiver), LINK)
+    for path in bulk:
+        sender.send_file(path, *relay.address, 16, 1000, 64, priority=Priority.Bulk)
+    if bulk:
+        # Congestion window grows till the queue of the link overflows
+        time.sleep(2)
+    result = measure(sender, relay.address)
+    sender.close()
+    relay.close()
+    return result
+
+
+if __name__ == "__main__":
+    quiet(logging.CRITICAL)
+    log.propagate = False
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    watcher = FileWatcher()
+    log.addHandler(watcher)
+    work_dir()
+    receiver = start_server()
+    bulk = [make_file(BULK_SIZE, f"bulk{i}.bin") for i in range(BULK_TRANSFERS)]
+
+    report("message, idle", through_link(
+        receiver, lambda sender, destination: message_latencies(sender, destination, receiver, Priority.High), []))
+    for priority in (Priority.High, Priority.Bulk):
+        report(f"message, during bulk, {priority.name}", through_link(
+            receiver, lambda sender, destination: message_latencies(sender, destination, receiver, priority), bulk))
+    report("small file, idle", through_link(
+        receiver, lambda sender, destination: file_latencies(sender, destination, watcher, Priority.High), []))
+    for priority in (Priority.High, Priority.Bulk):
+        report(f"small file, during bulk, {priority.name}", through_link(
+            receiver, lambda sender, destination: file_latencies(sender, destination, watcher, priority), bulk))
+    for name in os.listdir("."):
+        os.remove(name)
@@ -0,0 +1,75 @@
+"""Packets per second drained from a UDP socket by the receive paths of `Server`
+
+The socket is filled with `BURST` datagrams and then drained, so only the receive
+side is measured: one `recvfrom` per datagram as before, the `recvfrom_into`
+loop fallback and batched `recvmmsg` of `DatagramReceiver`.
+"""
+import socket
+import time
+
+from common import quiet  # noqa: F401, sets up the import path
+from datagramReceiver import DatagramReceiver
+from packetParser import MRP, PacketType
+
+ROUNDS = 200
+BURST = 500
+PAYLOAD = 500
+
+
+def make_pair() -> tuple[socket.socket, socket.socket]:
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setblocking(False)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(receiver.getsockname())
+    return sender, receiver
+
+
+def measure(drain) -> float:
+    sender, receiver = make_pair()
+    datagram = MRP.serialize(PacketType.Data, 0, 0, 0, bytes(PAYLOAD))
+    total, elapsed = 0, 0.0
+    for _ in range(ROUNDS):
+        for _ in range(BURST):
+            sender.send(datagram)
+        start = time.perf_counter()
+        received = drain(receiver)
+        elapsed += time.perf_counter() - start
+        total += received
+    sender.close()
+    receiver.close()
+    return total / elapsed
+
+
+def drain_recvfrom(sock: socket.socket) -> int:
+    received = 0
+    while True:
+        try:
+            data, _ = sock.recvfrom(1500)
+        except BlockingIOError:
+            return received
+        MRP.deserialize(data)
+        received += 1
+
+
+def drain_receiver(use_recvmmsg: bool):
+    receivers: dict[socket.socket, DatagramReceiver] = {}
+
+    def drain(sock: socket.socket) -> int:
+        if sock not in receivers:
+            receivers[sock] = DatagramReceiver(sock, use_recvmmsg=use_recvmmsg)
+        received = 0
+        while datagrams := receivers[sock].receive():
+            for data, _ in datagrams:
+                MRP.deserialize(data)
+            received += len(datagrams)
+        return received
+
+    return drain
+
+
+if __name__ == "__main__":
+    print(f"recvfrom per datagram:  {measure(drain_recvfrom):,.0f} packets/s")
+    print(f"recvfrom_into loop:     {measure(drain_receiver(False)):,.0f} packets/s")
+    print(f"recvmmsg batch:         {measure(drain_receiver(True)):,.0f} packets/s")
@@ -0,0 +1,199 @@
+"""UDP relay between two peers on loopback that impairs the datagrams it forwards
+
+The sender talks to the relay instead of the receiver, the relay forwards to the receiver from
+a socket of its own and the answers back to the sender. Every direction has its own `Impairment`,
+delays are per datagram, so jitter reorders datagrams too.
+"""
+import heapq
+import random
+import selectors
+import socket
+import time
+
+from dataclasses import dataclass, field
+from itertools import count
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+
+
+@dataclass
+class Impairment:
+    """What happens to the datagrams of one direction, probabilities are per datagram"""
+    delay: float = 0  # ms
+    jitter: float = 0  # ms
+    """Uniform random extra delay, up to this value"""
+    loss: float = 0
+    reorder: float = 0
+    """Datagram is held back by `reorder_delay`, so the following ones overtake it"""
+    reorder_delay: float = 5  # ms
+    duplicate: float = 0
+    corrupt: float = 0
+    """One random byte of the datagram is flipped"""
+    mtu: int = 0  # B
+    """Longer datagrams are dropped, like a router drops them with the don't fragment flag, 0 for no limit"""
+    rate: float = 0  # B/s
+    """Bandwidth of the link, datagrams wait in its queue until it is free, 0 for no limit"""
+    queue: int = 64 * 1024  # B
+    """Bytes waiting for a limited link, datagrams that don't fit are dropped"""
+
+    def to_dict(self) -> dict[str, float]:
+        return dict(self.__dict__)
+
+
+@dataclass
+class RelayStats:
+    forwarded: int = 0
+    lost: int = 0
+    reordered: int = 0
+    duplicated: int = 0
+    corrupted: int = 0
+    too_big: int = 0
+    overflowed: int = 0
+    """Dropped by the full queue of a limited link"""
+
+
+@dataclass
+class Profile:
+    """Named network, `forward` from the sender to the receiver, `backward` for the answers"""
+    name: str
+    forward: Impairment = field(default_factory=Impairment)
+    backward: Impairment = field(default_factory=Impairment)
+
+
+PROFILES: dict[str, Profile] = {profile.name: profile for profile in (
+    Profile("clean"),
+    Profile("lan", Impairment(delay=0.5, jitter=0.2), Impairment(delay=0.5, jitter=0.2)),
+    Profile("wan", Impairment(delay=20, jitter=2), Impairment(delay=20, jitter=2)),
+    Profile("lossy", Impairment(delay=5, loss=0.02), Impairment(delay=5, loss=0.02)),
+    Profile("reorder", Impairment(delay=2, reorder=0.05), Impairment(delay=2)),
+    Profile("duplicate", Impairment(delay=2, duplicate=0.05), Impairment(delay=2, duplicate=0.05)),
+    Profile("corrupt", Impairment(delay=2, corrupt=0.01), Impairment(delay=2, corrupt=0.01)),
+    Profile("tunnel", Impairment(delay=5, mtu=1400), Impairment(delay=5, mtu=1400)),
+    Profile("hostile", Impairment(delay=10, jitter=5, loss=0.05, reorder=0.05, duplicate=0.02, corrupt=0.01),
+            Impairment(delay=10, jitter=5, loss=0.05, duplicate=0.02)),
+)}
+
+
+class Forwarder:
+    """Forwards between one client and `target` until the pipe asks for the stats"""
+
+    def __init__(self, target: tuple[str, int], forward: Impairment, backward: Impairment, seed: int) -> None:
+        self.target = target
+        self.impairments = (forward, backward)
+        self.random = random.Random(seed)
+        self.stats = RelayStats()
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.front.bind(("127.0.0.1", 0))
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back.bind(("127.0.0.1", 0))
+        for sock in (self.front, self.back):
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        self.client: tuple[str, int] | None = None
+        self.queue: list[tuple[float, int, socket.socket, bytes, tuple[str, int]]] = []
+        """Held datagrams by the time they are sent"""
+        self.order = count()
+        self.link_free: dict[socket.socket, float] = {}
+        """Time each limited link sends its last queued datagram by, per socket"""
+
+    def run(self, control: Connection):
+        selector = selectors.DefaultSelector()
+        selector.register(self.front, selectors.EVENT_READ)
+        selector.register(self.back, selectors.EVENT_READ)
+        selector.register(control, selectors.EVENT_READ)
+        while True:
+            timeout = max(self.queue[0][0] - time.monotonic(), 0) if self.queue else None
+            for key, _ in selector.select(timeout):
+                if key.fileobj is control:
+                    control.recv()
+                    control.send(self.stats)
+                    return
+                self.receive(key.fileobj)  # type: ignore[arg-type]
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, sock, data, address = heapq.heappop(self.queue)
+                self.send(sock, data, address)
+
+    def receive(self, sock: socket.socket):
+        while True:
+            try:
+                data, address = sock.recvfrom(65536)
+            except OSError:
+                return
+            if sock is self.front:
+                self.client = address
+                self.impair(data, self.back, self.target, self.impairments[0])
+            elif self.client is not None:
+                self.impair(data, self.front, self.client, self.impairments[1])
+
+    def impair(self, data: bytes, sock: socket.socket, address: tuple[str, int], impairment: Impairment):
+        if impairment.mtu and len(data) > impairment.mtu:
+            self.stats.too_big += 1
+            return
+        if self.random.random() < impairment.loss:
+            self.stats.lost += 1
+            return
+        queued = 0.0  # s
+        if impairment.rate:
+            now = time.monotonic()
+            free = max(self.link_free.get(sock, now), now)
+            if (free - now) * impairment.rate + len(data) > impairment.queue:
+                self.stats.overflowed += 1
+                return
+            self.link_free[sock] = free + len(data) / impairment.rate
+            queued = self.link_free[sock] - now
+        if self.random.random() < impairment.corrupt and data:
+            index = self.random.randrange(len(data))
+            data = data[:index] + bytes([data[index] ^ 0xFF]) + data[index + 1:]
+            self.stats.corrupted += 1
+        copies = 1
+        if self.random.random() < impairment.duplicate:
+            copies = 2
+            self.stats.duplicated += 1
+        for _ in range(copies):
+            delay = impairment.delay + self.random.uniform(0, impairment.jitter) + queued * 1000
+            if self.random.random() < impairment.reorder:
+                delay += impairment.reorder_delay
+                self.stats.reordered += 1
+            self.stats.forwarded += 1
+            if delay <= 0 and not self.queue:
+                self.send(sock, data, address)
+            else:
+                heapq.heappush(self.queue, (time.monotonic() + delay / 1000, next(self.order), sock, data, address))
+
+    @staticmethod
+    def send(sock: socket.socket, data: bytes, address: tuple[str, int]):
+        try:
+            sock.sendto(data, address)
+        except OSError:
+            # Full buffer drops the datagram like a router would
+            pass
+
+
+def run_relay(target: tuple[str, int], forward: Impairment, backward: Impairment, seed: int, control: Connection):
+    forwarder = Forwarder(target, forward, backward, seed)
+    control.send(forwarder.front.getsockname())
+    forwarder.run(control)
+
+
+class Relay:
+    """Relay in a process of its own, so it doesn't take the GIL from the servers
+
+    `seed` makes the impairments of the same sequence of datagrams the same in every run.
+    """
+
+    def __init__(self, target: tuple[str, int], forward: Impairment | None = None,
+                 backward: Impairment | None = None, seed: int = 0) -> None:
+        self.control, control = Pipe()
+        self.process = Process(target=run_relay, args=(target, forward or Impairment(), backward or Impairment(),
+                                                       seed, control), daemon=True)
+        self.process.start()
+        self.address: tuple[str, int] = self.control.recv()
+        """Address the sender uses instead of the target"""
+
+    def close(self) -> RelayStats:
+        self.control.send("close")
+        stats = self.control.recv()
+        self.process.join()
+        return stats
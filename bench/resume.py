@@ -0,0 +1,137 @@
+"""Kill a resumable transfer mid-flight and check that the next send resumes it
+
+The sender runs in a process of its own and is killed once a part of the windows is journaled.
+The receiver times out and keeps the partial file with its journal, a new sender sends the same
+file again. The received file has to match the SHA-256 of the source, the journal has to be gone
+and the second sender must not send the journaled windows again. Exits with 1 when a check fails.
+"""
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+from common import quiet, work_dir, make_file, start_server, address
+from fileData import FileData
+from journal import TransferJournal
+from metrics import Metrics
+from receiveFile import TRANSFER_TIMEOUT
+from MainServer import Server
+
+FILE_SIZE = 32 * 1024 * 1024
+WINDOW = 64
+FRAME_LEN = 1000
+KILL_SHARE = 0.25
+"""Share of the data windows journaled before the sender is killed"""
+TIMEOUT = 60  # s
+
+MODES = (
+    ("resumable", False),
+    ("resumable, chunked", True),
+)
+"""Name and chunked mode"""
+
+
+def send(path: str, destination: tuple[str, int], chunked: bool):
+    """Sender process, sends until it is killed"""
+    quiet()
+    sender = start_server()
+    sender.send_file(path, *destination, WINDOW, FRAME_LEN, chunked=chunked, resumable=True)
+    time.sleep(TIMEOUT)
+
+
+def file_hash(path: str) -> bytes:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.digest()
+
+
+def journaled_windows(journal: TransferJournal) -> int:
+    fresh = TransferJournal(journal.file_hash, journal.size, journal.window_size, journal.fragment_len)
+    return fresh.completed_windows() if fresh.load() else 0
+
+
+def idle(receiver: Server) -> bool:
+    return not any(connection.transfers for connection in list(receiver.connections.values()))
+
+
+def wait(condition, timeout: float) -> bool:
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def sent_bytes(sender: Server) -> int:
+    snapshot = sender.get_metrics()
+    metrics: Metrics = snapshot["closed"]
+    for connection in snapshot["connections"].values():
+        metrics.merge(connection["metrics"])
+    return metrics.bytes_out
+
+
+def run(path: str, chunked: bool) -> list[str]:
+    """Return the failed checks"""
+    receiver = start_server()
+    digest = file_hash(path)
+    name = os.path.basename(path)
+    # Chunked transfer is identified by the hash of its chunk hashes
+    key = bytes.fromhex(FileData(path=path, with_hash=False, chunked=True).root) if chunked else digest
+    journal = TransferJournal(key, FILE_SIZE, WINDOW, FRAME_LEN)
+    windows = journal.get_windows()
+    failed: list[str] = []
+
+    process = multiprocessing.get_context("spawn").Process(target=send, args=(path, address(receiver), chunked))
+    process.start()
+    if not wait(lambda: journaled_windows(journal) >= windows * KILL_SHARE, TIMEOUT):
+        process.kill()
+        receiver.close()
+        return ["nothing journaled before the kill"]
+    process.kill()
+    process.join()
+    killed_at = journaled_windows(journal)
+    if killed_at >= windows:
+        failed.append("transfer finished before the kill")
+
+    # Receiver keeps the partial file and the journal after its timeout
+    if not wait(lambda: idle(receiver), TRANSFER_TIMEOUT / 1000 + TIMEOUT):
+        failed.append("receiver did not time out")
+    if not os.path.exists(journal.path):
+        failed.append("journal removed after the failure")
+
+    sender = start_server()
+    start = time.perf_counter()
+    sender.send_file(path, *address(receiver), WINDOW, FRAME_LEN, chunked=chunked, resumable=True)
+    finished = wait(lambda: not os.path.exists(journal.path) and idle(receiver), TIMEOUT)
+    elapsed = time.perf_counter() - start
+    resent = sent_bytes(sender)
+    sender.close()
+    receiver.close()
+    if not finished:
+        failed.append("resumed transfer did not finish")
+    elif file_hash(name) != digest:
+        failed.append("SHA-256 of the received file does not match")
+    skipped = killed_at * WINDOW * FRAME_LEN
+    if resent > FILE_SIZE - skipped + FILE_SIZE // 8:
+        failed.append(f"resumed transfer sent {resent} B, {skipped} B were journaled")
+    print(f"killed at {killed_at}/{windows} windows, resumed in {elapsed:.2f} s sending {resent / 1e6:.1f} MB")
+    os.remove(name)
+    return failed
+
+
+if __name__ == "__main__":
+    quiet()
+    work_dir()
+    source = make_file(FILE_SIZE)
+    ok = True
+    for mode, chunked in MODES:
+        print(f"{mode:<20} ", end="", flush=True)
+        failures = run(source, chunked)
+        for failure in failures:
+            print(f"{mode:<20} FAILED: {failure}")
+        ok &= not failures
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,63 @@
+"""RTT estimate of window by window transfers through reordering and lossy links
+
+The sender samples the RTT of a window from the resend of its reported losses, an original delayed
+past the loss report must not shorten the estimate. `late reorder` holds datagrams back longer than
+the receiver waits before it reports them, so the originals arrive right after the resend. Fails
+with exit code 1 when a sample is shorter than `COLLAPSE_SHARE` of the delay of the link, such samples
+pull the retransmission timeout down to spurious resends.
+"""
+import os
+import sys
+
+from common import quiet, work_dir, make_file, start_server, address, wait_received
+from relay import PROFILES, Impairment, Profile, Relay
+
+FILE_SIZE = 4 * 1024 * 1024
+WINDOW = 64
+FRAME_LEN = 1000
+TIMEOUT = 120  # s
+COLLAPSE_SHARE = 0.8
+"""Sample below this share of the round trip delay of the link answered a delayed original"""
+
+CHECKED: tuple[Profile, ...] = (
+    PROFILES["reorder"],
+    PROFILES["lossy"],
+    Profile("late reorder", Impairment(delay=20, reorder=0.05, reorder_delay=150), Impairment(delay=20)),
+)
+
+
+def run(profile: Profile, path: str) -> str | None:
+    """Return why the check failed"""
+    receiver = start_server()
+    sender = start_server()
+    relay = Relay(address(receiver), profile.forward, profile.backward)
+    name = os.path.basename(path)
+    sender.send_file(path, *relay.address, WINDOW, FRAME_LEN)
+    elapsed = wait_received(name, FILE_SIZE, TIMEOUT, receiver)
+    rtt = next(iter(sender.connections.values())).rtt.stats()
+    sender.close()
+    receiver.close()
+    stats = relay.close()
+    os.remove(name)
+    print(f"{profile.name:<14} {'failed' if elapsed is None else f'{elapsed:6.2f} s':>8}  samples {rtt['samples']:4}"
+          f"  min {rtt['min_sample']} ms  srtt {rtt['srtt']:6.1f} ms  rto {rtt['rto']:6.1f} ms"
+          f"  reordered {stats.reordered}  lost {stats.lost}")
+    if elapsed is None:
+        return "transfer did not finish"
+    base = profile.forward.delay + profile.backward.delay
+    if rtt["min_sample"] < COLLAPSE_SHARE * base:
+        return f"RTT sample of {rtt['min_sample']} ms, the link delays {base} ms"
+    return None
+
+
+if __name__ == "__main__":
+    quiet()
+    work_dir()
+    source = make_file(FILE_SIZE)
+    ok = True
+    for profile in CHECKED:
+        failure = run(profile, source)
+        if failure is not None:
+            print(f"{profile.name:<14} FAILED: {failure}")
+            ok = False
+    sys.exit(0 if ok else 1)
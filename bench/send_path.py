@@ -0,0 +1,63 @@
+"""Packets per second pushed to a UDP socket by the send paths of `Server`
+
+A window of `BURST` datagrams is queued and flushed, the receiver socket is drained
+outside of the measured time: one `sendto` per datagram as before, batched `sendmmsg`
+and UDP GSO of `DatagramSender`.
+"""
+import socket
+import time
+
+from common import quiet  # noqa: F401, sets up the import path
+from datagramSender import DatagramSender
+from packetParser import MRP, PacketType
+
+ROUNDS = 200
+BURST = 256
+PAYLOAD = 500
+
+
+def make_pair() -> tuple[socket.socket, socket.socket]:
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setblocking(False)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.setblocking(False)
+    return sender, receiver
+
+
+def drain(sock: socket.socket) -> int:
+    received = 0
+    while True:
+        try:
+            sock.recv(65536)
+        except BlockingIOError:
+            return received
+        received += 1
+
+
+def measure(use_sendmmsg: bool, use_gso: bool) -> tuple[float, float]:
+    sender, receiver = make_pair()
+    datagram_sender = DatagramSender(sender, use_sendmmsg=use_sendmmsg, use_gso=use_gso)
+    address = receiver.getsockname()
+    datagrams = [MRP.serialize(PacketType.Data, 0, i % 256, 0, bytes(PAYLOAD)) for i in range(BURST)]
+    total, received, elapsed = 0, 0, 0.0
+    for _ in range(ROUNDS):
+        queue = list(datagrams)
+        start = time.perf_counter()
+        datagram_sender.schedule(queue, address)
+        datagram_sender.flush()
+        elapsed += time.perf_counter() - start
+        total += BURST
+        received += drain(receiver)
+    sender.close()
+    receiver.close()
+    return total / elapsed, received / total
+
+
+if __name__ == "__main__":
+    for name, use_sendmmsg, use_gso in (("sendto per datagram:", False, False),
+                                        ("sendmmsg batch:     ", True, False),
+                                        ("UDP GSO:            ", True, True)):
+        rate, delivered = measure(use_sendmmsg, use_gso)
+        print(f"{name} {rate:,.0f} packets/s, {delivered:.0%} delivered")
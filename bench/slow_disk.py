@@ -0,0 +1,61 @@
+"""Latency of messages from one peer while another one sends a file to a slow disk
+
+Every write of the receiver is delayed by `WRITE_DELAY` to simulate a slow disk. With the disk
+jobs in the loop (`io_threads=0`) each write delays the packets of all peers, with the pool only
+the transfer writing to the disk waits.
+"""
+import os
+import statistics
+import threading
+import time
+
+from common import quiet, work_dir, make_file, start_server, address
+
+WRITE_DELAY = 0.0005  # s
+BULK_SIZE = 32 * 1024 * 1024
+ROUNDS = 50
+
+_pwrite = os.pwrite
+
+
+def slow_pwrite(fd: int, data, offset: int) -> int:
+    time.sleep(WRITE_DELAY)
+    return _pwrite(fd, data, offset)
+
+
+def message_latencies(io_threads: int, bulk: str) -> list[float]:
+    receiver = start_server(io_threads=io_threads)
+    sender = start_server()
+    peer = start_server()
+    received = threading.Event()
+    receiver.on_message = lambda data, source: received.set()
+    sender.send_file(bulk, *address(receiver), 64, 1000, 64)
+    time.sleep(0.5)
+    result = []
+    for i in range(ROUNDS):
+        received.clear()
+        start = time.perf_counter()
+        peer.send_message(f"ping {i}", *address(receiver))
+        if not received.wait(10):
+            break
+        result.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+    for server in (sender, peer, receiver):
+        server.close()
+    return result
+
+
+if __name__ == "__main__":
+    quiet()
+    work_dir()
+    bulk = make_file(BULK_SIZE)
+    os.pwrite = slow_pwrite
+    for name, io_threads in (("disk jobs in the loop", 0), ("disk jobs in the pool", 4)):
+        values = message_latencies(io_threads, bulk)
+        if not values:
+            print(f"{name:<24} nothing received")
+            continue
+        print(f"{name:<24} median {statistics.median(values):8.1f} ms   p90 {statistics.quantiles(values, n=10)[-1]:8.1f} ms"
+              f"   max {max(values):8.1f} ms"
+              f"   ({len(values)}/{ROUNDS})")
+        time.sleep(1)
@@ -0,0 +1,230 @@
+"""Throughput and latency of transfers through `relay.Relay` over window sizes, frame lengths and file sizes
+
+Every case runs a fresh sender and receiver `Server` on loopback, the sender sends to the relay, which
+impairs the datagrams with the network profile and forwards them to the receiver. The relay of every
+case starts from the same seed, so reruns of one commit see the same impairments for the same datagrams.
+Latency is the delivery time of small messages through the same relay.
+Combinations `userInterface.check_values` rejects are skipped, so are frames longer than the MTU of the profile,
+their datagrams are dropped by the relay, as they would be with the don't fragment flag.
+
+    python bench/sweep.py report.json [--quick] [--profiles clean,lossy]
+    python bench/sweep.py --compare base.json report.json
+
+The report is JSON, `--compare` prints the change of every case two reports share and exits with 1
+when a case got slower than the threshold or stopped finishing.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from datetime import datetime, timezone
+from typing import Any
+
+from common import quiet, work_dir, make_file, start_server, address, wait_received
+from packetParser import HEADER_SIZE
+from relay import PROFILES, Profile, Relay
+from metrics import Metrics
+from MainServer import Server
+from userInterface import check_values
+
+WINDOWS: tuple[int, ...] = (8, 64, 248)
+FRAMES: tuple[int, ...] = (0, 64, 500, 1400, 2040, 8192)
+"""Frame lengths, 0 fills the datagrams the path MTU lets through"""
+FILE_SIZES: tuple[int, ...] = (64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+QUICK_WINDOWS: tuple[int, ...] = (64,)
+QUICK_FRAMES: tuple[int, ...] = (0, 1400)
+QUICK_FILE_SIZES: tuple[int, ...] = (1024 * 1024,)
+QUICK_PROFILES: tuple[str, ...] = ("clean", "lossy", "tunnel", "hostile")
+MESSAGES: int = 20
+"""Messages per profile for the latency"""
+MESSAGE_TIMEOUT: float = 5  # s
+TIMEOUT: float = 120  # s
+SEED: int = 1
+THRESHOLD: float = 0.1
+"""Relative loss of throughput or gain of latency `--compare` reports as a regression"""
+LATENCY_SLACK: float = 1  # ms
+"""Latency gain always tolerated, loopback latencies are too short for the relative threshold alone"""
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def sender_metrics(sender: Server) -> Metrics:
+    """Metrics of all connections of the sender, the closed ones included"""
+    snapshot = sender.get_metrics()
+    metrics = snapshot["closed"]
+    for connection in snapshot["connections"].values():
+        metrics.merge(connection["metrics"])
+    return metrics
+
+
+def run_case(profile: Profile, window: int, frame: int, size: int, timeout: float) -> dict[str, Any]:
+    sender, receiver = start_server(), start_server()
+    relay = Relay(address(receiver), profile.forward, profile.backward, SEED)
+    path = make_file(size, f"{profile.name}-{window}-{frame}-{size}.bin")
+    name = os.path.basename(path)
+    try:
+        start = time.perf_counter()
+        sender.send_file(path, *relay.address, window, frame or None)
+        elapsed = wait_received(name, size, timeout, receiver)
+        if elapsed is not None:
+            elapsed = time.perf_counter() - start
+        metrics = sender_metrics(sender)
+    finally:
+        sender.close()
+        receiver.close()
+        stats = relay.close()
+        os.remove(path)
+        if os.path.exists(name):
+            os.remove(name)
+    return {
+        "profile": profile.name, "window": window, "frame": frame, "size": size, "ok": elapsed is not None,
+        "seconds": elapsed, "throughput": None if elapsed is None else size / elapsed / 1e6,  # MB/s
+        "rtt_mean": metrics.rtt.sum / metrics.rtt.count if metrics.rtt.count else None,  # ms
+        "packets_out": metrics.packets_out, "retransmits": metrics.retransmits,
+        "relay": stats.__dict__,
+    }
+
+
+def run_latency(profile: Profile, frame: int = 500) -> dict[str, Any]:
+    """Delivery time of small messages, the next one is sent once the last one arrived or timed out"""
+    sender, receiver = start_server(), start_server()
+    relay = Relay(address(receiver), profile.forward, profile.backward, SEED)
+    arrived = threading.Event()
+    receiver.on_message = lambda data, addr: arrived.set()
+    latencies: list[float] = []
+    try:
+        for index in range(MESSAGES):
+            arrived.clear()
+            start = time.perf_counter()
+            sender.send_message(f"ping {index}", *relay.address, frame)
+            if arrived.wait(MESSAGE_TIMEOUT):
+                latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        sender.close()
+        receiver.close()
+        relay.close()
+    return {
+        "profile": profile.name, "sent": MESSAGES, "delivered": len(latencies),
+        "median": statistics.median(latencies) if latencies else None,  # ms
+        "p90": percentile(latencies, 0.9) if latencies else None,  # ms
+        "max": max(latencies) if latencies else None,  # ms
+    }
+
+
+def sweep(profiles: list[Profile], windows: tuple[int, ...], frames: tuple[int, ...], sizes: tuple[int, ...],
+          timeout: float) -> dict[str, Any]:
+    report: dict[str, Any] = {
+        "commit": git_commit(), "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(), "seed": SEED,
+        "profiles": {profile.name: {"forward": profile.forward.to_dict(), "backward": profile.backward.to_dict()}
+                     for profile in profiles},
+        "transfers": [], "latency": [],
+    }
+    for profile in profiles:
+        latency = run_latency(profile)
+        report["latency"].append(latency)
+        print(f"{profile.name:<10} latency  median {format_value(latency['median'], 'ms')}  "
+              f"p90 {format_value(latency['p90'], 'ms')}  {latency['delivered']}/{latency['sent']}", flush=True)
+        for size in sizes:
+            for window in windows:
+                for frame in frames:
+                    if not check_values(window, frame, size) or not fits(profile, frame):
+                        continue
+                    case = run_case(profile, window, frame, size, timeout)
+                    report["transfers"].append(case)
+                    print(f"{profile.name:<10} window {window:>3}  frame {frame:>4}  size {size:>9}  "
+                          f"{format_value(case['throughput'], 'MB/s')}  retransmits {case['retransmits']}", flush=True)
+    return report
+
+
+def fits(profile: Profile, frame: int) -> bool:
+    """Frame gets through the MTU of the relay, automatic frames find it"""
+    return frame == 0 or all(impairment.mtu == 0 or frame + HEADER_SIZE <= impairment.mtu
+                             for impairment in (profile.forward, profile.backward))
+
+
+def format_value(value: float | None, unit: str) -> str:
+    return "failed" if value is None else f"{value:8.2f} {unit}"
+
+
+def compare(base: dict[str, Any], new: dict[str, Any], threshold: float) -> bool:
+    """Print the changes between two reports, return whether there is no regression"""
+    passed = True
+    print(f"{base.get('commit')} -> {new.get('commit')}")
+    transfers = {(case["profile"], case["window"], case["frame"], case["size"]): case for case in base["transfers"]}
+    for case in new["transfers"]:
+        key = (case["profile"], case["window"], case["frame"], case["size"])
+        if key not in transfers:
+            continue
+        old, speed = transfers[key]["throughput"], case["throughput"]
+        if old is None or speed is None:
+            regressed = old is not None
+            change = "finished" if speed is not None else "failed"
+        else:
+            regressed = speed < old * (1 - threshold)
+            change = f"{(speed / old - 1) * 100:+7.1f} %"
+        passed &= not regressed
+        print(f"{'!' if regressed else ' '} {key[0]:<10} window {key[1]:>3}  frame {key[2]:>4}  size {key[3]:>9}  "
+              f"{format_value(old, 'MB/s')} -> {format_value(speed, 'MB/s')}  {change}")
+    latencies = {case["profile"]: case for case in base["latency"]}
+    for case in new["latency"]:
+        old = latencies.get(case["profile"], {}).get("median")
+        if old is None or case["median"] is None:
+            continue
+        regressed = case["median"] > old * (1 + threshold) + LATENCY_SLACK
+        passed &= not regressed
+        print(f"{'!' if regressed else ' '} {case['profile']:<10} latency  "
+              f"{format_value(old, 'ms')} -> {format_value(case['median'], 'ms')}  {(case['median'] / old - 1) * 100:+7.1f} %")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", nargs="?", help="path of the JSON report")
+    parser.add_argument("--quick", action="store_true", help="one case per profile, for a check before a commit")
+    parser.add_argument("--profiles", help=f"comma separated, of {', '.join(PROFILES)}")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="seconds a transfer may take")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two reports")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as base_file, open(args.compare[1]) as new_file:
+            sys.exit(0 if compare(json.load(base_file), json.load(new_file), args.threshold) else 1)
+
+    if args.profiles:
+        names = args.profiles.split(",")
+    else:
+        names = list(QUICK_PROFILES if args.quick else PROFILES)
+    unknown = [name for name in names if name not in PROFILES]
+    if unknown:
+        parser.error(f"unknown profiles: {', '.join(unknown)}")
+    # Report is written after the change into the work directory
+    output = os.path.abspath(args.output or f"sweep-{git_commit() or 'unknown'}.json")
+    quiet()
+    work_dir()
+    if args.quick:
+        result = sweep([PROFILES[name] for name in names], QUICK_WINDOWS, QUICK_FRAMES, QUICK_FILE_SIZES,
+                       args.timeout)
+    else:
+        result = sweep([PROFILES[name] for name in names], WINDOWS, FRAMES, FILE_SIZES, args.timeout)
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"Report saved to {output}")
@@ -0,0 +1,62 @@
+"""Sends to a peer that never answers have to fail instead of waiting forever
+
+The port of a closed socket gets the open requests, after `SENDER_KEEPALIVE_TIMEOUT` the awaited
+message and file resolve as failed and the connection is removed. Exits with 1 when a check fails.
+"""
+import asyncio
+import socket
+import sys
+import time
+
+from common import quiet, work_dir, make_file
+from asyncServer import AsyncServer
+from connection import SENDER_KEEPALIVE_TIMEOUT
+
+TIMEOUT = SENDER_KEEPALIVE_TIMEOUT / 1000 + 10  # s
+
+
+def closed_port() -> int:
+    """Port nobody listens on"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+async def run(path: str) -> list[str]:
+    """Return the failed checks"""
+    failed: list[str] = []
+    port = closed_port()
+    async with await AsyncServer.create("127.0.0.1") as sender:
+        start = time.perf_counter()
+        try:
+            if await asyncio.wait_for(sender.send_message("ping", "127.0.0.1", port), TIMEOUT):
+                failed.append("message to the closed port succeeded")
+        except asyncio.TimeoutError:
+            failed.append("message to the closed port did not resolve")
+        print(f"message resolved in {time.perf_counter() - start:.1f} s")
+
+        start = time.perf_counter()
+        try:
+            stats = await asyncio.wait_for(sender.send_file(path, "127.0.0.1", port, 8, 1000), TIMEOUT)
+            if stats.succeeded:
+                failed.append("file to the closed port succeeded")
+        except asyncio.TimeoutError:
+            failed.append("file to the closed port did not resolve")
+        print(f"file resolved in {time.perf_counter() - start:.1f} s")
+
+        # Connection is removed by the next run of the loop
+        await asyncio.sleep(0.1)
+        if sender.connections:
+            failed.append("connection to the closed port was not removed")
+    return failed
+
+
+if __name__ == "__main__":
+    quiet()
+    work_dir()
+    failures = asyncio.run(run(make_file(64 * 1024)))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,85 @@
+"""Aggregate receive throughput of a sharded server with 1..N worker processes
+
+The same amount of peers, each in its own process, sends one file at once to the pool.
+Peers use consecutive ports, so they are spread evenly over the workers. Run with the
+maximal amount of workers as an argument: `python bench/workers.py 4`, default is the amount of cores.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from common import quiet, work_dir, make_file
+from services import log
+from MainServer import Server
+from workerPool import WorkerPool
+
+FILE_SIZE = 32 * 1024 * 1024
+TIMEOUT = 300  # s
+
+
+class SentWatcher(logging.Handler):
+    """Reports the time the peer's file was confirmed"""
+
+    def __init__(self, done: multiprocessing.Queue) -> None:
+        super().__init__(logging.CRITICAL)
+        self.done = done
+
+    def emit(self, record: logging.LogRecord):
+        if "File sent successfully" in record.getMessage():
+            self.done.put(time.monotonic())
+
+
+def peer(port: int, destination: tuple[str, int], path: str, go, done: multiprocessing.Queue):
+    quiet(logging.CRITICAL)
+    log.propagate = False
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(SentWatcher(done))
+    server = Server("127.0.0.1", port)
+    go.wait()
+    server.send_file(path, *destination, 64, 1000, 64)
+    server.start()
+
+
+def measure(workers: int, peers: int, paths: list[str]) -> float | None:
+    """Throughput of all peers together in MB/s"""
+    pool = WorkerPool("127.0.0.1", 0, workers)
+    base = random.randrange(20000, 60000 - peers)
+    go = multiprocessing.Event()
+    done: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=peer, args=(base + i, pool.address, paths[i], go, done), daemon=True)
+                 for i in range(peers)]
+    for process in processes:
+        process.start()
+    time.sleep(0.5)
+    start = time.monotonic()
+    go.set()
+    finished = []
+    try:
+        for _ in range(peers):
+            finished.append(done.get(timeout=TIMEOUT))
+    except Exception:
+        pass
+    for process in processes:
+        process.terminate()
+    pool.close()
+    pool.start()
+    if len(finished) < peers:
+        return None
+    return peers * FILE_SIZE / (max(finished) - start) / 1e6
+
+
+if __name__ == "__main__":
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1
+    quiet()
+    work_dir()
+    paths = [make_file(FILE_SIZE, f"peer-{i}.bin") for i in range(max_workers)]
+    print(f"{max_workers} peers, {FILE_SIZE // 1024 // 1024} MiB each, {os.cpu_count()} cores")
+    workers = 1
+    while workers <= max_workers:
+        speed = measure(workers, max_workers, paths)
+        print(f"{workers:>3} workers: " + ("failed" if speed is None else f"{speed:8.2f} MB/s"))
+        workers *= 2
@@ -1,92 +1,271 @@
 import socket
 import selectors
 
+from collections import deque
+from concurrent.futures import Future
 from random import randint
-from tempfile import NamedTemporaryFile
-from typing import Any
+from threading import get_ident
+from typing import Any, Callable
 from connection import Conn
+from datagramReceiver import DatagramReceiver
+from datagramSender import DatagramSender
+from ioPool import IoPool, IO_THREADS
+from metrics import Metrics, MetricsServer
+from sendFile import READ_AHEAD_WINDOWS
 from packetParser import MRP
-from services import log
+from scheduler import Priority
+from services import log, time_ms
+from timerQueue import TimerQueue
 
 
 class Server:
-    def __init__(self, host: str | None = None, port: int = 0, error_rate: int = 0):
+    def __init__(self, host: str | None = None, port: int = 0, error_rate: int = 0, congestion: str = "reno",
+                 reuse_port: bool = False, io_threads: int = IO_THREADS, read_ahead: int = READ_AHEAD_WINDOWS,
+                 metrics_port: int | None = None):
         self.connections: dict[str, Conn] = {}
+        self.timers = TimerQueue()
         self.port: int = port
         self.host: str | None = host
         self.error_rate = error_rate
+        self.congestion: str = congestion
+        """Congestion control algorithm of new connections, see `congestion.CONGESTION_CONTROLLERS`"""
+        self.read_ahead: int = read_ahead
+        """Windows of a sent file read from the disk ahead of sending"""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            # Workers of a `WorkerPool` bind the same port, the kernel picks the worker of every datagram
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind((host, port))
         self.socket.setblocking(False)
+        self.receiver = DatagramReceiver(self.socket)
+        self.sender = DatagramSender(self.socket)
         self.selector = selectors.DefaultSelector()
         self.selector.register(self.socket, selectors.EVENT_READ, data=None)
+        # Pair of sockets used to wake up the loop blocked in select from another thread
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.selector.register(
+            self._wakeup_recv, selectors.EVENT_READ, data=None)
+        self._is_running = False
+        self._loop_thread: int | None = None
+        self._pending: deque[tuple[Callable[..., Any], tuple[Any, ...]]] = deque()
+        self.io: IoPool | None = IoPool(self.call_soon, io_threads) if io_threads > 0 else None
+        """Disk reads, writes and hashing of all transfers run in this pool, without it in the loop"""
+        self.on_message: Callable[[bytes, tuple[str, int]], None] | None = None
+        """Called in the loop thread with the data and the address of every received message, default prints it"""
+        self.closed_metrics = Metrics()
+        """Metrics of the removed connections"""
+        self.metrics_server: MetricsServer | None = None
+        if metrics_port is not None:
+            # Local only, the metrics name the peers
+            self.metrics_server = MetricsServer(self.get_metrics, "127.0.0.1", metrics_port)
 
         log.critical(f"Server started on {self.socket.getsockname()}\n")
 
     def start(self):
-        while True:
+        self._is_running = True
+        self._loop_thread = get_ident()
+        while self._is_running:
+            # Send everything queued by the previous iteration before blocking
+            self.sender.flush()
+
+            # Run connections only when some of their timers expired
+            deadline = self.timers.next_deadline()
+            now = time_ms()
+            if deadline is not None and deadline <= now:
+                self.timers.run_expired(now)
+                continue
+
+            # Block until the next packet or the earliest timer
+            timeout = None if deadline is None else (deadline - now) / 1000
             try:
-                events: Any = self.selector.select(timeout=0)
-            except ValueError:
+                events: Any = self.selector.select(timeout=timeout)
+            except (ValueError, OSError):
                 events = []
             for key, _ in events:
+                if key.fileobj is self._wakeup_recv:
+                    self.handle_wakeup()
+                    continue
                 try:
-                    data, (ip, port) = key.fileobj.recvfrom(1500)
-                    # Broke packet if error rate is set
-                    # if self.error_rate > 0 and randint(0, self.error_rate) == 0:
-                    #     data = MRP.broke_packet(data)
-                    packet = MRP.deserialize(data)
-                    self.dispatch_packet(packet, ip, port)
+                    datagrams = self.receiver.receive()
                 except IOError:
-                    pass
+                    continue
+                for data, (ip, port) in datagrams:
+                    # Broke packet if error rate is set
+                    if self.error_rate > 0 and randint(0, self.error_rate) == 0:
+                        data = MRP.broke_packet(data)
+                    # Drop corrupted packets, the receiver reports them as lost
+                    if not MRP.check_checksum(data):
+                        continue
+                    try:
+                        packet = MRP.deserialize(data)
+                        self.dispatch_packet(packet, ip, port)
+                    except IOError:
+                        pass
+
+    def wakeup(self):
+        """Interrupt the select in `start` to recalculate timers"""
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def handle_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(1024):
+                pass
+        except (BlockingIOError, OSError):
+            pass
 
-            self.run_connections()
+        while self._pending:
+            callback, args = self._pending.popleft()
+            callback(*args)
 
-    def run_connections(self):
-        delete_connections: list[Conn] = []
-        for connection in self.connections.values():
-            if not connection.run():
-                delete_connections.append(connection)
+    def call_soon(self, callback: Callable[..., Any], *args: Any):
+        """Run `callback` inside the server loop, can be called from any thread"""
+        if not self._is_running or get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self._pending.append((callback, args))
+            # Checking the queue length first loses wakeups of threads appending at once, a full
+            # socketpair means the loop is woken anyway
+            self.wakeup()
 
-        for connection in delete_connections:
+    def schedule_connection(self, connection: Conn):
+        """Register the next deadline of the connection in the timer queue
+
+        Timers are only moved to an earlier time, a timer that fires too early
+        (e.g. keepalive after a new packet) is rescheduled in `handle_connection_timer`.
+        """
+        deadline = connection.next_deadline()
+        if deadline is None:
+            self.timers.cancel(connection.timer)
+            connection.timer = None
+        elif connection.timer is None or connection.timer.cancelled or deadline < connection.timer.deadline:
+            self.timers.cancel(connection.timer)
+            connection.timer = self.timers.schedule(
+                deadline, self.handle_connection_timer, connection)
+
+    def handle_io_done(self, connection: Conn):
+        """Run the timer of the connection in this iteration, all jobs done meanwhile share one reschedule"""
+        # Connection could be closed while the job was running
+        if self.connections.get(f"{connection.destination[0]}:{connection.destination[1]}") is not connection:
+            return
+        now = time_ms()
+        if connection.timer is None or connection.timer.cancelled or connection.timer.deadline > now:
+            self.timers.cancel(connection.timer)
+            connection.timer = self.timers.schedule(now, self.handle_connection_timer, connection)
+
+    def handle_connection_timer(self, connection: Conn):
+        connection.timer = None
+        deadline = connection.next_deadline()
+        if deadline is not None and deadline <= time_ms() and not connection.run():
             connection.close()
+            self.closed_metrics.merge(connection.metrics)
             del self.connections[f"{connection.destination[0]}:{connection.destination[1]}"]
+            return
 
-    def send_file(self, file_path: str, ip: str, port: int, window_len: int = 64, frame_len: int = 500):
-        if self.connections.get(f"{ip}:{port}", None) is None:
-            self.connections[f"{ip}:{port}"] = Conn(
-                self.socket, ip, port, window_len, frame_len)
+        self.schedule_connection(connection)
 
-        self.connections[f"{ip}:{port}"].send_file(
-            file_path, frame_len, window_len)
+    def send_file(self, file_path: str, ip: str, port: int, window_len: int = 64, frame_len: int | None = None,
+                  max_in_flight: int | None = None, chunked: bool = False, resumable: bool = False,
+                  priority: Priority = Priority.Normal):
+        """Send file to ip:port, `max_in_flight` packets enables sliding window instead of window by window
 
-    def send_message(self, msg: str, ip: str, port: int, window_len: int = 64, frame_len: int = 500):
-        # Create file with message
-        temp_file = NamedTemporaryFile(mode="w+", suffix=".msg", delete=False)
-        temp_file.write(msg)
-        temp_file.close()
-        log.warn(f"{temp_file.name} created\n")
-        self.send_file(temp_file.name, ip, port, window_len, frame_len)
+        `chunked` sends hashes of the file chunks, so the receiver verifies and repairs every chunk separately.
+        `resumable` lets the receiver keep the partial file of a failed transfer and continue it on the next send.
+        `priority` class of the transfer, a higher class is sent first, transfers of one class share the bandwidth.
+        Without `frame_len` the fragments fill the largest datagram that gets to the peer unfragmented.
+        """
+        self.call_soon(self._send_file, file_path, ip, port, window_len, frame_len, max_in_flight, chunked,
+                       resumable, priority)
 
-    def dispatch_packet(self, packet: MRP, ip: str, port: int):
+    def _send_file(self, file_path: str, ip: str, port: int, window_len: int, frame_len: int | None,
+                   max_in_flight: int | None, chunked: bool, resumable: bool, priority: Priority):
+        connection = self.get_connection(ip, port, window_len, frame_len)
+        connection.send_file(file_path, frame_len, window_len, max_in_flight, chunked, resumable, priority)
+        self.schedule_connection(connection)
+
+    def send_message(self, msg: str | bytes, ip: str, port: int, frame_len: int = 500,
+                     priority: Priority = Priority.High):
+        """Send message to ip:port straight from memory, by default it goes out before the data of files
+
+        The receiver passes it to its `on_message`, messages up to 256 fragments are supported.
+        """
+        data = msg.encode("utf-8") if isinstance(msg, str) else msg
+        self.call_soon(self._send_message, data, ip, port, frame_len, priority)
+
+    def _send_message(self, data: bytes, ip: str, port: int, frame_len: int, priority: Priority):
+        connection = self.get_connection(ip, port, 64, frame_len)
+        try:
+            connection.send_message(data, frame_len, priority)
+        except ValueError as e:
+            log.error(f"Error sending message: {e}\n")
+        self.schedule_connection(connection)
+
+    def handle_message(self, data: bytes, address: tuple[str, int]):
+        if self.on_message is not None:
+            self.on_message(data, address)
+        else:
+            log.critical(f"{address[0]}:{address[1]}<<<< {data.decode('utf-8', errors='replace')}\n")
+
+    def get_metrics(self, timeout: float = 5) -> dict[str, Any]:
+        """Snapshot of the metrics, can be called from any thread
+
+        `{"connections": {"ip:port": {"metrics": Metrics, "sending": {id: Metrics}, "receiving": {id: Metrics}}},
+        "closed": Metrics}`,
+        the metrics of a connection include its transfers, `metrics.to_json` makes it serializable.
+        """
+        result: Future = Future()
+        self.call_soon(self._get_metrics, result)
+        return result.result(timeout)
+
+    def _get_metrics(self, result: Future):
+        result.set_result({"connections": {peer: connection.get_metrics() for peer, connection in self.connections.items()},
+                           "closed": self.closed_metrics.copy()})
+
+    def get_connection(self, ip: str, port: int, window_len: int, frame_len: int | None) -> Conn:
         if self.connections.get(f"{ip}:{port}", None) is None:
             self.connections[f"{ip}:{port}"] = Conn(
-                self.socket, ip, port, 16, 2)
+                self.socket, self.sender, ip, port, window_len, frame_len, self.congestion, self.handle_message,
+                self.io, self.handle_io_done, self.read_ahead)
+        return self.connections[f"{ip}:{port}"]
 
-        self.connections[f"{ip}:{port}"].add_packet(packet)
+    def dispatch_packet(self, packet: MRP, ip: str, port: int):
+        connection = self.get_connection(ip, port, 16, 2)
+        connection.add_packet(packet)
+        self.schedule_connection(connection)
 
     def close(self):
+        self.call_soon(self._close)
+
+    def _close(self):
         # TODO: Close all connections before closing server
 
+        if self.metrics_server is not None:
+            self.metrics_server.close()
         for _, connection in self.connections.items():
             connection.kill()
+            self.timers.cancel(connection.timer)
 
+        self._is_running = False
+        self.sender.flush()
+        if self.io is not None:
+            # Files of the killed transfers are closed by their last jobs
+            self.io.shutdown()
         log.critical(f"Server closed\n")
         self.socket.close()
         self.selector.close()
-        self._is_running = False
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
 
     def close_connection(self, ip: str, port: int):
+        self.call_soon(self._close_connection, ip, port)
+
+    def _close_connection(self, ip: str, port: int):
         if self.connections.get(f"{ip}:{port}", None) is not None:
             self.connections[f"{ip}:{port}"].kill()
+            self.timers.cancel(self.connections[f"{ip}:{port}"].timer)
+            self.closed_metrics.merge(self.connections[f"{ip}:{port}"].metrics)
             del self.connections[f"{ip}:{port}"]
@@ -0,0 +1,276 @@
+import asyncio
+import socket
+
+from concurrent.futures import Future
+from time import time
+from typing import Any, AsyncIterator, Callable
+from connection import Conn
+from datagramReceiver import DatagramReceiver
+from datagramSender import DatagramSender
+from ioPool import IoPool, IO_THREADS
+from metrics import Metrics, MetricsServer
+from message import SendMessage, ReceiveMessage
+from packetParser import MRP
+from receiveFile import ReceiveFile
+from scheduler import Priority
+from sendFile import SendFile, READ_AHEAD_WINDOWS
+from services import log, time_ms
+from transferStats import TransferStats
+
+
+class AsyncServer(asyncio.DatagramProtocol):
+    """Server driven by an asyncio loop instead of its own thread
+
+    Packets come through a datagram transport, the ones queued behind them are drained with `DatagramReceiver`.
+    Deadlines of the connections are timers of the loop and the disk jobs report back with
+    `call_soon_threadsafe`, so the server never polls.
+    Create it with `await AsyncServer.create(...)`, the methods must be called from the loop.
+    Received files and messages are queued until they are iterated with `files` and `messages`.
+    """
+
+    def __init__(self, sock: socket.socket, congestion: str = "reno", io_threads: int = IO_THREADS,
+                 read_ahead: int = READ_AHEAD_WINDOWS, metrics_port: int | None = None) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.socket = sock
+        self.congestion: str = congestion
+        """Congestion control algorithm of new connections, see `congestion.CONGESTION_CONTROLLERS`"""
+        self.read_ahead: int = read_ahead
+        self.connections: dict[str, Conn] = {}
+        self.timers: dict[Conn, tuple[int, asyncio.TimerHandle]] = {}
+        """Deadline and loop timer of the next `run` of every connection that has one"""
+        self.receiver = DatagramReceiver(sock)
+        self.sender = DatagramSender(sock)
+        self._flush_scheduled: bool = False
+        self.io: IoPool | None = IoPool(self.loop.call_soon_threadsafe, io_threads) if io_threads > 0 else None
+        self.transport: asyncio.DatagramTransport | None = None
+        self.sending: dict[SendFile | SendMessage, asyncio.Future] = {}
+        """Futures of the awaited transfers, resolved when the transfer ends"""
+        self.received_files: asyncio.Queue[TransferStats | None] = asyncio.Queue()
+        self.received_messages: asyncio.Queue[tuple[bytes, tuple[str, int]] | None] = asyncio.Queue()
+        self.closed: bool = False
+        self.closed_metrics = Metrics()
+        """Metrics of the removed connections"""
+        self.metrics_server: MetricsServer | None = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(self.get_metrics_threadsafe, "127.0.0.1", metrics_port)
+
+    @classmethod
+    async def create(cls, host: str | None = None, port: int = 0, congestion: str = "reno",
+                     io_threads: int = IO_THREADS, read_ahead: int = READ_AHEAD_WINDOWS,
+                     metrics_port: int | None = None) -> "AsyncServer":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        sock.setblocking(False)
+        server = cls(sock, congestion, io_threads, read_ahead, metrics_port)
+        await server.loop.create_datagram_endpoint(lambda: server, sock=sock)
+        log.critical(f"Server started on {sock.getsockname()}\n")
+        return server
+
+    async def __aenter__(self) -> "AsyncServer":
+        return self
+
+    async def __aexit__(self, *exc: Any):
+        await self.aclose()
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        self.transport = transport  # type: ignore[assignment]
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]):
+        if self.closed:
+            return
+        self.handle_datagram(data, addr)
+        # Transport reads one datagram per loop iteration, the rest of the queue is drained in one batch
+        try:
+            datagrams = self.receiver.receive()
+        except OSError:
+            datagrams = []
+        for data, addr in datagrams:
+            self.handle_datagram(data, addr)
+        self.flush_soon()
+
+    def handle_datagram(self, data: bytes | memoryview, addr: tuple[str, int]):
+        # Drop corrupted packets, the receiver reports them as lost
+        if not MRP.check_checksum(data):
+            return
+        try:
+            packet = MRP.deserialize(data)
+            connection = self.get_connection(addr[0], addr[1], 16, 2)
+            connection.add_packet(packet)
+        except IOError:
+            return
+        self.schedule_connection(connection)
+
+    def error_received(self, exc: Exception):
+        log.debug(f"Socket error: {exc}\n")
+
+    def connection_lost(self, exc: Exception | None):
+        if not self.closed:
+            self.close()
+
+    def flush_soon(self):
+        """Send the queued datagrams once the callbacks of this loop iteration are done"""
+        if not self._flush_scheduled and not self.closed:
+            self._flush_scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        if not self.closed:
+            self.sender.flush()
+
+    def call_at(self, deadline: int, callback: Callable[..., Any], *args: Any) -> asyncio.TimerHandle:
+        """Run `callback` at the `time_ms` deadline on the loop clock"""
+        return self.loop.call_at(self.loop.time() + deadline / 1000 - time(), callback, *args)
+
+    def schedule_connection(self, connection: Conn):
+        """Register the next deadline of the connection as a loop timer, see `Server.schedule_connection`"""
+        deadline = connection.next_deadline()
+        timer = self.timers.get(connection)
+        if deadline is None:
+            if timer is not None:
+                timer[1].cancel()
+                del self.timers[connection]
+        elif timer is None or deadline < timer[0]:
+            if timer is not None:
+                timer[1].cancel()
+            self.timers[connection] = (deadline, self.call_at(deadline, self.handle_connection_timer, connection))
+
+    def handle_io_done(self, connection: Conn):
+        """Run the connection in this iteration, all jobs done meanwhile share one run"""
+        if self.connections.get(f"{connection.destination[0]}:{connection.destination[1]}") is not connection:
+            return
+        now = time_ms()
+        timer = self.timers.get(connection)
+        if timer is None or timer[0] > now:
+            if timer is not None:
+                timer[1].cancel()
+            self.timers[connection] = (now, self.call_at(now, self.handle_connection_timer, connection))
+
+    def handle_connection_timer(self, connection: Conn):
+        self.timers.pop(connection, None)
+        deadline = connection.next_deadline()
+        if deadline is not None and deadline <= time_ms() and not connection.run():
+            connection.close()
+            self.closed_metrics.merge(connection.metrics)
+            del self.connections[f"{connection.destination[0]}:{connection.destination[1]}"]
+        else:
+            self.schedule_connection(connection)
+        self.flush_soon()
+
+    def handle_transfer_end(self, connection: Conn, transfer: ReceiveFile | SendFile | SendMessage | ReceiveMessage):
+        if isinstance(transfer, ReceiveFile):
+            if transfer.inited:
+                self.received_files.put_nowait(transfer.stats())
+            return
+        if isinstance(transfer, ReceiveMessage):
+            return
+        future = self.sending.pop(transfer, None)
+        if future is not None and not future.done():
+            future.set_result(transfer.stats() if isinstance(transfer, SendFile) else transfer.succeeded)
+
+    def handle_message(self, data: bytes, address: tuple[str, int]):
+        self.received_messages.put_nowait((data, address))
+
+    async def send_file(self, file_path: str, ip: str, port: int, window_len: int = 64, frame_len: int | None = None,
+                        max_in_flight: int | None = None, chunked: bool = False, resumable: bool = False,
+                        priority: Priority = Priority.Normal) -> TransferStats:
+        """Send file to ip:port and wait until it is confirmed or fails, see `Server.send_file`"""
+        connection = self.get_connection(ip, port, window_len, frame_len)
+        transfer = connection.send_file(file_path, frame_len, window_len, max_in_flight, chunked, resumable, priority)
+        if transfer is None:
+            raise ConnectionError(f"No free id for transfer to {ip}:{port}")
+        return await self.wait_transfer(connection, transfer)
+
+    async def send_message(self, msg: str | bytes, ip: str, port: int, frame_len: int = 500,
+                           priority: Priority = Priority.High) -> bool:
+        """Send message to ip:port, return whether the receiver confirmed it, see `Server.send_message`"""
+        data = msg.encode("utf-8") if isinstance(msg, str) else msg
+        connection = self.get_connection(ip, port, 64, frame_len)
+        transfer = connection.send_message(data, frame_len, priority)
+        if transfer is None:
+            raise ConnectionError(f"No free id for message to {ip}:{port}")
+        return await self.wait_transfer(connection, transfer)
+
+    async def wait_transfer(self, connection: Conn, transfer: SendFile | SendMessage) -> Any:
+        future = self.loop.create_future()
+        self.sending[transfer] = future
+        self.schedule_connection(connection)
+        self.flush_soon()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Transfer stops with the task waiting for it
+            self.sending.pop(transfer, None)
+            transfer.close()
+            self.schedule_connection(connection)
+            raise
+
+    async def files(self) -> AsyncIterator[TransferStats]:
+        """Iterate over received files, failed ones included, until the server is closed"""
+        while (stats := await self.received_files.get()) is not None:
+            yield stats
+
+    async def messages(self) -> AsyncIterator[tuple[bytes, tuple[str, int]]]:
+        """Iterate over the data and the address of received messages until the server is closed"""
+        while (message := await self.received_messages.get()) is not None:
+            yield message
+
+    def get_metrics(self) -> dict[str, Any]:
+        """Snapshot of the metrics, see `Server.get_metrics`"""
+        return {"connections": {peer: connection.get_metrics() for peer, connection in self.connections.items()},
+                "closed": self.closed_metrics.copy()}
+
+    def get_metrics_threadsafe(self, timeout: float = 5) -> dict[str, Any]:
+        """`get_metrics` for other threads, it runs in the loop"""
+        result: Future = Future()
+        self.loop.call_soon_threadsafe(lambda: result.set_result(self.get_metrics()))
+        return result.result(timeout)
+
+    def get_connection(self, ip: str, port: int, window_len: int, frame_len: int | None) -> Conn:
+        if self.connections.get(f"{ip}:{port}", None) is None:
+            self.connections[f"{ip}:{port}"] = Conn(
+                self.socket, self.sender, ip, port, window_len, frame_len, self.congestion, self.handle_message,
+                self.io, self.handle_io_done, self.read_ahead, self.handle_transfer_end)
+        return self.connections[f"{ip}:{port}"]
+
+    def close_connection(self, ip: str, port: int):
+        connection = self.connections.pop(f"{ip}:{port}", None)
+        if connection is not None:
+            connection.kill()
+            self.closed_metrics.merge(connection.metrics)
+            timer = self.timers.pop(connection, None)
+            if timer is not None:
+                timer[1].cancel()
+            self.flush_soon()
+
+    def close(self):
+        """Close without waiting, the queued disk jobs finish in the pool afterwards, `aclose` waits for them"""
+        if self.closed:
+            return
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        for connection in self.connections.values():
+            connection.kill()
+        for _, timer in self.timers.values():
+            timer.cancel()
+        self.connections.clear()
+        self.timers.clear()
+        self.sender.flush()
+        self.closed = True
+        if self.io is not None:
+            # Files of the killed transfers are closed by their last jobs
+            self.io.shutdown(wait=False)
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.socket.close()
+        self.received_files.put_nowait(None)
+        self.received_messages.put_nowait(None)
+        log.critical(f"Server closed\n")
+
+    async def aclose(self):
+        """Close and wait until the disk jobs are done, the shutdown is awaited so other coroutines keep running"""
+        io = self.io
+        self.close()
+        if io is not None:
+            await self.loop.run_in_executor(None, io.shutdown)
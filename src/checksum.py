@@ -0,0 +1,58 @@
+from enum import IntEnum
+from zlib import crc32
+
+try:
+    # Hardware accelerated (SSE 4.2 / ARMv8) CRC32C
+    from crc32c import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+CRC32C_POLYNOMIAL: int = 0x82F63B78
+"""Castagnoli polynomial, reversed"""
+
+
+class ChecksumKind(IntEnum):
+    """Checksum algorithm, written to the low 4 bits of the packet version byte"""
+    Crc32 = 1
+    Crc32c = 2
+
+
+def make_table(polynomial: int) -> list[int]:
+    table: list[int] = []
+    for byte in range(256):
+        value = byte
+        for _ in range(8):
+            value = (value >> 1) ^ polynomial if value & 1 else value >> 1
+        table.append(value)
+    return table
+
+
+CRC32C_TABLE: list[int] = make_table(CRC32C_POLYNOMIAL)
+
+
+def crc32c_table(data: bytes | memoryview, value: int = 0) -> int:
+    """Table driven CRC32C, used only when the `crc32c` module is not installed"""
+    table = CRC32C_TABLE
+    crc = value ^ 0xFFFFFFFF
+    for byte in bytes(data):
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+crc32c = _crc32c if _crc32c is not None else crc32c_table
+
+CHECKSUMS = {
+    ChecksumKind.Crc32: crc32,
+    ChecksumKind.Crc32c: crc32c,
+}
+"""Checksum function by kind, all take the data and the running value"""
+
+DEFAULT_CHECKSUM: int = ChecksumKind.Crc32c if _crc32c is not None else ChecksumKind.Crc32
+"""Checksum senders put on the wire, CRC-32 of zlib unless the `crc32c` module is installed
+
+The `crc32c` module is an optional third party package and this repository installs no dependencies,
+so the default on the wire is CRC-32, not CRC32C. Both are 32 bit CRCs that catch every burst of up to
+32 bits, CRC32C is chosen for its speed with hardware support, but its table driven fallback in Python
+costs ~210 s/GB against ~0.7 s/GB of zlib. Receivers verify both kinds, so peers with and without
+the module work together.
+"""
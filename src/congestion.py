@@ -0,0 +1,236 @@
+from math import inf
+
+from rttEstimator import RttEstimator
+
+INITIAL_CWND: int = 10  # packets
+MIN_CWND: int = 2  # packets
+PACING_BURST: int = 1  # ms
+"""Amount of sending time the pacer may catch up at once"""
+RENO_SLOW_START_GAIN: float = 2
+RENO_AVOIDANCE_GAIN: float = 1.2
+BBR_STARTUP_GAIN: float = 2.89
+BBR_PROBE_GAINS: tuple[float, ...] = (1.25, 0.75, 1, 1, 1, 1, 1, 1)
+BBR_BANDWIDTH_ROUNDS: int = 10
+BBR_MIN_RTT_WINDOW: int = 10000  # ms
+BBR_MIN_ROUND: int = 10  # ms
+"""Shortest delivery rate sample, confirms of whole windows make shorter samples too noisy"""
+
+
+class Pacer:
+    """Spreads packets over time so that at most `rate` bytes per ms are sent"""
+
+    def __init__(self) -> None:
+        self.next_send_time: float = 0  # ms
+
+    def can_send(self, now: int) -> bool:
+        return self.next_send_time <= now
+
+    def on_sent(self, size: int, rate: float, now: int):
+        if rate == inf:
+            return
+        self.next_send_time = max(self.next_send_time, now - PACING_BURST) + size / rate
+
+
+class CongestionController:
+    """Base of the congestion controllers, without any limit on cwnd and pacing rate
+
+    Controllers are owned by the connection and shared by its transfers, `cwnd` and
+    `in_flight` are counted in packets, `pacing_rate` in bytes per ms.
+    """
+    name = "none"
+
+    def __init__(self, mss: int, rtt: RttEstimator) -> None:
+        self.mss: int = mss
+        self.rtt = rtt
+        self.cwnd: float = inf
+        self.pacing_rate: float = inf
+        self.in_flight: int = 0
+        self.pacer = Pacer()
+        self.delivered: int = 0  # packets
+        self.lost: int = 0  # packets
+        self.timeouts: int = 0
+
+    def can_send(self, now: int, min_cwnd: int = 0) -> bool:
+        """Check the congestion window, never limited below `min_cwnd`, and the pacer"""
+        return self.in_flight < max(self.cwnd, min_cwnd) and self.pacer.can_send(now)
+
+    def on_sent(self, size: int, now: int, retransmit: bool = False):
+        if not retransmit:
+            self.in_flight += 1
+            if size > self.mss:
+                self.mss = size
+                self.update_control()
+        self.pacer.on_sent(size, self.pacing_rate, now)
+
+    def on_ack(self, packets: int, now: int):
+        self.in_flight = max(self.in_flight - packets, 0)
+        self.delivered += packets
+
+    def on_loss(self, packets: int, now: int):
+        self.lost += packets
+
+    def on_timeout(self, now: int):
+        self.timeouts += 1
+
+    def update_control(self):
+        """Recalculate cwnd and pacing rate"""
+        pass
+
+    def release(self, packets: int):
+        """Forget packets of a finished transfer that will never be confirmed"""
+        self.in_flight = max(self.in_flight - packets, 0)
+
+    def get_srtt(self) -> float:
+        return max(self.rtt.srtt if self.rtt.srtt is not None else self.rtt.rto, 1)
+
+    def stats(self) -> dict[str, float | int | str]:
+        return {
+            "algorithm": self.name,
+            "cwnd": self.cwnd,
+            "pacing_rate": self.pacing_rate,
+            "in_flight": self.in_flight,
+            "delivered": self.delivered,
+            "lost": self.lost,
+            "timeouts": self.timeouts,
+        }
+
+
+class RenoController(CongestionController):
+    """AIMD: slow start and congestion avoidance, cwnd halved once per RTT on loss"""
+    name = "reno"
+
+    def __init__(self, mss: int, rtt: RttEstimator) -> None:
+        super().__init__(mss, rtt)
+        self.cwnd = INITIAL_CWND
+        self.ssthresh: float = inf
+        self.recovery_end: int = 0  # ms
+        self.update_control()
+
+    def on_ack(self, packets: int, now: int):
+        super().on_ack(packets, now)
+        if self.cwnd < self.ssthresh:
+            self.cwnd += packets
+        else:
+            self.cwnd += packets / self.cwnd
+        self.update_control()
+
+    def on_loss(self, packets: int, now: int):
+        super().on_loss(packets, now)
+        # Only one reduction for losses from the same round trip
+        if now < self.recovery_end:
+            return
+        self.recovery_end = now + int(self.get_srtt())
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+        self.update_control()
+
+    def on_timeout(self, now: int):
+        super().on_timeout(now)
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = MIN_CWND
+        self.update_control()
+
+    def update_control(self):
+        gain = RENO_SLOW_START_GAIN if self.cwnd < self.ssthresh else RENO_AVOIDANCE_GAIN
+        self.pacing_rate = gain * self.cwnd * self.mss / self.get_srtt()
+
+    def stats(self) -> dict[str, float | int | str]:
+        return super().stats() | {"ssthresh": self.ssthresh}
+
+
+class BbrController(CongestionController):
+    """Rate based, paces at the measured bottleneck bandwidth and keeps cwnd near the BDP
+
+    Simplified BBR: startup until bandwidth stops growing, drain, then probe bandwidth
+    with a cycle of pacing gains. Losses don't reduce the rate directly.
+    """
+    name = "bbr"
+
+    def __init__(self, mss: int, rtt: RttEstimator) -> None:
+        super().__init__(mss, rtt)
+        self.cwnd = INITIAL_CWND
+        self.btl_bw: float = 0  # bytes per ms
+        self.bw_samples: list[float] = []
+        self.min_rtt: float = inf  # ms
+        self.min_rtt_time: int = 0  # ms
+        self.mode: str = "startup"
+        self.full_bw: float = 0
+        self.full_bw_rounds: int = 0
+        self.cycle_index: int = 0
+        self.round_start: int = 0  # ms
+        self.round_delivered: int = 0  # packets
+        self.update_control()
+
+    def on_ack(self, packets: int, now: int):
+        super().on_ack(packets, now)
+        if self.rtt.last_sample is not None and (self.rtt.last_sample < self.min_rtt
+                                                 or now - self.min_rtt_time > BBR_MIN_RTT_WINDOW):
+            self.min_rtt = max(self.rtt.last_sample, 1)
+            self.min_rtt_time = now
+
+        # One delivery rate sample per round trip
+        if self.round_start == 0:
+            self.round_start, self.round_delivered = now, self.delivered
+            return
+        elapsed = now - self.round_start
+        if elapsed < max(self.get_srtt(), BBR_MIN_ROUND):
+            return
+        self.add_bandwidth_sample((self.delivered - self.round_delivered) * self.mss / elapsed)
+        self.round_start, self.round_delivered = now, self.delivered
+        self.update_control()
+
+    def add_bandwidth_sample(self, bandwidth: float):
+        self.bw_samples = (self.bw_samples + [bandwidth])[-BBR_BANDWIDTH_ROUNDS:]
+        self.btl_bw = max(self.bw_samples)
+
+        if self.mode == "startup":
+            # Bandwidth stopped growing by 25% for three rounds, the pipe is full
+            if self.btl_bw >= self.full_bw * 1.25:
+                self.full_bw, self.full_bw_rounds = self.btl_bw, 0
+            else:
+                self.full_bw_rounds += 1
+                if self.full_bw_rounds >= 3:
+                    self.mode = "drain"
+        elif self.mode == "drain":
+            if self.in_flight <= self.get_bdp():
+                self.mode = "probe_bw"
+        else:
+            self.cycle_index = (self.cycle_index + 1) % len(BBR_PROBE_GAINS)
+
+    def on_timeout(self, now: int):
+        super().on_timeout(now)
+        self.cwnd = MIN_CWND
+
+    def get_bdp(self) -> float:
+        """Bandwidth delay product in packets"""
+        min_rtt = self.min_rtt if self.min_rtt != inf else self.get_srtt()
+        return self.btl_bw * min_rtt / self.mss
+
+    def update_control(self):
+        if self.btl_bw == 0:
+            self.pacing_rate = BBR_STARTUP_GAIN * self.cwnd * self.mss / self.get_srtt()
+            return
+        if self.mode == "startup":
+            gain = BBR_STARTUP_GAIN
+        elif self.mode == "drain":
+            gain = 1 / BBR_STARTUP_GAIN
+        else:
+            gain = BBR_PROBE_GAINS[self.cycle_index]
+        self.pacing_rate = gain * self.btl_bw
+        self.cwnd = max(2 * self.get_bdp(), INITIAL_CWND)
+
+    def stats(self) -> dict[str, float | int | str]:
+        return super().stats() | {"btl_bw": self.btl_bw, "min_rtt": self.min_rtt, "mode": self.mode}
+
+
+CONGESTION_CONTROLLERS: dict[str, type[CongestionController]] = {
+    CongestionController.name: CongestionController,
+    RenoController.name: RenoController,
+    BbrController.name: BbrController,
+}
+
+
+def create_controller(name: str, mss: int, rtt: RttEstimator) -> CongestionController:
+    if name not in CONGESTION_CONTROLLERS:
+        raise ValueError(f"Unknown congestion control {name}, use one of {list(CONGESTION_CONTROLLERS)}")
+    return CONGESTION_CONTROLLERS[name](mss, rtt)
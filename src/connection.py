@@ -1,13 +1,29 @@
 from enum import Enum
+from functools import partial
+from typing import Any, Callable
 from socket import SocketType
 from services import time_ms, log
-from packetParser import MRP, PacketType
+from packetParser import MRP, PacketType, MAX_TRANSFER_ID, HEADER_SIZE
 from receiveFile import ReceiveFile
-from sendFile import SendFile
+from sendFile import SendFile, READ_AHEAD_WINDOWS
+from message import SendMessage, ReceiveMessage
+from timerQueue import Timer
+from rttEstimator import RttEstimator
+from congestion import create_controller
+from datagramSender import DatagramSender
+from scheduler import TransferScheduler, Priority
+from ioPool import IoPool
+from metrics import Metrics, TRANSFER_COUNTERS
+from pathMtu import PathMtu, BASE_FRAGMENT_LEN, send_unfragmented
 
-ACK_TIMEOUT = 300  # ms
 SENDER_KEEPALIVE_TIMEOUT = 11000  # ms
 RECEIVED_KEEP_ALIVE_TIMEOUT = 21000  # ms
+RECENT_MESSAGES: int = 1024
+"""Ids of the delivered messages remembered, a resent message with a lost confirm is not delivered twice"""
+ANSWER_TYPES: frozenset[PacketType] = frozenset({
+    PacketType.Confirm, PacketType.ConfirmData, PacketType.ConfirmInit_file_transfer, PacketType.ConfirmIntegrity,
+    PacketType.RepairRequest, PacketType.ConfirmMessage})
+"""Packets the receiving side sends back, they belong to a transfer started by this side"""
 
 
 class ConnState(Enum):
@@ -27,21 +43,64 @@ class ConnState(Enum):
 
 
 class Conn:
-    def __init__(self, socket: SocketType, ip: str, port: int, window_size: int, frame_len: int) -> None:
+    def __init__(self, socket: SocketType, sender: DatagramSender, ip: str, port: int, window_size: int, frame_len: int | None,
+                 congestion: str = "reno", on_message: Callable[[bytes, tuple[str, int]], None] | None = None,
+                 io: IoPool | None = None, on_io_done: Callable[["Conn"], None] | None = None,
+                 read_ahead: int = READ_AHEAD_WINDOWS,
+                 on_transfer_end: Callable[["Conn", ReceiveFile | SendFile | SendMessage | ReceiveMessage], None] | None = None
+                 ) -> None:
         self.socket = socket
+        self.sender = sender
+        self.outbox: list[bytes] = []
+        """Datagrams waiting for the next flush of `sender`"""
         self.destination: tuple[str, int] = (ip, port)
         self.state = ConnState.Disconnected
         self.receive_awailable: bool = False
         self.send_awailable: bool = False
         self.window_size: int = window_size
-        self.frame_len: int = frame_len
-        self.transfers: dict[int, ReceiveFile | SendFile] = {}
+        self.frame_len: int = frame_len or BASE_FRAGMENT_LEN
+        self.sending: dict[int, SendFile | SendMessage] = {}
+        """Transfers started by this side by their id"""
+        self.receiving: dict[int, ReceiveFile | ReceiveMessage] = {}
+        """Transfers started by the peer, both sides pick ids on their own, so the same id can be in both"""
+        self.on_message = on_message
+        """Called with the data and the address of every received message"""
+        self.delivered_messages: dict[int, None] = {}
+        """Ids of the last delivered messages in order of delivery"""
+        self.io = io
+        """Thread pool for the disk jobs of the transfers, without it they run in the loop"""
+        self.on_io_done = on_io_done
+        """Called after the result of a disk job was handled, the state of the connection could change"""
+        self.read_ahead: int = read_ahead
+        self.on_transfer_end = on_transfer_end
+        """Called with every transfer once it is finished, failed or closed"""
         self.last_packet_time: int = time_ms()  # ms
-        self.last_transfer_id: int = 0
+        self.last_confirm_time: int = 0  # ms
+        self.last_transfer_id: int = MAX_TRANSFER_ID
+        """Last id given to a sending transfer, ids are handed out in order"""
         self.future_send: bool = False
         self._killed = False
+        self.timer: Timer | None = None
+        """Timer of the next `run`, managed by the server"""
+        self.metrics = Metrics()
+        """Packets of the connection and the counters of its finished transfers"""
+        self.rtt = RttEstimator(self.metrics.rtt)
+        """Round trip time statistics shared by all transfers of the connection"""
+        self.congestion = create_controller(congestion, self.frame_len, self.rtt)
+        """Congestion window and pacing rate shared by all sending transfers"""
+        self.scheduler = TransferScheduler(self.congestion)
+        """Picks the sending transfer whose packet goes out next"""
+        self.path_mtu = PathMtu(self.send_probe, self.rtt, f"{ip}:{port}")
+        """Largest datagram to the peer, searched when the connection opens for sending"""
+        self.open_time: int = 0  # ms
+        self.open_retries: int = 0
         log.critical(f"Connection created with {ip}:{port}\n")
 
+    @property
+    def transfers(self) -> list[ReceiveFile | SendFile | SendMessage | ReceiveMessage]:
+        """Running transfers of both directions"""
+        return [*self.sending.values(), *self.receiving.values()]
+
     def run(self) -> bool:
         if self._killed:
             return False
@@ -56,22 +115,64 @@ class Conn:
             if self.state == ConnState.Wait_Send_awailable or self.state == ConnState.Receive_Wait_Send_awailable:
                 self.handle_wait_send_awailable()
             else:
-                delete_transfers: list[int] = []
-                for transfer in self.transfers.values():
-                    if not transfer.run():
-                        delete_transfers.append(transfer.id)
+                if self.state == ConnState.Wait_Send_Confirm or self.state == ConnState.Receive_Wait_Send_Confirm:
+                    self.handle_wait_send_confirm()
+                self.path_mtu.run()
+
+                for transfers in (self.sending, self.receiving):
+                    delete_transfers: list[int] = [transfer_id for transfer_id, transfer in transfers.items()
+                                                   if not transfer.run()]
+                    for transfer_id in delete_transfers:
+                        self.future_send = False
+                        self.end_transfer(transfers.pop(transfer_id))
 
-                for transfer_id in delete_transfers:
-                    del self.transfers[transfer_id]
-                    self.future_send = False
+                # Continue sending when the pacer allows
+                self.scheduler.run()
 
         return True
 
+    def next_deadline(self) -> int | None:
+        """Return time in ms when `run` has to be called next, `None` if only a packet can change the state"""
+        if self._killed or (self.state == ConnState.Disconnected and not self.future_send):
+            return 0
+
+        keepalive_deadline = self.last_packet_time + SENDER_KEEPALIVE_TIMEOUT + 1
+        if time_ms() >= keepalive_deadline:
+            # Only `handle_timeout` is run after the keepalive timeout
+            if self.state in (ConnState.Send_awailable, ConnState.Send_Receive_awailable,
+                              ConnState.Wait_Send_Confirm, ConnState.Receive_Wait_Send_Confirm):
+                return keepalive_deadline
+            if self.state in (ConnState.Receive_awailable, ConnState.Receive_Wait_Send_awailable):
+                return self.last_packet_time + RECEIVED_KEEP_ALIVE_TIMEOUT + 1
+            return None
+
+        deadline = keepalive_deadline
+        if self.state == ConnState.Wait_Send_awailable or self.state == ConnState.Receive_Wait_Send_awailable:
+            return min(deadline, max(self.last_packet_time, self.last_confirm_time) + self.rtt.get_timeout() + 1)
+        if self.state == ConnState.Wait_Send_Confirm or self.state == ConnState.Receive_Wait_Send_Confirm:
+            deadline = min(deadline, self.open_time +
+                           self.rtt.get_timeout(self.open_retries) + 1)
+        path_mtu_deadline = self.path_mtu.next_deadline()
+        if path_mtu_deadline is not None and path_mtu_deadline < deadline:
+            deadline = path_mtu_deadline
+
+        for transfer in self.transfers:
+            transfer_deadline = transfer.next_deadline()
+            if transfer_deadline is not None and transfer_deadline < deadline:
+                deadline = transfer_deadline
+        scheduler_deadline = self.scheduler.next_deadline()
+        if scheduler_deadline is not None and scheduler_deadline < deadline:
+            deadline = scheduler_deadline
+
+        return deadline
+
     def handle_timeout(self):
         if self.state == ConnState.Send_awailable or self.state == ConnState.Send_Receive_awailable:
             log.info(
                 f"{self.destination[0]}:{self.destination[1]}  Long time no see, may I continue sending?\n")
             self.last_packet_time = time_ms()
+            self.open_time = time_ms()
+            self.open_retries = 0
             self.send(MRP.serialize(
                 PacketType.OpenConnection, 0, 0, 0, b""))
             if self.state == ConnState.Send_awailable:
@@ -80,6 +181,9 @@ class Conn:
                 self.state = ConnState.Receive_Wait_Send_Confirm
         elif self.state == ConnState.Wait_Send_Confirm or self.state == ConnState.Receive_Wait_Send_Confirm:
             log.info(f"Disconnected from {self.destination} by timeout\n")
+            # Peer never confirmed the open, the waiting transfers fail and the connection is removed
+            self.end_transfers()
+            self.future_send = False
             self.state = ConnState.Disconnected
             return False
         elif self.state == ConnState.Receive_awailable or self.state == ConnState.Receive_Wait_Send_awailable:
@@ -95,10 +199,18 @@ class Conn:
 
     def handle_wait_send_awailable(self):
         # If there are no packets for a long time, then resend the send confirmation
-        if time_ms() - self.last_packet_time > ACK_TIMEOUT:
+        if time_ms() - max(self.last_packet_time, self.last_confirm_time) > self.rtt.get_timeout():
+            self.last_confirm_time = time_ms()
             self.send(MRP.serialize(
                 PacketType.ConfirmOpenConnection, 0, 0, 0, b""))
 
+    def handle_wait_send_confirm(self):
+        # Resend the lost open request with exponential backoff
+        if time_ms() - self.open_time > self.rtt.get_timeout(self.open_retries):
+            self.open_time = time_ms()
+            self.open_retries += 1
+            self.send(MRP.serialize(PacketType.OpenConnection, 0, 0, 0, b""))
+
     def open_connection(self):
         # Open sending stream
         if self.state == ConnState.Disconnected:
@@ -106,12 +218,22 @@ class Conn:
         elif self.state == ConnState.Receive_awailable:
             self.state = ConnState.Receive_Wait_Send_Confirm
 
+        self.open_time = time_ms()
+        self.open_retries = 0
         self.send(MRP.serialize(PacketType.OpenConnection, 0, 0, 0, b""))
+        self.path_mtu.start()
 
     def add_packet(self, packet: MRP):
         self.last_packet_time = time_ms()
+        self.metrics.packets_in += 1
+        self.metrics.bytes_in += HEADER_SIZE + len(packet.payload)
 
-        if packet.type == PacketType.OpenConnection:
+        # Probes are answered in any state, the peer searches its path MTU while the connection opens
+        if packet.type == PacketType.Probe:
+            self.send(MRP.serialize(PacketType.ConfirmProbe, 0, 0, HEADER_SIZE + len(packet.payload), b""))
+        elif packet.type == PacketType.ConfirmProbe:
+            self.path_mtu.handle_confirm(packet.window_number)
+        elif packet.type == PacketType.OpenConnection:
             if self.state == ConnState.Disconnected:
                 self.send(MRP.serialize(
                     PacketType.ConfirmOpenConnection, 0, 0, 0, b""))
@@ -124,6 +246,9 @@ class Conn:
                 self.send(MRP.serialize(
                     PacketType.ConfirmOpenConnection, 0, 0, 0, b""))
         elif packet.type == PacketType.ConfirmOpenConnection:
+            if self.state == ConnState.Wait_Send_Confirm or self.state == ConnState.Receive_Wait_Send_Confirm:
+                if self.open_retries == 0:
+                    self.rtt.add_sample(time_ms() - self.open_time)
             self.state = ConnState.Send_awailable
         elif self.state == ConnState.Wait_Receive_awailable:
             self.state = ConnState.Receive_awailable
@@ -135,42 +260,143 @@ class Conn:
                 f"Packet {packet.type} received in state {self.state}")
 
     def dispatch_packet(self, packet: MRP):
-        if packet.transfer_id not in self.transfers:
+        transfer: ReceiveFile | SendFile | SendMessage | ReceiveMessage | None
+        if packet.type in ANSWER_TYPES:
+            transfer = self.sending.get(packet.transfer_id)
+        else:
+            transfer = self.receiving.get(packet.transfer_id)
+        if transfer is not None:
+            transfer.add_packet(packet)
+        elif packet.type == PacketType.Init_file_transfer:
             # TODO: Ask user if he wants to receive this file
-            self.transfers[packet.transfer_id] = ReceiveFile(self.destination,
-                                                             self.send, packet)
-            self.last_transfer_id += 1
+            transfer = self.receiving[packet.transfer_id] = ReceiveFile(self.destination,
+                                                                        self.send, packet, self.rtt, self.get_run_io())
+        elif packet.type == PacketType.Message:
+            if packet.transfer_id in self.delivered_messages:
+                # Confirm of the message was lost
+                self.metrics.duplicates += 1
+                self.send(MRP.serialize(PacketType.ConfirmMessage, packet.transfer_id, 0, 0, b""))
+            else:
+                transfer = self.receiving[packet.transfer_id] = ReceiveMessage(self.destination, self.send, packet,
+                                                                               self.deliver_message, self.rtt)
         else:
-            self.transfers[packet.transfer_id].add_packet(packet)
+            # Late packet of a finished transfer
+            self.metrics.duplicates += 1
+            log.debug("Packet %s of unknown transfer %d <- %s\n", packet.type, packet.transfer_id, self.destination)
+        if transfer is not None:
+            transfer.metrics.packets_in += 1
+            transfer.metrics.bytes_in += HEADER_SIZE + len(packet.payload)
 
     def send(self, data: bytes):
-        self.socket.sendto(data, self.destination)
+        self.metrics.packets_out += 1
+        self.metrics.bytes_out += len(data)
+        if not self.outbox:
+            self.sender.schedule(self.outbox, self.destination)
+        self.outbox.append(data)
+        if len(self.outbox) >= self.sender.batch:
+            self.flush()
+
+    def send_probe(self, data: bytes) -> bool:
+        """Send the probe of `path_mtu` now, without fragmentation, after the queued datagrams"""
+        self.flush()
+        self.metrics.packets_out += 1
+        self.metrics.bytes_out += len(data)
+        return send_unfragmented(self.socket, data, self.destination)
+
+    def flush(self):
+        """Send queued datagrams now instead of on the next loop iteration"""
+        if self.outbox:
+            self.sender.send(self.outbox, self.destination)
+            self.outbox.clear()
 
-    def send_file(self, file_path: str, frame_len: int, window_len: int):
+    def send_file(self, file_path: str, frame_len: int | None, window_len: int, max_in_flight: int | None = None,
+                  chunked: bool = False, resumable: bool = False, priority: Priority = Priority.Normal) -> SendFile | None:
+        """Start sending the file, `frame_len` `None` fills the datagrams the path MTU lets through"""
         free_id: int | None = self.get_id()
         if free_id is None:
             log.error("No free id for transfer")
-            return False
+            return None
 
-        if self.state == ConnState.Send_awailable or self.state == ConnState.Send_Receive_awailable:
-            self.transfers[free_id] = SendFile(self.destination,
-                                               free_id, self.send, file_path, window_len, frame_len)
-        else:
+        if self.state != ConnState.Send_awailable and self.state != ConnState.Send_Receive_awailable:
             self.open_connection()
             self.future_send = True
-            self.transfers[free_id] = SendFile(self.destination,
-                                               free_id, self.send, file_path, window_len, frame_len)
-        return True
+        transfer = SendFile(self.destination,
+                            free_id, self.send, file_path, window_len, frame_len, max_in_flight, self.rtt, self.congestion, chunked=chunked, resumable=resumable,
+                            scheduler=self.scheduler, priority=priority, run_io=self.get_run_io(),
+                            read_ahead=self.read_ahead, path_mtu=self.path_mtu)
+        self.sending[free_id] = transfer
+        return transfer
+
+    def get_run_io(self) -> Callable[..., None] | None:
+        return self.run_io if self.io is not None else None
+
+    def run_io(self, job: Callable[..., Any], done: Callable[[Any], None], *args: Any):
+        """Run the disk job of a transfer in the pool, `done` gets its result in the loop"""
+        if self.io is not None:
+            self.io.submit(job, partial(self.complete_io, done), *args)
+
+    def complete_io(self, done: Callable[[Any], None], result: Any):
+        done(result)
+        if self.on_io_done is not None:
+            self.on_io_done(self)
+
+    def send_message(self, data: bytes, frame_len: int, priority: Priority = Priority.High) -> SendMessage | None:
+        free_id: int | None = self.get_id()
+        if free_id is None:
+            log.error("No free id for message")
+            return None
+
+        transfer = SendMessage(self.destination, free_id, self.send, data, frame_len, self.rtt,
+                               self.congestion, self.scheduler, priority)
+        self.sending[free_id] = transfer
+        if self.state != ConnState.Send_awailable and self.state != ConnState.Send_Receive_awailable:
+            self.open_connection()
+            self.future_send = True
+        return transfer
+
+    def deliver_message(self, transfer_id: int, data: bytes):
+        self.delivered_messages[transfer_id] = None
+        if len(self.delivered_messages) > RECENT_MESSAGES:
+            del self.delivered_messages[next(iter(self.delivered_messages))]
+        if self.on_message is not None:
+            self.on_message(data, self.destination)
 
     def get_id(self) -> int | None:
-        # Return free id for transfer (0-15)
-        for i in range(16):
-            if i not in self.transfers:
-                return i
+        """Return the next free id, a recently finished transfer gets its id again only after a wrap around"""
+        if len(self.sending) > MAX_TRANSFER_ID:
+            return None
+        transfer_id = (self.last_transfer_id + 1) & MAX_TRANSFER_ID
+        while transfer_id in self.sending:
+            transfer_id = (transfer_id + 1) & MAX_TRANSFER_ID
+        self.last_transfer_id = transfer_id
+        return transfer_id
 
-    def kill(self):
-        for transfer in self.transfers.values():
+    def end_transfer(self, transfer: ReceiveFile | SendFile | SendMessage | ReceiveMessage):
+        """Keep the counters of the removed transfer and report it"""
+        self.metrics.merge(transfer.metrics, TRANSFER_COUNTERS)
+        if self.on_transfer_end is not None:
+            self.on_transfer_end(self, transfer)
+
+    def end_transfers(self):
+        """Close all transfers, each of them is reported once"""
+        transfers = self.transfers
+        self.sending.clear()
+        self.receiving.clear()
+        for transfer in transfers:
             transfer.close()
+            self.end_transfer(transfer)
+
+    def get_metrics(self) -> dict[str, Any]:
+        """Metrics of the connection with its running transfers and of each running transfer by its direction and id"""
+        metrics = self.metrics.copy()
+        for transfer in self.transfers:
+            metrics.merge(transfer.metrics, TRANSFER_COUNTERS)
+        return {"metrics": metrics,
+                "sending": {id: transfer.metrics.copy() for id, transfer in self.sending.items()},
+                "receiving": {id: transfer.metrics.copy() for id, transfer in self.receiving.items()}}
+
+    def kill(self):
+        self.end_transfers()
         self.state = ConnState.Disconnected
         self._killed = True
 
@@ -178,6 +404,5 @@ class Conn:
             f"Forced close connection with {self.destination[0]}:{self.destination[1]}\n")
 
     def close(self):
-        for transfer in self.transfers.values():
-            transfer.close()
+        self.end_transfers()
         self.state = ConnState.Disconnected
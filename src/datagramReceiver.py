@@ -0,0 +1,140 @@
+import ctypes
+import ctypes.util
+import errno
+import socket
+import sys
+
+from socket import SocketType
+
+RECEIVE_BATCH: int = 64
+"""Maximum amount of datagrams received in one wakeup"""
+MAX_DATAGRAM_SIZE: int = 65507
+"""Largest UDP payload of an IPv4 datagram"""
+RECEIVE_BUFFER_SIZE: int = MAX_DATAGRAM_SIZE
+"""Size of one buffer in the ring, fits every datagram, so none is truncated whatever the path MTU"""
+SOCKET_BUFFER_SIZE: int = 4 * 1024 * 1024
+"""SO_RCVBUF with room for windows of the largest datagrams, the kernel caps it by net.core.rmem_max"""
+MSG_DONTWAIT: int = 0x40
+SOCKADDR_SIZE: int = 128
+MAX_CACHED_ADDRESSES: int = 4096
+
+
+class Iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class Msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(Iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class Mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", Msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def load_recvmmsg():
+    """Return libc `recvmmsg` or None when it is not available (not Linux)"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(Mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+
+_recvmmsg = load_recvmmsg()
+
+
+class DatagramReceiver:
+    """Drains up to `batch` datagrams from a non-blocking socket per call
+
+    Datagrams are received into a preallocated ring of buffers and returned as memoryviews,
+    they are valid only until the next `receive` call, so whoever keeps the data has to copy it.
+    Uses `recvmmsg` (one syscall per batch) where available, otherwise `recvfrom_into` until EAGAIN.
+    """
+
+    def __init__(self, sock: SocketType, batch: int = RECEIVE_BATCH, buffer_size: int = RECEIVE_BUFFER_SIZE,
+                 use_recvmmsg: bool = True) -> None:
+        self.socket = sock
+        self.batch = batch
+        self.buffer_size = buffer_size
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) < SOCKET_BUFFER_SIZE:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        self.ring = bytearray(batch * buffer_size)
+        self.view = memoryview(self.ring)
+        self.buffers = [self.view[i * buffer_size:(i + 1) * buffer_size] for i in range(batch)]
+        self.use_recvmmsg: bool = use_recvmmsg and _recvmmsg is not None and sock.family == socket.AF_INET
+        if self.use_recvmmsg:
+            self.init_mmsghdrs()
+
+    def init_mmsghdrs(self):
+        ring_address = ctypes.addressof(ctypes.c_char.from_buffer(self.ring))
+        self.names = ctypes.create_string_buffer(self.batch * SOCKADDR_SIZE)
+        names_address = ctypes.addressof(self.names)
+        self.iovecs = (Iovec * self.batch)()
+        self.mmsghdrs = (Mmsghdr * self.batch)()
+        for i in range(self.batch):
+            self.iovecs[i].iov_base = ring_address + i * self.buffer_size
+            self.iovecs[i].iov_len = self.buffer_size
+            header = self.mmsghdrs[i].msg_hdr
+            header.msg_name = names_address + i * SOCKADDR_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+            # Kernel shrinks it to the size of sockaddr_in, which is enough for the next calls
+            header.msg_namelen = SOCKADDR_SIZE
+        self.addresses: dict[int, tuple[str, int]] = {}
+        # Read results straight from the raw memory, ctypes attribute access is slow
+        self.names_view = memoryview(self.names).cast("B").cast("Q")
+        self.lengths_view = memoryview(self.mmsghdrs).cast("B").cast("I")
+        self.names_step = SOCKADDR_SIZE // 8
+        self.lengths_step = ctypes.sizeof(Mmsghdr) // 4
+        self.lengths_offset = Mmsghdr.msg_len.offset // 4
+
+    def receive(self) -> list[tuple[memoryview, tuple[str, int]]]:
+        if self.use_recvmmsg:
+            return self.receive_mmsg()
+        return self.receive_loop()
+
+    def receive_loop(self) -> list[tuple[memoryview, tuple[str, int]]]:
+        result: list[tuple[memoryview, tuple[str, int]]] = []
+        for buffer in self.buffers:
+            try:
+                size, address = self.socket.recvfrom_into(buffer)
+            except BlockingIOError:
+                break
+            result.append((buffer[:size], address))
+        return result
+
+    def receive_mmsg(self) -> list[tuple[memoryview, tuple[str, int]]]:
+        amount = _recvmmsg(self.socket.fileno(), self.mmsghdrs, self.batch, MSG_DONTWAIT, None)
+        if amount < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise OSError(error, "recvmmsg failed")
+
+        result: list[tuple[memoryview, tuple[str, int]]] = []
+        for i in range(amount):
+            # First 8 bytes of sockaddr_in identify the peer: family, port and IPv4 address
+            name = self.names_view[i * self.names_step]
+            address = self.addresses.get(name)
+            if address is None:
+                raw = name.to_bytes(8, sys.byteorder)
+                address = (socket.inet_ntoa(raw[4:8]), int.from_bytes(raw[2:4], "big"))
+                if len(self.addresses) > MAX_CACHED_ADDRESSES:
+                    self.addresses.clear()
+                self.addresses[name] = address
+            size = self.lengths_view[i * self.lengths_step + self.lengths_offset]
+            result.append((self.buffers[i][:size], address))
+        return result
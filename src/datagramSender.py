@@ -0,0 +1,199 @@
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+
+from socket import SocketType
+from datagramReceiver import Iovec, Mmsghdr
+from services import log
+
+SEND_BATCH: int = 64
+"""Maximum amount of datagrams sent in one syscall"""
+SEND_BUFFER_SIZE: int = 1500
+"""Size of one buffer in the ring, longer datagrams are sent one by one"""
+UDP_SEGMENT: int = 103
+"""Linux socket option of UDP generic segmentation offload"""
+GSO_MAX_SEGMENTS: int = 64
+GSO_MAX_SIZE: int = 65000
+"""Total payload of one GSO send, must fit into one IP datagram"""
+SOCKADDR_IN_SIZE: int = 16
+SOCKET_BUFFER_SIZE: int = 4 * 1024 * 1024
+"""SO_SNDBUF with room for bursts of the largest datagrams, the kernel caps it by net.core.wmem_max"""
+
+
+def load_sendmmsg():
+    """Return libc `sendmmsg` or None when it is not available (not Linux)"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(Mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = load_sendmmsg()
+
+
+class DatagramSender:
+    """Flushes outbound queues of connections in batches
+
+    Connections append datagrams to their own queue and register it with `schedule`,
+    the server calls `flush` once per loop iteration. Runs of equally sized datagrams go out
+    with one UDP GSO `sendmsg`, the rest with `sendmmsg`, otherwise with `sendto` one by one.
+    Datagrams the socket buffer has no room for or the host refuses are dropped, the protocol retransmits them.
+    """
+
+    def __init__(self, sock: SocketType, batch: int = SEND_BATCH, buffer_size: int = SEND_BUFFER_SIZE,
+                 use_sendmmsg: bool = True, use_gso: bool = True) -> None:
+        self.socket = sock
+        self.batch = batch
+        self.buffer_size = buffer_size
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) < SOCKET_BUFFER_SIZE:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        self.pending: list[tuple[list[bytes], tuple[str, int]]] = []
+        self.use_sendmmsg: bool = use_sendmmsg and _sendmmsg is not None and sock.family == socket.AF_INET
+        self.use_gso: bool = use_gso and sys.platform.startswith("linux") and sock.family == socket.AF_INET
+        if self.use_sendmmsg:
+            self.init_mmsghdrs()
+
+    def init_mmsghdrs(self):
+        self.ring = bytearray(self.batch * self.buffer_size)
+        self.view = memoryview(self.ring)
+        ring_address = ctypes.addressof(ctypes.c_char.from_buffer(self.ring))
+        # All datagrams of one batch have the same destination
+        self.name = ctypes.create_string_buffer(SOCKADDR_IN_SIZE)
+        self.iovecs = (Iovec * self.batch)()
+        self.mmsghdrs = (Mmsghdr * self.batch)()
+        for i in range(self.batch):
+            self.iovecs[i].iov_base = ring_address + i * self.buffer_size
+            header = self.mmsghdrs[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.name)
+            header.msg_namelen = SOCKADDR_IN_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+        self.names: dict[tuple[str, int], bytes | None] = {}
+        # Write lengths straight to the raw memory, ctypes attribute access is slow
+        self.lengths_view = memoryview(self.iovecs).cast("B").cast("Q")
+        self.lengths_step = ctypes.sizeof(Iovec) // 8
+        self.lengths_offset = Iovec.iov_len.offset // 8
+
+    def schedule(self, queue: list[bytes], address: tuple[str, int]):
+        """Register a queue to be sent on the next `flush`"""
+        self.pending.append((queue, address))
+
+    def flush(self):
+        """Send and clear all scheduled queues"""
+        pending = self.pending
+        self.pending = []
+        for queue, address in pending:
+            if queue:
+                self.send(queue, address)
+                queue.clear()
+
+    def send(self, datagrams: list[bytes], address: tuple[str, int]):
+        try:
+            if self.use_gso and len(datagrams) > 1:
+                self.send_gso(datagrams, address)
+            else:
+                self.send_plain(datagrams, address)
+        except BlockingIOError:
+            # Socket buffer is full, the rest is lost like on the wire
+            pass
+        except OSError as error:
+            # Refused by the host (firewall, broadcast address, no buffers), the rest is dropped the same way
+            log.error(f"Sending to {address[0]}:{address[1]} failed: {error}\n")
+
+    def send_plain(self, datagrams: list[bytes], address: tuple[str, int]):
+        if self.use_sendmmsg and len(datagrams) > 1:
+            name = self.get_name(address)
+            if name is not None:
+                self.send_mmsg(datagrams, name)
+                return
+        self.send_loop(datagrams, address)
+
+    def send_loop(self, datagrams: list[bytes], address: tuple[str, int]):
+        for data in datagrams:
+            self.socket.sendto(data, address)
+
+    def send_gso(self, datagrams: list[bytes], address: tuple[str, int]):
+        singles: list[bytes] = []
+        start = 0
+        while start < len(datagrams):
+            # Segments of one send are equal, only the last one may be shorter
+            size = len(datagrams[start])
+            limit = min(len(datagrams), start + min(GSO_MAX_SEGMENTS, GSO_MAX_SIZE // max(size, 1)))
+            end = start + 1
+            while end < limit and len(datagrams[end]) == size:
+                end += 1
+            if end < limit and len(datagrams[end]) < size:
+                end += 1
+
+            if end - start == 1:
+                singles.append(datagrams[start])
+            else:
+                if singles:
+                    self.send_plain(singles, address)
+                    singles = []
+                try:
+                    self.socket.sendmsg([b"".join(datagrams[start:end])],
+                                       [(socket.SOL_UDP, UDP_SEGMENT, struct.pack("H", size))], 0, address)
+                except OSError as error:
+                    if error.errno not in (errno.EINVAL, errno.ENOPROTOOPT, errno.EIO, errno.EOPNOTSUPP):
+                        raise
+                    # Kernel or device without UDP GSO
+                    self.use_gso = False
+                    singles.extend(datagrams[start:end])
+            start = end
+
+        if singles:
+            self.send_plain(singles, address)
+
+    def get_name(self, address: tuple[str, int]) -> bytes | None:
+        """Return sockaddr_in of the address, None if it is not a numeric IPv4 address"""
+        if address not in self.names:
+            try:
+                self.names[address] = (struct.pack("=H", socket.AF_INET) + address[1].to_bytes(2, "big") +
+                                       socket.inet_aton(address[0]) + bytes(8))
+            except (OSError, OverflowError):
+                self.names[address] = None
+        return self.names[address]
+
+    def send_mmsg(self, datagrams: list[bytes], name: bytes):
+        ctypes.memmove(self.name, name, SOCKADDR_IN_SIZE)
+        fd = self.socket.fileno()
+        start = 0
+        while start < len(datagrams):
+            amount = 0
+            for data in datagrams[start:start + self.batch]:
+                size = len(data)
+                if size > self.buffer_size:
+                    break
+                offset = amount * self.buffer_size
+                self.view[offset:offset + size] = data
+                self.lengths_view[amount * self.lengths_step + self.lengths_offset] = size
+                amount += 1
+
+            if amount == 0:
+                # Datagram does not fit into the ring
+                self.socket.sendto(datagrams[start], self.socket_address(name))
+                start += 1
+                continue
+
+            sent = _sendmmsg(fd, self.mmsghdrs, amount, 0)
+            if sent <= 0:
+                error = ctypes.get_errno() if sent < 0 else errno.EAGAIN
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise BlockingIOError(error, "sendmmsg would block")
+                raise OSError(error, "sendmmsg failed")
+            # After a partial send the rest is copied to the ring again
+            start += sent
+
+    @staticmethod
+    def socket_address(name: bytes) -> tuple[str, int]:
+        return socket.inet_ntoa(name[4:8]), int.from_bytes(name[2:4], "big")
@@ -3,6 +3,7 @@ import services
 from threading import Thread
 from userInterface import handle_commands
 from MainServer import Server
+from workerPool import WorkerPool
 
 if not os.path.exists("./src/save"):
     os.mkdir("./src/save")
@@ -11,7 +12,8 @@ while True:
     try:
         ip = input("Enter server ip (127.0.0.1): ") or "127.0.0.1"
         port = int(input("Enter server port (1000): ") or 0) or 1000
-        server = Server(ip, port, 0)
+        workers = int(input("Worker processes (1): ") or 1)
+        server = Server(ip, port, 0) if workers == 1 else WorkerPool(ip, port, workers)
         break
     except Exception as e:
         services.log.error(e)
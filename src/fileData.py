@@ -1,15 +1,25 @@
+import hashlib
 import os
-from services import sha256_file
+from math import ceil
+from services import sha256_file, sha256_chunks
+
+CHUNK_SIZE: int = 64 * 1024
+"""Smallest chunk with its own hash, small chunks keep repairs short"""
+MAX_CHUNKS: int = 4096
+"""Chunks grow for big files, so the hashes fit into the init data"""
 
 
 class FileData():
     """Class for creating the init data for the file transfer
     `file_len:  8B      ` - Length of the file in bytes
-    `hash:      32B     ` - hash of the file
+    `hash:      32B     ` - hash of the file, missing if `with_hash` is `False`
+    `chunks:    32B * n ` - hashes of the chunks if `chunked`, `get_chunk_size` bytes each
     `file_path: 0-255B  ` - Path of the file
     """
 
-    def __init__(self, *, path: None | str = None, data: None | bytes = None) -> None:
+    def __init__(self, *, path: None | str = None, data: None | bytes = None, with_hash: bool = True,
+                 chunked: bool = False) -> None:
+        self.chunk_hashes: list[bytes] = []
         if path is not None:
             if not os.path.isfile(path):
                 raise FileNotFoundError("File does not exist")
@@ -18,14 +28,21 @@ class FileData():
 
             self.__size: bytes = os.path.getsize(
                 path).to_bytes(8, "big")  # 8B
-            self.__hash: bytes = sha256_file(path)  # 32B
+            self.__hash: bytes = sha256_file(path) if with_hash else b""  # 32B
+            if chunked:
+                self.chunk_hashes = sha256_chunks(path, self.chunk_size)
             self.__path: bytes = self.filter_name(path)  # 0-255B
-            self.raw: bytes = self.__size + self.__hash + self.__path
+            self.raw: bytes = self.__size + self.__hash + b"".join(self.chunk_hashes) + self.__path
         elif data is not None:
             # Parse the init data
+            hash_end = 40 if with_hash else 8
             self.__size: bytes = data[:8]
-            self.__hash: bytes = data[8:40]
-            self.__path: bytes = data[40:]
+            self.__hash: bytes = data[8:hash_end]
+            if chunked:
+                chunks_end = hash_end + 32 * ceil(self.size / self.chunk_size)
+                self.chunk_hashes = [data[i:i + 32] for i in range(hash_end, chunks_end, 32)]
+                hash_end = chunks_end
+            self.__path: bytes = data[hash_end:]
             self.raw: bytes = data
         else:
             raise ValueError("No data or path provided")
@@ -34,6 +51,15 @@ class FileData():
     def hash(self) -> str:
         return self.__hash.hex()
 
+    @property
+    def root(self) -> str:
+        """Hash of all chunk hashes, identifies the whole file in chunked mode"""
+        return hashlib.sha256(b"".join(self.chunk_hashes)).hexdigest()
+
+    @property
+    def chunk_size(self) -> int:
+        return get_chunk_size(self.size)
+
     @property
     def size(self) -> int:
         return int.from_bytes(self.__size, "big")
@@ -50,4 +76,12 @@ class FileData():
         return os.path.basename(path).encode(encoding="utf-8")
 
 
+def get_chunk_size(size: int) -> int:
+    """Both sides derive the chunk size from the file size, so it is not sent"""
+    chunk_size = CHUNK_SIZE
+    while size > chunk_size * MAX_CHUNKS:
+        chunk_size *= 2
+    return chunk_size
+
+
 FileData(data=b'')
@@ -0,0 +1,91 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+IO_THREADS: int = 4
+"""Disk jobs running at once for all transfers of the server"""
+
+Done = Callable[[Any], None]
+"""Gets the result of the job, or the exception it raised"""
+
+
+def run_job(job: Callable[..., Any], *args: Any) -> Any:
+    """Run the job right away, return the raised exception instead of the result"""
+    try:
+        return job(*args)
+    except Exception as e:
+        return e
+
+
+class IoPool:
+    """Bounded pool of threads for the disk reads, writes and hashing of the transfers
+
+    The loop never waits for the disk, the result of every job is handed back to the loop with `call_soon`.
+    """
+
+    def __init__(self, call_soon: Callable[..., None], threads: int = IO_THREADS) -> None:
+        self.call_soon = call_soon
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="mrp-io")
+
+    def submit(self, job: Callable[..., Any], done: Done, *args: Any):
+        """Run `job(*args)` in a pool thread, then `done` with its result in the loop"""
+        try:
+            future = self.executor.submit(job, *args)
+        except RuntimeError:
+            # Pool is shut down with the server or the interpreter, the job runs right away
+            done(run_job(job, *args))
+            return
+        future.add_done_callback(partial(self.complete, done))
+
+    def complete(self, done: Done, future: Future):
+        exception = future.exception()
+        self.call_soon(done, exception if exception is not None else future.result())
+
+    def shutdown(self, wait: bool = True):
+        """Take no more jobs, the queued ones still run, `wait` blocks until all of them are done"""
+        self.executor.shutdown(wait=wait)
+
+
+class IoQueue:
+    """Disk jobs of one transfer, run in the pool one after another in the order they were submitted
+
+    A transfer reads or writes its file in order and closes it after the last job, so its jobs
+    never run at once and they need no locks. Without a pool the jobs run right away in the loop.
+    """
+
+    def __init__(self, run_io: Callable[..., None] | None = None) -> None:
+        self.run_io = run_io
+        """Runs a job in the pool, `run_io(job, done, *args)`"""
+        self.jobs: deque[tuple[Callable[..., Any], Done | None, tuple[Any, ...]]] = deque()
+        self.running: bool = False
+
+    @property
+    def pending(self) -> int:
+        """Jobs submitted and not done yet"""
+        return len(self.jobs) + self.running
+
+    def submit(self, job: Callable[..., Any], done: Done | None = None, *args: Any):
+        if self.run_io is None:
+            result = run_job(job, *args)
+            if done is not None:
+                done(result)
+            return
+        self.jobs.append((job, done, args))
+        if not self.running:
+            self.run_next()
+
+    def run_next(self):
+        job, done, args = self.jobs.popleft()
+        self.running = True
+        if self.run_io is not None:
+            self.run_io(job, partial(self.complete, done), *args)
+
+    def complete(self, done: Done | None, result: Any):
+        self.running = False
+        if done is not None:
+            done(result)
+        # The next job starts only now, a job done at once completes inside `run_next`
+        # and its result must not overtake this one
+        if self.jobs and not self.running:
+            self.run_next()
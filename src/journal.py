@@ -0,0 +1,96 @@
+import os
+
+from math import ceil
+from struct import Struct
+
+JOURNAL_MAGIC: bytes = b"MRPJRNL1"
+JOURNAL_SUFFIX: str = ".mrp-journal"
+JOURNAL_HEADER: Struct = Struct("!8s32sQIIH")
+"""Magic, file hash, file size, window size, fragment length and length of the file name"""
+
+
+class TransferJournal:
+    """Progress of a resumable transfer, kept next to the partial file
+
+    `header | file name | bitmap of the written data windows`, a bit is set once the whole
+    window is written, so after a failure the transfer continues from the first missing window.
+    """
+
+    def __init__(self, file_hash: bytes, size: int, window_size: int, fragment_len: int) -> None:
+        self.file_hash = file_hash
+        self.size = size
+        self.window_size = window_size
+        self.fragment_len = fragment_len
+        self.path: str = self.get_path(file_hash)
+        self.file_name: str = ""
+        self.bitmap = bytearray(ceil(self.get_windows() / 8))
+        self.bitmap_offset: int = 0
+        self.fd: int | None = None
+
+    @staticmethod
+    def get_path(file_hash: bytes) -> str:
+        """Journal is found by the hash before the init data with the file name arrives"""
+        return f".{file_hash.hex()[:32]}{JOURNAL_SUFFIX}"
+
+    def get_windows(self) -> int:
+        window_bytes = self.window_size * self.fragment_len
+        return ceil(self.size / window_bytes) if window_bytes > 0 else 0
+
+    def load(self) -> bool:
+        """Read the journal of the same file sent with the same window layout, `False` if there is none"""
+        try:
+            with open(self.path, "rb") as journal:
+                data = journal.read()
+        except OSError:
+            return False
+        if len(data) < JOURNAL_HEADER.size:
+            return False
+        magic, file_hash, size, window_size, fragment_len, name_len = JOURNAL_HEADER.unpack_from(data)
+        if (magic, file_hash, size, window_size, fragment_len) != (
+                JOURNAL_MAGIC, self.file_hash, self.size, self.window_size, self.fragment_len):
+            return False
+        bitmap_start = JOURNAL_HEADER.size + name_len
+        bitmap = data[bitmap_start:bitmap_start + len(self.bitmap)]
+        if len(bitmap) != len(self.bitmap):
+            return False
+        self.file_name = data[JOURNAL_HEADER.size:bitmap_start].decode("utf-8")
+        self.bitmap[:] = bitmap
+        return True
+
+    def completed_windows(self) -> int:
+        """Amount of the data windows written without a gap from the start of the file"""
+        windows = 0
+        for byte in self.bitmap:
+            if byte != 0xFF:
+                return min(windows + 8 - (byte ^ 0xFF).bit_length(), self.get_windows())
+            windows += 8
+        return min(windows, self.get_windows())
+
+    def open(self, file_name: str):
+        """Create the journal on disk, the completed windows are kept"""
+        self.file_name = file_name
+        name = file_name.encode("utf-8")
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.write(self.fd, JOURNAL_HEADER.pack(JOURNAL_MAGIC, self.file_hash, self.size, self.window_size,
+                                              self.fragment_len, len(name)) + name + self.bitmap)
+        self.bitmap_offset = JOURNAL_HEADER.size + len(name)
+
+    def mark(self, window: int):
+        """Record the data window as written, one byte of the journal is rewritten"""
+        index = window // 8
+        if self.fd is None or index >= len(self.bitmap):
+            return
+        self.bitmap[index] |= 0x80 >> (window % 8)
+        os.pwrite(self.fd, self.bitmap[index:index + 1], self.bitmap_offset + index)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,214 @@
+from enum import Enum
+from math import ceil
+from typing import Callable
+
+from services import time_ms, log
+from packetParser import MRP, PacketType
+from rttEstimator import RttEstimator
+from congestion import CongestionController
+from scheduler import TransferScheduler, Priority
+from metrics import Metrics
+
+MAX_MESSAGE_FRAGMENTS: int = 256
+"""Fragment index is sent in `number_in_window`, the index of the last one in `window_number`"""
+MESSAGE_TIMEOUT = 10000  # ms
+
+
+class MessageState(Enum):
+    Wait_confirm = 0
+    Wait_fragments = 1
+    End_transfer = 2
+
+
+class SendMessage:
+    """Message sent from memory without the init exchange of files, the not confirmed fragments are resent
+
+    Fragments go through the scheduler like file data, so many messages don't leave in one burst.
+    `ConfirmMessage` with an empty payload confirms the whole message, otherwise its payload
+    is a bitmap of the received fragments, bit `index` for the fragment `index`.
+    """
+
+    def __init__(self, destination: tuple[str, int], id: int, send: Callable[[bytes], None], data: bytes,
+                 fragment_len: int = 500, rtt: RttEstimator | None = None,
+                 congestion: CongestionController | None = None, scheduler: TransferScheduler | None = None,
+                 priority: Priority = Priority.High) -> None:
+        fragments = max(ceil(len(data) / fragment_len), 1)
+        if fragments > MAX_MESSAGE_FRAGMENTS:
+            raise ValueError(f"Message is longer than {MAX_MESSAGE_FRAGMENTS * fragment_len} bytes, send it as a file")
+        self.dst = f"{destination[0]}:{destination[1]}"
+        self.id: int = id
+        self.send: Callable[[bytes], None] = send
+        self.rtt: RttEstimator = rtt if rtt is not None else RttEstimator()
+        self.packets: list[bytes] = [
+            MRP.serialize(PacketType.Message, id, index, fragments - 1,
+                          data[index * fragment_len:(index + 1) * fragment_len])
+            for index in range(fragments)]
+        self.sent_index: int = 0
+        self.congestion: CongestionController = congestion if congestion is not None else CongestionController(
+            fragment_len, self.rtt)
+        self.scheduler: TransferScheduler = scheduler if scheduler is not None else TransferScheduler(self.congestion)
+        self.priority: Priority = priority
+        self.queued: bool = False
+        """Fragments not sent yet wait for the scheduler"""
+        self.admitted: bool = True
+        """Messages don't wait for a free slot of the scheduler"""
+        self.mid_window: bool = False
+        self.confirmed: int = 0
+        """Bitmap of the fragments the receiver has"""
+        self.state = MessageState.Wait_confirm
+        self.backoff: int = 0
+        """Amount of resends without a confirm"""
+        self.first_send_time: int = 0  # ms
+        self.last_send_time: int = 0  # ms
+        self.is_inited: bool = False
+        self.succeeded: bool = False
+        """Receiver confirmed all fragments"""
+        self.metrics = Metrics()
+
+    def run(self):
+        if not self.is_inited:
+            self.is_inited = True
+            self.first_send_time = time_ms()
+            self.scheduler.wake(self)
+        elif (self.state == MessageState.Wait_confirm and not self.queued
+              and time_ms() - self.last_send_time > self.retransmit_timeout):
+            if time_ms() - self.first_send_time > MESSAGE_TIMEOUT:
+                log.error(f"Message {self.id} was not confirmed -> {self.dst}\n")
+                self.end()
+            else:
+                self.backoff += 1
+                self.send_packets()
+
+        return self.state != MessageState.End_transfer
+
+    def next_deadline(self) -> int | None:
+        """Return time in ms when `run` has to be called next, `None` if it waits only for packets"""
+        if not self.is_inited or self.state == MessageState.End_transfer:
+            return 0
+        if self.queued:
+            return None
+        return self.last_send_time + self.retransmit_timeout + 1
+
+    @property
+    def window_size(self) -> int:
+        """All fragments may be in flight, even with a smaller congestion window"""
+        return len(self.packets)
+
+    def send_next(self) -> int:
+        """Send the next fragment when the scheduler asks, return its size, `0` when all are sent"""
+        if self.state != MessageState.Wait_confirm or self.sent_index == len(self.packets):
+            return 0
+        packet = self.packets[self.sent_index]
+        self.sent_index += 1
+        self.last_send_time = time_ms()
+        self.congestion.on_sent(len(packet), self.last_send_time)
+        self.metrics.packets_out += 1
+        self.metrics.bytes_out += len(packet)
+        self.send(packet)
+        return len(packet)
+
+    @property
+    def retransmit_timeout(self) -> int:
+        """Receiver reports missing fragments after one timeout, sender resends them itself only after two"""
+        return self.rtt.get_timeout(self.backoff + 1)
+
+    def send_packets(self):
+        """Resend the sent fragments the receiver doesn't have"""
+        self.last_send_time = time_ms()
+        for index in range(self.sent_index):
+            if not self.confirmed >> index & 1:
+                self.congestion.on_sent(len(self.packets[index]), self.last_send_time, True)
+                self.metrics.packets_out += 1
+                self.metrics.bytes_out += len(self.packets[index])
+                self.metrics.retransmits += 1
+                self.send(self.packets[index])
+
+    def add_packet(self, packet: MRP):
+        if packet.type != PacketType.ConfirmMessage or self.state != MessageState.Wait_confirm:
+            return
+        all_fragments = (1 << len(self.packets)) - 1
+        confirmed = int.from_bytes(packet.payload, "big") if len(packet.payload) > 0 else all_fragments
+        newly_confirmed = confirmed & ~self.confirmed & ((1 << self.sent_index) - 1)
+        self.confirmed |= confirmed
+        self.congestion.on_ack(newly_confirmed.bit_count(), time_ms())
+        if self.confirmed != all_fragments:
+            self.send_packets()
+            return
+        if self.backoff == 0:
+            self.rtt.add_sample(time_ms() - self.last_send_time)
+        self.succeeded = True
+        self.end()
+
+    def end(self):
+        self.scheduler.remove(self)
+        # Fragments lost for good are not in flight anymore
+        self.congestion.release(self.sent_index - (self.confirmed & ((1 << self.sent_index) - 1)).bit_count())
+        self.state = MessageState.End_transfer
+
+    def close(self):
+        if self.state != MessageState.End_transfer:
+            self.end()
+
+
+class ReceiveMessage:
+    """Collects the fragments of a message in memory and hands it over once it is complete"""
+
+    def __init__(self, destination: tuple[str, int], send: Callable[[bytes], None], packet: MRP,
+                 deliver: Callable[[int, bytes], None], rtt: RttEstimator | None = None) -> None:
+        self.dst = f"{destination[0]}:{destination[1]}"
+        self.id: int = packet.transfer_id
+        self.send: Callable[[bytes], None] = send
+        self.deliver: Callable[[int, bytes], None] = deliver
+        """Called with the id and the data of the complete message"""
+        self.rtt: RttEstimator = rtt if rtt is not None else RttEstimator()
+        self.fragments: list[bytes | None] = [None] * (packet.window_number + 1)
+        self.received: int = 0
+        """Bitmap of the received fragments"""
+        self.count: int = 0
+        self.state = MessageState.Wait_fragments
+        self.last_packet_time: int = time_ms()  # ms
+        self.confirm_time: int = 0  # ms
+        self.backoff: int = 0
+        self.metrics = Metrics()
+        self.add_packet(packet)
+
+    def run(self):
+        if self.state == MessageState.Wait_fragments:
+            if time_ms() - self.last_packet_time > MESSAGE_TIMEOUT:
+                log.error(f"Message {self.id} is incomplete <- {self.dst}\n")
+                self.state = MessageState.End_transfer
+            elif time_ms() - max(self.last_packet_time, self.confirm_time) > self.rtt.get_timeout(self.backoff):
+                # Report the received fragments, the sender resends the rest
+                self.confirm_time = time_ms()
+                self.backoff += 1
+                self.send(MRP.serialize(PacketType.ConfirmMessage, self.id, 0, 0,
+                                        self.received.to_bytes((len(self.fragments) + 7) // 8, "big")))
+
+        return self.state != MessageState.End_transfer
+
+    def next_deadline(self) -> int | None:
+        """Return time in ms when `run` has to be called next, `None` if it waits only for packets"""
+        if self.state == MessageState.End_transfer:
+            return 0
+        return min(max(self.last_packet_time, self.confirm_time) + self.rtt.get_timeout(self.backoff),
+                   self.last_packet_time + MESSAGE_TIMEOUT) + 1
+
+    def add_packet(self, packet: MRP):
+        if packet.type != PacketType.Message or self.state != MessageState.Wait_fragments:
+            return
+        self.last_packet_time = time_ms()
+        index = packet.number_in_window
+        if index >= len(self.fragments) or self.fragments[index] is not None:
+            self.metrics.duplicates += 1
+            return
+        self.fragments[index] = bytes(packet.payload)
+        self.received |= 1 << index
+        self.count += 1
+        self.backoff = 0
+        if self.count == len(self.fragments):
+            self.state = MessageState.End_transfer
+            self.send(MRP.serialize(PacketType.ConfirmMessage, self.id, 0, 0, b""))
+            self.deliver(self.id, b"".join(fragment for fragment in self.fragments if fragment is not None))
+
+    def close(self):
+        self.state = MessageState.End_transfer
@@ -0,0 +1,176 @@
+import json
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Any, Callable
+
+LATENCY_BUCKETS: tuple[float, ...] = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # ms
+"""Upper bounds of the histogram buckets, one more bucket counts the longer values"""
+MS_BUCKETS: tuple[float, ...] = tuple(bound for bound in LATENCY_BUCKETS if bound >= 1)  # ms
+"""Buckets of the values measured by `time_ms` in whole ms, the finer ones would stay empty"""
+COUNTERS: tuple[str, ...] = ("packets_in", "bytes_in", "packets_out", "bytes_out",
+                             "retransmits", "duplicates", "out_of_order")
+TRANSFER_COUNTERS: tuple[str, ...] = ("retransmits", "duplicates", "out_of_order")
+"""Counted only by the transfers, the connection counts all packets and bytes itself"""
+HISTOGRAMS: tuple[str, ...] = ("rtt", "window_stall", "disk_time", "hash_time")
+METRICS_PORT: int = 9464
+
+
+class Histogram:
+    """Amount of observed values per bucket with their count and sum, values are in ms"""
+    __slots__ = ("bounds", "buckets", "count", "sum")
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.buckets: list[int] = [0] * (len(bounds) + 1)
+        self.count: int = 0
+        self.sum: float = 0
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        for index, amount in enumerate(other.buckets):
+            self.buckets[index] += amount
+        self.count += other.count
+        self.sum += other.sum
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"count": self.count, "sum": self.sum,
+                "buckets": dict(zip([*map(str, self.bounds), "+Inf"], self.buckets))}
+
+
+class Metrics:
+    """Counters and histograms of a connection or of one transfer
+
+    Updated in the loop, only the disk and hash times are observed by the jobs in the pool.
+    Transfers count the packets they receive, the data they send, retransmits, duplicate and out of order
+    packets, the connection counts every packet it sends and receives and samples the RTT.
+    """
+    __slots__ = COUNTERS + HISTOGRAMS
+
+    def __init__(self) -> None:
+        self.packets_in: int = 0
+        self.bytes_in: int = 0
+        self.packets_out: int = 0
+        self.bytes_out: int = 0
+        self.retransmits: int = 0
+        """Packets sent again, data resent after a loss or a timeout, repairs of chunks"""
+        self.duplicates: int = 0
+        """Received packets that were already received"""
+        self.out_of_order: int = 0
+        """New packets that arrived after a packet sent later, resent packets filling gaps included"""
+        self.rtt = Histogram(MS_BUCKETS)
+        self.window_stall = Histogram(MS_BUCKETS)
+        """Time the sender had data but the window was full"""
+        self.disk_time = Histogram()
+        self.hash_time = Histogram()
+
+    def merge(self, other: "Metrics", counters: tuple[str, ...] = COUNTERS):
+        for name in counters:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name in HISTOGRAMS:
+            getattr(self, name).merge(getattr(other, name))
+
+    def copy(self) -> "Metrics":
+        metrics = Metrics()
+        metrics.merge(self)
+        return metrics
+
+    def to_dict(self) -> dict[str, Any]:
+        result: dict[str, Any] = {name: getattr(self, name) for name in COUNTERS}
+        result.update({name: getattr(self, name).to_dict() for name in HISTOGRAMS})
+        return result
+
+
+def to_prometheus(connections: dict[str, Metrics], closed: Metrics | None = None, prefix: str = "mrp") -> str:
+    """Prometheus text format of the metrics, one series per peer
+
+    Metrics of the closed connections have no peer, they are the `closed` metrics of their own.
+    """
+    lines: list[str] = []
+    families = [(prefix, {f'peer="{peer}"': metrics for peer, metrics in connections.items()})]
+    if closed is not None:
+        families.append((f"{prefix}_closed", {"": closed}))
+    for family, series in families:
+        for name in COUNTERS:
+            lines.append(f"# TYPE {family}_{name}_total counter")
+            lines += [f"{family}_{name}_total{braces(labels)} {getattr(metrics, name)}"
+                      for labels, metrics in series.items()]
+        for name in HISTOGRAMS:
+            lines.append(f"# TYPE {family}_{name}_ms histogram")
+            for labels, metrics in series.items():
+                histogram: Histogram = getattr(metrics, name)
+                cumulative = 0
+                for bound, amount in zip([*map(str, histogram.bounds), "+Inf"], histogram.buckets):
+                    cumulative += amount
+                    le = f'le="{bound}"'
+                    lines.append(f"{family}_{name}_ms_bucket{braces(labels, le)} {cumulative}")
+                lines.append(f"{family}_{name}_ms_sum{braces(labels)} {histogram.sum}")
+                lines.append(f"{family}_{name}_ms_count{braces(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def braces(*labels: str) -> str:
+    """Label set of a series, nothing for a series without labels"""
+    joined = ",".join(label for label in labels if label)
+    return f"{{{joined}}}" if joined else ""
+
+
+def to_json(snapshot: dict[str, Any]) -> dict[str, Any]:
+    """Replace the `Metrics` of the snapshot by dicts"""
+    return {
+        "connections": {peer: {"metrics": connection["metrics"].to_dict(),
+                               "sending": {id: metrics.to_dict() for id, metrics in connection["sending"].items()},
+                               "receiving": {id: metrics.to_dict() for id, metrics in connection["receiving"].items()}}
+                        for peer, connection in snapshot["connections"].items()},
+        "closed": snapshot["closed"].to_dict(),
+    }
+
+
+class MetricsServer:
+    """Serves the metrics on a local HTTP socket, `/metrics` in Prometheus text format, `/metrics.json` as JSON
+
+    `collect` returns the snapshot of `Server.get_metrics`, it is called in the thread of the request.
+    """
+
+    def __init__(self, collect: Callable[[], dict[str, Any]], host: str = "127.0.0.1",
+                 port: int = METRICS_PORT) -> None:
+        self.collect = collect
+        self.http = ThreadingHTTPServer((host, port), self.make_handler())
+        self.http.daemon_threads = True
+        self.address: tuple[str, int] = self.http.server_address[:2]  # type: ignore[assignment]
+        Thread(target=self.http.serve_forever, daemon=True).start()
+
+    def make_handler(self) -> type[BaseHTTPRequestHandler]:
+        collect = self.collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    snapshot = collect()
+                    connections = {peer: connection["metrics"] for peer, connection in snapshot["connections"].items()}
+                    body = to_prometheus(connections, snapshot["closed"]).encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(to_json(collect())).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.http.shutdown()
+        self.http.server_close()
@@ -1,17 +1,48 @@
 from random import randint
-from zlib import crc32
+from struct import Struct, error as StructError
 from dataclasses import dataclass
 from enum import Enum
+from checksum import CHECKSUMS, DEFAULT_CHECKSUM
 
 
-FLAGS_BYTES: int = 1
-"""Number of bytes for flags"""
+TYPE_BYTES: int = 1
+"""Number of bytes for the packet type"""
+TRANSFER_ID_B: int = 4
+"""Number of bytes for the transfer id"""
+MAX_TRANSFER_ID: int = 2 ** (TRANSFER_ID_B * 8) - 1
+"""Maximum id of the transfer, ids are reused only after wrapping around"""
 PACKET_NUMBER_B: int = 1
 """Number of bytes for packet number"""
 WINDOW_SIZE_B: int = 4
 """Number of bytes for window size"""
 MAX_WINDOW_NUMBER: int = 2 ** (WINDOW_SIZE_B * 8) - 1
 """Maximum number of the window"""
+MAX_WINDOWS_AHEAD: int = 4
+"""Number of windows after the current one the receiver buffers, limits the sliding window sender"""
+INIT_TRAILING_HASH: int = 0b00000001
+"""Init flag, the init data has no hash, it comes in the `Integrity` packet after the last window"""
+INIT_CHUNK_HASHES: int = 0b00000010
+"""Init flag, the init data has hashes of the file chunks, corrupted chunks are repaired with `RepairRequest`"""
+INIT_RESUMABLE: int = 0b00000100
+"""Init flag, the init packet has the file hash and size, the receiver confirms it with the window to start from"""
+PROTOCOL_VERSION: int = 2
+"""Written to the upper 4 bits of the first byte, the lower 4 bits are `checksum.ChecksumKind`
+
+Version 1 packed the type and a 4 bit transfer id into one byte, version 2 has a 32 bit transfer id.
+"""
+HEADER: Struct = Struct("!BBIBII")
+"""Version, type, transfer id, number in window, window number and checksum
+
+The checksum covers the rest of the header and the payload, its kind is in the version byte.
+Senders use CRC-32 by default, CRC32C only with the optional `crc32c` module, see `checksum.DEFAULT_CHECKSUM`.
+"""
+HEADER_SIZE: int = HEADER.size
+CHECKED_HEADER: Struct = Struct("!BBIBI")
+"""Part of the header covered by the checksum together with the payload"""
+CHECKSUM: Struct = Struct("!I")
+CHECKSUM_OFFSET: int = CHECKED_HEADER.size
+VERSION_BYTE: int = (PROTOCOL_VERSION << 4) + DEFAULT_CHECKSUM
+DEFAULT_CHECKSUM_FUNCTION = CHECKSUMS[DEFAULT_CHECKSUM]
 
 
 class PacketType(Enum):
@@ -22,9 +53,23 @@ class PacketType(Enum):
     ConfirmOpenConnection = 5
     Init_file_transfer = 6
     ConfirmInit_file_transfer = 7
+    Integrity = 8
+    ConfirmIntegrity = 9
+    RepairRequest = 10
+    RepairData = 11
+    Message = 12
+    ConfirmMessage = 13
+    Probe = 14
+    """Padded to the probed datagram size, window number is the size, see `pathMtu.PathMtu`"""
+    ConfirmProbe = 15
 
 
-@dataclass
+_packet_types = {packet_type.value: packet_type for packet_type in PacketType}
+PACKET_TYPES: tuple[PacketType | None, ...] = tuple(_packet_types.get(i) for i in range(2 ** (TYPE_BYTES * 8)))
+"""Packet type by the type byte, constructing the Enum per packet is slow"""
+
+
+@dataclass(slots=True)
 class MRP:
     """Mykhailo's reliable protocol"""
     type: PacketType
@@ -32,50 +77,64 @@ class MRP:
     number_in_window: int
     """Number of the packet inside the window from `0` to `window_size - 1`"""
     window_number: int
-    payload: bytes
-
-    @staticmethod
-    def deserialize(data: bytes):
-        """Parse bytes into MRP"""
-        flags = data[0:(FLAGS_BYTES)]
-        packet_type, file_id = MRP.parse_flags(flags)
-        packet_number: int = int.from_bytes(data[FLAGS_BYTES:(FLAGS_BYTES +
-                                                              PACKET_NUMBER_B)], "big")
-        window_number = int.from_bytes(
-            data[(FLAGS_BYTES+PACKET_NUMBER_B):+(FLAGS_BYTES+PACKET_NUMBER_B+WINDOW_SIZE_B)], "big")
-        payload = data[(FLAGS_BYTES+PACKET_NUMBER_B +
-                        WINDOW_SIZE_B):]
-
-        return MRP(packet_type, file_id, packet_number, window_number, payload)
+    payload: bytes | memoryview
 
     @staticmethod
-    def parse_flags(data: bytes) -> tuple[PacketType, int]:
-        flags = int.from_bytes(data, "big")
-        packet_type_number = flags >> 4
-        if packet_type_number < 0 or packet_type_number > 12:
-            packet_type_number = 0
-        packet_type = PacketType(packet_type_number)
-
-        file_id = flags & 0b00001111
-
-        return packet_type, file_id
+    def deserialize(data: bytes | memoryview):
+        """Parse bytes into MRP without copying, payload is a view of `data`
+
+        `data` can be a reused receive buffer, so a packet kept after dispatch has to be `detach`ed.
+        """
+        try:
+            version, type, transfer_id, packet_number, window_number, _ = HEADER.unpack_from(data)
+        except StructError:
+            raise IOError("Packet is shorter than the header")
+        if version >> 4 != PROTOCOL_VERSION:
+            raise IOError(f"Unsupported protocol version {version >> 4}")
+        packet_type = PACKET_TYPES[type]
+        if packet_type is None:
+            raise IOError(f"Unknown packet type {type}")
+
+        return MRP(packet_type, transfer_id, packet_number, window_number, memoryview(data)[HEADER_SIZE:])
+
+    def detach(self) -> "MRP":
+        """Copy the payload out of the receive buffer"""
+        if not isinstance(self.payload, bytes):
+            self.payload = bytes(self.payload)
+        return self
 
     @ staticmethod
-    def check_checksum(data: bytes) -> bool:
-        """Check if checksum is correct"""
-        checksum = int.from_bytes(data[4:8], "big")
-        return checksum == crc32(data[0:4] + data[8:])
+    def check_checksum(data: bytes | memoryview) -> bool:
+        """Check if checksum is correct, the algorithm is chosen by the sender"""
+        if len(data) < HEADER_SIZE:
+            return False
+        checksum = CHECKSUMS.get(data[0] & 0b00001111)
+        if checksum is None:
+            return False
+        view = memoryview(data)
+        expected = CHECKSUM.unpack_from(view, CHECKSUM_OFFSET)[0]
+        return checksum(view[HEADER_SIZE:], checksum(view[:CHECKSUM_OFFSET])) == expected
 
     @ staticmethod
     def serialize(type: PacketType, file_id: int, number_in_window: int, window_number: int, payload: bytes) -> bytes:
         """Create MRP packet"""
-        first_byte: int = (type.value << 4) + file_id
-        packet_number_in_window = number_in_window.to_bytes(
-            PACKET_NUMBER_B, "big")
-        packet_window_number = window_number.to_bytes(
-            WINDOW_SIZE_B, "big")
+        header = CHECKED_HEADER.pack(VERSION_BYTE, type.value, file_id, number_in_window, window_number)
+        checksum = DEFAULT_CHECKSUM_FUNCTION(payload, DEFAULT_CHECKSUM_FUNCTION(header))
+        return header + CHECKSUM.pack(checksum) + payload
 
-        return bytes([first_byte]) + packet_number_in_window + packet_window_number + payload
+    @ staticmethod
+    def serialize_into(buffer: bytearray | memoryview, offset: int, type: PacketType, file_id: int,
+                       number_in_window: int, window_number: int, payload: bytes | memoryview) -> int:
+        """Write MRP packet into a preallocated buffer, return its length"""
+        CHECKED_HEADER.pack_into(buffer, offset, VERSION_BYTE, type.value, file_id,
+                                 number_in_window, window_number)
+        end = offset + HEADER_SIZE + len(payload)
+        buffer[offset + HEADER_SIZE:end] = payload
+        view = memoryview(buffer)
+        checksum = DEFAULT_CHECKSUM_FUNCTION(view[offset + HEADER_SIZE:end],
+                                             DEFAULT_CHECKSUM_FUNCTION(view[offset:offset + CHECKSUM_OFFSET]))
+        CHECKSUM.pack_into(buffer, offset + CHECKSUM_OFFSET, checksum)
+        return end - offset
 
     @ staticmethod
     def broke_packet(data: bytes):
@@ -0,0 +1,164 @@
+import errno
+import socket
+import sys
+
+from socket import SocketType
+from typing import Callable
+from datagramReceiver import MAX_DATAGRAM_SIZE
+from packetParser import MRP, PacketType, HEADER_SIZE
+from rttEstimator import RttEstimator
+from services import log, time_ms
+
+BASE_PLPMTU: int = 1200  # B
+"""Datagram assumed to get through every path, RFC 8899 uses it for IPv6 and recommends it for IPv4"""
+BASE_FRAGMENT_LEN: int = BASE_PLPMTU - HEADER_SIZE  # B
+"""Automatic fragment without path MTU discovery"""
+MAX_PLPMTU: int = MAX_DATAGRAM_SIZE  # B
+MAX_FRAGMENT_LEN: int = MAX_PLPMTU - HEADER_SIZE  # B
+PROBE_SIZES: tuple[int, ...] = (1252, 1392, 1464, 1472, 8972, MAX_PLPMTU)  # B
+"""Probed together first, common link MTUs without the IP and UDP headers:
+IPv6 minimum, WireGuard, PPPoE, Ethernet, jumbo frames and loopback"""
+SETTLE_RTTS: int = 2
+"""Round trips the automatic fragments wait for the first probes, the larger ones not back by then are lost"""
+MAX_PROBES: int = 3
+"""Unanswered probes of one size after which the size does not get through"""
+SEARCH_PRECISION: int = 32  # B
+"""Search ends when the largest confirmed and the smallest failed size are closer"""
+RAISE_TIMER: int = 600000  # ms
+"""Time after a finished search when larger datagrams are probed again"""
+IP_MTU_DISCOVER: int = 10
+IP_PMTUDISC_PROBE: int = 3
+"""Set the don't fragment flag and ignore the path MTU cached by the kernel, Linux only"""
+PROBING_SUPPORTED: bool = sys.platform.startswith("linux")
+"""Without the don't fragment flag the probes are fragmented and every size gets through"""
+
+
+def send_unfragmented(sock: SocketType, data: bytes, address: tuple[str, int]) -> bool:
+    """Send `data` with the don't fragment flag now, return `False` if it is too big for the interface
+
+    The flag is set only for this datagram, the rest is still fragmented when its size was chosen by hand.
+    """
+    mode = sock.getsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER)
+    sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    try:
+        sock.sendto(data, address)
+    except BlockingIOError:
+        # Full socket buffer loses the probe like the wire would
+        pass
+    except OSError as e:
+        if e.errno != errno.EMSGSIZE:
+            # Refused by the host for another reason, the probe is lost like a send of the data would be
+            log.error(f"Sending a probe to {address[0]}:{address[1]} failed: {e}\n")
+            return True
+        return False
+    finally:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, mode)
+    return True
+
+
+class PathMtu:
+    """Largest datagram that gets to the peer without IP fragmentation, RFC 8899 (DPLPMTUD)
+
+    Owned by the connection. Probes are padded `Probe` packets, the peer answers every probe with
+    `ConfirmProbe` carrying its size, so a confirm can't be confused with one of another size.
+    The first round probes `PROBE_SIZES` at once, then the gap between the largest confirmed and
+    the smallest failed size is halved one probe at a time. Sizes are UDP payloads, headers included.
+    Automatic fragments of the first transfers wait only for the first round or `SETTLE_RTTS`.
+    """
+
+    def __init__(self, send: Callable[[bytes], bool], rtt: RttEstimator, destination: str = "") -> None:
+        self.send = send
+        """Sends a probe now with the don't fragment flag, returns `False` if it can't leave the host"""
+        self.rtt = rtt
+        self.destination = destination
+        self.plpmtu: int = BASE_PLPMTU
+        """Largest confirmed datagram"""
+        self.failed: int = MAX_PLPMTU + 1
+        """Smallest datagram that did not get through"""
+        self.probes: dict[int, int] = {}
+        """Amount of probes sent of every size waiting for a confirm"""
+        self.probe_time: int = 0  # ms
+        self.start_time: int = 0  # ms
+        self.searching: bool = False
+        self.settled: bool = not PROBING_SUPPORTED
+        """First round of probes is confirmed or timed out, automatic fragments can be sized"""
+        self.done_time: int | None = None  # ms
+
+    @property
+    def fragment_len(self) -> int:
+        """Payload of a data packet that fills the largest confirmed datagram"""
+        return self.plpmtu - HEADER_SIZE
+
+    def start(self):
+        """Search for a larger datagram than the confirmed one"""
+        if self.searching or not PROBING_SUPPORTED:
+            return
+        self.searching = True
+        self.start_time = time_ms()
+        self.failed = MAX_PLPMTU + 1
+        self.probes = {size: 0 for size in PROBE_SIZES if size > self.plpmtu}
+        self.send_probes()
+
+    @property
+    def settle_deadline(self) -> int:
+        """Time the automatic fragments stop waiting for the first round, before an RTT sample after a timeout"""
+        if self.rtt.srtt is None:
+            return self.start_time + self.rtt.get_timeout()
+        return self.start_time + int(SETTLE_RTTS * self.rtt.srtt) + 1
+
+    def run(self):
+        now = time_ms()
+        if not self.settled and now >= self.settle_deadline:
+            # Search goes on for the next transfers
+            self.settled = True
+        if self.searching and self.probes and now - self.probe_time > self.rtt.get_timeout():
+            for size, sent in list(self.probes.items()):
+                if sent >= MAX_PROBES:
+                    self.failed = min(self.failed, size)
+                    del self.probes[size]
+            self.send_probes()
+        elif self.done_time is not None and now - self.done_time > RAISE_TIMER:
+            self.done_time = None
+            self.start()
+
+    def next_deadline(self) -> int | None:
+        """Return time in ms when `run` has to be called next, `None` if it waits only for confirms"""
+        if self.searching:
+            deadline = self.probe_time + self.rtt.get_timeout() + 1 if self.probes else None
+            if not self.settled and (deadline is None or self.settle_deadline < deadline):
+                deadline = self.settle_deadline
+            return deadline
+        if self.done_time is not None:
+            return self.done_time + RAISE_TIMER + 1
+        return None
+
+    def handle_confirm(self, size: int):
+        if size not in self.probes:
+            # Late confirm of a resent probe
+            return
+        self.plpmtu = max(self.plpmtu, size)
+        # Smaller probes of the round don't matter anymore
+        for probed in [probed for probed in self.probes if probed <= self.plpmtu]:
+            del self.probes[probed]
+        if not self.probes:
+            self.send_probes()
+
+    def send_probes(self):
+        """Send the waiting probes or pick the next size, sizes too big to leave the host fail at once"""
+        while True:
+            if not self.probes:
+                self.settled = True
+                if self.failed - self.plpmtu <= SEARCH_PRECISION:
+                    self.searching = False
+                    self.done_time = time_ms()
+                    log.info("Path MTU -> %s: %d B\n", self.destination, self.plpmtu)
+                    return
+                self.probes[(self.plpmtu + self.failed) // 2] = 0
+            for size in list(self.probes):
+                self.probes[size] += 1
+                if not self.send(MRP.serialize(PacketType.Probe, 0, 0, size, bytes(size - HEADER_SIZE))):
+                    self.failed = min(self.failed, size)
+                    del self.probes[size]
+            if self.probes:
+                self.probe_time = time_ms()
+                return
@@ -1,14 +1,27 @@
+import hashlib
 import os
 
-from services import sha256_file, time_ms, MSG_RECV, log
+from services import time_ms, log
+from collections import deque
 from enum import Enum
-from typing import Callable
-from packetParser import MRP, PacketType
+from functools import partial
+from time import perf_counter
+from typing import Any, Callable
+from ioPool import IoQueue
+from packetParser import MRP, PacketType, MAX_WINDOWS_AHEAD, INIT_TRAILING_HASH, INIT_CHUNK_HASHES, INIT_RESUMABLE
 from fileData import FileData
+from rttEstimator import RttEstimator
+from transferStats import TransferStats
+from metrics import Metrics
+from journal import TransferJournal
 
 
 CONFIRM_RESEND_TIMEOUT = 5000  # ms
 TRANSFER_TIMEOUT = 10000  # ms
+HASH_CHUNK: int = 1024 * 1024
+"""Data of the previous attempt of a resumed transfer is read back and hashed in chunks of this size"""
+MAX_PENDING_WRITES: int = 16
+"""Windows waiting for the disk, beyond that a window is confirmed only once written, so the sender slows down"""
 
 
 class ReceiveState(Enum):
@@ -17,8 +30,35 @@ class ReceiveState(Enum):
     End_transfer = 2
 
 
+class WindowSlots:
+    """Packets of one window in slots indexed by `number_in_window` with an occupancy bitmap"""
+    __slots__ = ("packets", "bits", "count")
+
+    def __init__(self, size: int) -> None:
+        self.packets: list[MRP | None] = [None] * size
+        self.bits: int = 0
+        """Bit `size - number_in_window - 1` is set for every received packet, the layout of the confirm"""
+        self.count: int = 0
+
+    def add(self, packet: MRP) -> bool:
+        """Store the packet, return `False` for a duplicate or a number outside of the window
+
+        Payload is not copied, the caller detaches it before the next receive.
+        """
+        index = packet.number_in_window
+        if index >= len(self.packets) or self.packets[index] is not None:
+            return False
+        self.packets[index] = packet
+        self.bits |= 1 << (len(self.packets) - index - 1)
+        self.count += 1
+        return True
+
+    def is_full(self) -> bool:
+        return self.count == len(self.packets)
+
+
 class ReceiveFile:
-    def __init__(self, destination: tuple[str, int], send_function_injection: Callable[[bytes], None], packet: MRP | None = None) -> None:
+    def __init__(self, destination: tuple[str, int], send_function_injection: Callable[[bytes], None], packet: MRP | None = None, rtt: RttEstimator | None = None, run_io: Callable[..., None] | None = None) -> None:
         self.id: int = 0
         self.dst = f"{destination[0]}:{destination[1]}"
         self.send = send_function_injection
@@ -26,143 +66,433 @@ class ReceiveFile:
         self.fragment_len: int = 1
         self.init_data_raw = b""
         self.init_data_end_window: int = 0
-        self.window: list[MRP] = []
+        self.window = WindowSlots(self.window_size)
+        self.future_windows: dict[int, WindowSlots] = {}
+        """Packets of the next `MAX_WINDOWS_AHEAD` windows sent by a sliding window sender"""
         self.window_number: int = 0
         self.last_packet_time = time_ms()
         self.state = ReceiveState.Wait_init
         self.received_bytes: int = 0
         self.start_time: int = 0
+        self.end_time: int = 0  # ms
+        self.succeeded: bool = False
+        """Whole file is written and its hash matches"""
+        self.metrics = Metrics()
+        self.highest_sequence: int = -1
+        """Highest `window_number * window_size + number_in_window` received, lower new packets are out of order"""
         self.last_window_confirm: bytes = b""
         self.confirm_resend_time: int = 0
         self.inited = False
-        self.window_timeout: int = 100
+        self.rtt: RttEstimator = rtt if rtt is not None else RttEstimator()
+        self.backoff: int = 0
+        """Amount of confirm resends without new packets"""
+        self.rtt_probe: tuple[int, int, bool] | None = None
+        """(window number, time, valid) of the confirm waiting for the next packet of the window"""
         self.size: int = 9999
         self.hash: str = ""
+        self.trailing_hash: bool = False
+        """The hash comes in the `Integrity` packet after the last window instead of in the init data"""
         self.path: str = ""
+        self.file: Any = None
+        self.positional: bool = hasattr(os, "pwrite")
+        """Write fragments at their offsets, otherwise in order, needed to resume a transfer"""
+        self.jobs = IoQueue(run_io)
+        """Disk writes and hashing run in the pool of the server, in order"""
+        self.unwritten: deque[tuple[int, bytes]] = deque()
+        """Offsets and payloads of the fragments waiting for their positional write, drained in the pool"""
+        self.draining: bool = False
+        """A job writing `unwritten` is submitted"""
+        self.hasher = hashlib.sha256()
+        """SHA-256 of the data written in order so far, of the current chunk in chunked mode, used by the jobs"""
+        self.hashed_bytes: int = 0
+        self.chunked: bool = False
+        """Init data has hashes of the file chunks, every chunk is verified once it is written"""
+        self.chunk_size: int = 0
+        self.chunk_hashes: list[bytes] = []
+        self.checked_chunks: int = 0
+        self.repairs: dict[int, set[int]] = {}
+        """Fragments still missing to repair the corrupted chunk"""
+        self.journal: TransferJournal | None = None
+        """Progress of a resumable transfer, the partial file is kept when it fails"""
+        self.resume_window: int = 0
+        """Data windows written by the previous attempt, the sender starts after them"""
 
         if packet is not None:
             self.start_time = time_ms()
             self.add_packet(packet)
 
     def run(self):
-        if (self.state == ReceiveState.Wait_window
-                and self.last_packet_time + self.window_timeout < time_ms()):
-            if self.inited and self.received_bytes < self.size:
+        if self.state == ReceiveState.Wait_window:
+            if self.is_received():
+                # Wait for a resend of the last packet, its confirm could be lost
+                if self.last_packet_time + self.linger_timeout < time_ms():
+                    self.end_transfer()
+            elif self.last_packet_time + self.window_timeout < time_ms():
                 # Resend the last window
                 if time_ms() - self.last_packet_time > TRANSFER_TIMEOUT:
                     self.handle_error_transfer()
                 elif time_ms() - self.confirm_resend_time > self.window_timeout:
                     self.confirm_resend_time = time_ms()
                     self.handle_lost_packets()
-            if not self.inited:
-                pass
-            else:
-                self.end_transfer()
+                    self.backoff += 1
 
         return self.state != ReceiveState.End_transfer
 
+    @property
+    def window_timeout(self) -> int:
+        """Time without packets after which the lost packets are reported, ms"""
+        return self.rtt.get_timeout(self.backoff)
+
+    @property
+    def linger_timeout(self) -> int:
+        """Time after the last packet of a complete transfer, longer than the retransmission timeout of the sender"""
+        return self.rtt.get_timeout(self.backoff + 2)
+
+    def next_deadline(self) -> int | None:
+        """Return time in ms when `run` has to be called next, `None` if it waits only for packets"""
+        if self.state == ReceiveState.End_transfer:
+            return 0
+        if self.state == ReceiveState.Wait_window:
+            if not self.is_received():
+                return min(max(self.last_packet_time, self.confirm_resend_time) + self.window_timeout,
+                           self.last_packet_time + TRANSFER_TIMEOUT) + 1
+            return self.last_packet_time + self.linger_timeout + 1
+
+        return None
+
+    def is_received(self) -> bool:
+        """All data is written and the hash to check it is known, in chunked mode all chunks are verified"""
+        return (self.inited and self.received_bytes >= self.size and self.hash != ""
+                and not self.repairs and self.checked_chunks == len(self.chunk_hashes))
+
     def handle_error_transfer(self):
-        if self.path.endswith(MSG_RECV):
-            log.warn(
-                f"Message transfer failed <- {self.dst}\n")
-        else:
-            log.warn(
-                f"{self.path} Receiving failed, host timed out <- {self.dst}\n")
+        log.warn(
+            f"{self.path} Receiving failed, host timed out <- {self.dst}\n")
+        self.end_time = time_ms()
         self.state = ReceiveState.End_transfer
-        self.file.close()
-        os.remove(self.path)
+        if self.inited:
+            if self.journal is not None:
+                log.warn(f"{self.path} Partial file is kept to resume the transfer\n")
+            self.jobs.submit(self.close_file, None, True)
 
-    def end_transfer(self):
-        end_time = time_ms()
-        self.file.seek(0)
-        sha256: str = sha256_file(self.path).hex()
-        self.file.seek(0)
-        if self.path.endswith(MSG_RECV):
-            msg = self.file.read().decode("utf-8")
-            # Delete the file
+    def close_file(self, failed: bool):
+        """Close the file after its last write, runs in the pool
+
+        Failed transfer keeps the partial file only when it can be resumed.
+        """
+        if self.file is not None:
             self.file.close()
+        if self.journal is not None:
+            if failed:
+                self.journal.close()
+            else:
+                self.journal.remove()
+        elif failed:
             os.remove(self.path)
-            log.critical(
-                f"{self.dst}<<<< {msg}\n")
-        else:
-            if self.size > self.received_bytes:
-                self.handle_error_transfer()
-                return
-            log.critical(
-                f"\nFile received successfully <- {self.dst}\n\
-                    \tFile: {self.path} \n\
-                    \tFragment size: {self.fragment_len} B \n\
-                    \tWindow size: {self.window_size} \n\
-                    \tSHA256 expected: {self.hash} \n\
-                    \tSHA256 received: {sha256} \n\
-                    \tTime: {int((time_ms() - self.start_time) / 1000)}s \n\
-                    \tFile size: {self.size} B \n\
-                    \tAverage speed {int(self.size/ (end_time - self.start_time)) } KiB/s\n")
-            self.file.close()
 
+    def end_transfer(self):
+        end_time = time_ms()
+        # All windows were hashed by their write jobs before they were counted as received
+        sha256: str = self.hash if self.chunked else self.hasher.hexdigest()
+        if self.chunked:
+            # Sender waits until all chunks are verified
+            self.send(MRP.serialize(PacketType.ConfirmIntegrity, self.id, 0, 0, b""))
+        if self.size > self.received_bytes:
+            self.handle_error_transfer()
+            return
+        if sha256 != self.hash:
+            log.error(f"{self.path} SHA256 mismatch <- {self.dst}\n")
+        log.critical(
+            f"\nFile received successfully <- {self.dst}\n\
+                \tFile: {self.path} \n\
+                \tFragment size: {self.fragment_len} B \n\
+                \tWindow size: {self.window_size} \n\
+                \tSHA256 expected: {self.hash} \n\
+                \tSHA256 received: {sha256} \n\
+                \tTime: {int((time_ms() - self.start_time) / 1000)}s \n\
+                \tFile size: {self.size} B \n\
+                \tAverage speed {int(self.size / max(end_time - self.start_time, 1) * 1000 / 1024)} KiB/s\n")
+        self.jobs.submit(self.close_file, None, False)
+
+        self.succeeded = sha256 == self.hash
+        self.end_time = end_time
         self.state = ReceiveState.End_transfer
 
     def handle_window(self):
-        if len(self.window) == self.window_size:
+        if self.window.is_full():
             if self.window_number < self.init_data_end_window:
                 # Receive init datafile
                 self.handle_init_window()
             elif self.window_number == self.init_data_end_window:
                 self.handle_init_window()
                 # Parse the init data
-                file_data: FileData = FileData(data=self.init_data_raw)
+                file_data: FileData = FileData(data=self.init_data_raw,
+                                               with_hash=not self.trailing_hash and not self.chunked,
+                                               chunked=self.chunked)
                 self.size = file_data.size
-                self.hash = file_data.hash
+                self.hash = file_data.root if self.chunked else file_data.hash
+                self.chunk_size = file_data.chunk_size
+                self.chunk_hashes = file_data.chunk_hashes
                 self.path = file_data.path
                 self.inited = True
-                try:
-                    self.file = open(self.path, "wb+")
-                except Exception as e:
-                    log.critical(f"Error opening file: {e}")
-                    self.handle_error_transfer()
-                    return
+                self.open_file()
             else:
                 # Receive file data/
                 self.handle_file_window()
         else:
             self.last_window_confirm = b""
 
-    def handle_file_window(self):
-        # Sort the packets
-        self.window.sort(key=lambda x: x.number_in_window)
-        # Check if the window is correct
-        for i in range(self.window_size):
-            if self.window[i].number_in_window != i:
-                self.window.clear()
-                return
+    def open_file(self):
+        """Open the file in the pool, windows completed meanwhile are written after it"""
+        resumed = 0
+        if self.resume_window > 0 and self.journal is not None:
+            resumed = min(self.resume_window * self.window_size * self.fragment_len, self.size)
+            log.warn(f"{self.path} Resuming from {resumed} B <- {self.dst}\n")
+        self.jobs.submit(self.prepare_file, partial(self.handle_written, resumed, None), resumed)
+        # Fragments of the windows buffered before the file was known are written after it is open
+        for window in self.future_windows.values():
+            for packet in window.packets:
+                if packet is not None:
+                    self.write_fragment(packet)
 
-        # Write the data to the file
-        for packet in self.window:
-            self.file.write(packet.payload)
-            self.received_bytes += len(packet.payload)
+    def prepare_file(self, resumed: int) -> list[bool]:
+        """Open the file and verify the data of the previous attempt, runs in the pool"""
+        start = perf_counter()
+        if resumed > 0 and self.journal is not None:
+            if self.journal.file_name != self.path:
+                os.replace(self.journal.file_name, self.path)
+            self.file = open(self.path, "rb+")
+        else:
+            self.file = open(self.path, "wb+")
+        if self.positional:
+            self.preallocate()
+        if self.journal is not None:
+            self.journal.open(self.path)
+        self.metrics.disk_time.observe((perf_counter() - start) * 1000)
+        if self.journal is not None:
+            # Data of the previous attempt is verified before the rest arrives
+            start = perf_counter()
+            results = self.hash_written(resumed)
+            self.metrics.hash_time.observe((perf_counter() - start) * 1000)
+            return results
+        return []
 
-        log.debug(
-            f"F:{self.id} W:{self.window_number}: {round((self.received_bytes / self.size) * 100, 2)}% <-\t{self.dst}")
-        # Send the confirm
+    def handle_file_window(self):
+        # Slots are already in order, the payloads are copies owned by the window
+        fragments = [(self.get_offset(packet.window_number, packet.number_in_window), packet.payload)
+                     for packet in self.window.packets if packet is not None]
+        written = sum(len(payload) for _, payload in fragments)
+        data_window = self.window_number - self.init_data_end_window - 1 + self.resume_window
+        # Formatted only when debug records are written
+        log.debug("F:%d W:%d: %.2f%% <-\t%s", self.id, self.window_number,
+                  (self.received_bytes + written) / self.size * 100, self.dst)
         confirm_payload = ((2 ** self.window_size) -
                            1).to_bytes(self.window_size // 8, "big")
-        self.send(MRP.serialize(PacketType.ConfirmData,
-                  self.id, 0, self.window_number, confirm_payload))
+        if self.jobs.pending >= MAX_PENDING_WRITES:
+            # Disk is behind, the window is confirmed after it is written
+            self.jobs.submit(self.write_window, partial(self.handle_written, written, self.window_number),
+                             fragments, data_window)
+        else:
+            self.jobs.submit(self.write_window, partial(self.handle_written, written, None), fragments, data_window)
+            # Send the confirm
+            self.send(MRP.serialize(PacketType.ConfirmData,
+                      self.id, 0, self.window_number, confirm_payload))
 
         self.last_window_confirm = confirm_payload
         self.window_number += 1
-        self.window = []
+        self.window = WindowSlots(self.window_size)
 
-    def handle_init_window(self):
-        # Sort the packets
-        self.window.sort(key=lambda x: x.number_in_window)
-        # Check if the window is correct
-        for i in range(self.window_size):
-            if self.window[i].number_in_window != i:
-                raise ValueError("Window is not correct")
+    def preallocate(self):
+        """Reserve the whole file, so positional writes don't fragment it or fail on a full disk midway"""
+        fd = self.file.fileno()
+        try:
+            os.posix_fallocate(fd, 0, self.size)
+        except (AttributeError, OSError):
+            # Not supported by the platform or the file system, at least set the size
+            os.ftruncate(fd, self.size)
+
+    def write_window(self, fragments: list[tuple[int, bytes]], data_window: int) -> list[bool]:
+        """Hash the fragments of a complete window, write them in order unless they are written already
+
+        Runs in the pool, return the verification results of the chunks completed by the window.
+        """
+        if self.positional:
+            # Rest of the window could still wait for its positional write, the journal marks only written data
+            self.write_unwritten()
+        results: list[bool] = []
+        disk_time = hash_time = 0.0  # s
+        for _, payload in fragments:
+            start = perf_counter()
+            if not self.positional:
+                self.file.write(payload)
+            written = perf_counter()
+            results += self.hash_data(payload)
+            disk_time += written - start
+            hash_time += perf_counter() - written
+        if self.journal is not None:
+            self.journal.mark(data_window)
+        self.metrics.disk_time.observe(disk_time * 1000)
+        self.metrics.hash_time.observe(hash_time * 1000)
+        return results
 
+    def write_fragment(self, packet: MRP):
+        """Queue the fragment for its positional write, one job writes all fragments queued meanwhile"""
+        self.unwritten.append((self.get_offset(packet.window_number, packet.number_in_window), packet.payload))
+        if not self.draining:
+            self.draining = True
+            self.jobs.submit(self.write_unwritten, self.handle_unwritten)
+
+    def write_unwritten(self):
+        """Write the queued fragments at their offsets, runs in the pool"""
+        start = perf_counter()
+        fd = self.file.fileno()
+        while self.unwritten:
+            offset, payload = self.unwritten.popleft()
+            os.pwrite(fd, payload, offset)
+        self.metrics.disk_time.observe((perf_counter() - start) * 1000)
+
+    def handle_unwritten(self, result: None | BaseException):
+        self.draining = False
+        if isinstance(result, BaseException) and self.state != ReceiveState.End_transfer:
+            log.critical(f"Error writing file: {result}")
+            self.handle_error_transfer()
+
+    def handle_written(self, written: int, confirm_window: int | None, result: list[bool] | BaseException):
+        """Count the data written in the pool and request repairs of the chunks that failed verification"""
+        if self.state == ReceiveState.End_transfer:
+            return
+        if isinstance(result, BaseException):
+            log.critical(f"Error writing file: {result}")
+            self.handle_error_transfer()
+            return
+        self.received_bytes += written
+        for verified in result:
+            if not verified:
+                self.request_repair(self.checked_chunks)
+            self.checked_chunks += 1
+        if confirm_window is not None:
+            self.send(MRP.serialize(PacketType.ConfirmData, self.id, 0, confirm_window,
+                                    ((2 ** self.window_size) - 1).to_bytes(self.window_size // 8, "big")))
+
+    def get_offset(self, window_number: int, number_in_window: int) -> int:
+        """Position of the fragment in the file, all fragments but the last one are `fragment_len` long"""
+        data_window = window_number - self.init_data_end_window - 1 + self.resume_window
+        return (data_window * self.window_size + number_in_window) * self.fragment_len
+
+    def hash_written(self, end: int) -> list[bool]:
+        """Update the hash with the data till `end` read back in chunks, runs in the pool"""
+        fd = self.file.fileno()
+        results: list[bool] = []
+        while self.hashed_bytes < end:
+            chunk = os.pread(fd, min(HASH_CHUNK, end - self.hashed_bytes), self.hashed_bytes)
+            if not chunk:
+                break
+            results += self.hash_data(chunk)
+        return results
+
+    def hash_data(self, data: bytes | memoryview) -> list[bool]:
+        """Feed the data written in order to the file hash, in chunked mode verify every completed chunk
+
+        Runs in the pool, return whether each completed chunk matches its hash, the loop requests the repairs.
+        """
+        if not self.chunked:
+            self.hasher.update(data)
+            self.hashed_bytes += len(data)
+            return []
+        results: list[bool] = []
+        view = memoryview(data)
+        while len(view) > 0:
+            chunk = self.hashed_bytes // self.chunk_size
+            chunk_end = min((chunk + 1) * self.chunk_size, self.size)
+            take = min(len(view), chunk_end - self.hashed_bytes)
+            self.hasher.update(view[:take])
+            self.hashed_bytes += take
+            view = view[take:]
+            if self.hashed_bytes == chunk_end:
+                results.append(self.hasher.digest() == self.chunk_hashes[chunk])
+                self.hasher = hashlib.sha256()
+        return results
+
+    def request_repair(self, chunk: int):
+        start = chunk * self.chunk_size
+        end = min(start + self.chunk_size, self.size)
+        log.warn(f"{self.path} Chunk {chunk} is corrupted, requesting repair <- {self.dst}\n")
+        self.repairs[chunk] = set(range(start // self.fragment_len, (end - 1) // self.fragment_len + 1))
+        self.send(MRP.serialize(PacketType.RepairRequest, self.id, 0, chunk, b""))
+
+    def add_repair_packet(self, packet: MRP):
+        """Write the resent fragment, verify the chunk again once all its fragments are back"""
+        fragment = packet.window_number
+        offset = fragment * self.fragment_len
+        last_chunk = (offset + self.fragment_len - 1) // self.chunk_size
+        chunks = [chunk for chunk in range(offset // self.chunk_size, last_chunk + 1)
+                  if fragment in self.repairs.get(chunk, ())]
+        if not chunks:
+            return
+        for chunk in chunks:
+            self.repairs[chunk].discard(fragment)
+        complete = [chunk for chunk in chunks if not self.repairs[chunk]]
+        self.jobs.submit(self.write_repair, partial(self.handle_repaired, complete), offset, bytes(packet.payload),
+                         complete)
+
+    def write_repair(self, offset: int, payload: bytes, complete: list[int]) -> list[bool]:
+        """Write the repaired fragment and verify the chunks it completed, runs in the pool"""
+        start = perf_counter()
+        self.write_at(offset, payload)
+        self.metrics.disk_time.observe((perf_counter() - start) * 1000)
+        results: list[bool] = []
+        for chunk in complete:
+            start = perf_counter()
+            chunk_start = chunk * self.chunk_size
+            data = self.read_at(chunk_start, min(self.chunk_size, self.size - chunk_start))
+            results.append(hashlib.sha256(data).digest() == self.chunk_hashes[chunk])
+            self.metrics.hash_time.observe((perf_counter() - start) * 1000)
+        return results
+
+    def handle_repaired(self, complete: list[int], result: list[bool] | BaseException):
+        if self.state == ReceiveState.End_transfer:
+            return
+        if isinstance(result, BaseException):
+            log.critical(f"Error writing file: {result}")
+            self.handle_error_transfer()
+            return
+        for chunk, verified in zip(complete, result):
+            if verified:
+                del self.repairs[chunk]
+                log.info(f"{self.path} Chunk {chunk} repaired <- {self.dst}\n")
+            else:
+                self.request_repair(chunk)
+
+    def write_at(self, offset: int, data: bytes | memoryview):
+        if self.positional:
+            os.pwrite(self.file.fileno(), data, offset)
+            return
+        position = self.file.tell()
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.seek(position)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if self.positional:
+            return os.pread(self.file.fileno(), size, offset)
+        position = self.file.tell()
+        self.file.seek(offset)
+        data = self.file.read(size)
+        self.file.seek(position)
+        return data
+
+    def store_payload(self, packet: MRP):
+        """Keep a copy of the payload until the window is hashed, write data right away once the file is known
+
+        Fragments reach the disk out of order at their offsets, the window is hashed in order when complete.
+        """
+        packet.detach()
+        if self.positional and self.inited and packet.window_number > self.init_data_end_window:
+            self.write_fragment(packet)
+
+    def handle_init_window(self):
         # Add the data to the init data
-        for packet in self.window:
+        for packet in self.window.packets:
             self.init_data_raw += packet.payload
 
         # Send the confirm
@@ -173,51 +503,147 @@ class ReceiveFile:
 
         self.last_window_confirm = confirm_payload
         self.window_number += 1
-        self.window = []
+        self.window = WindowSlots(self.window_size)
 
     def handle_lost_packets(self):
         if self.last_window_confirm != b"":
             # Resend the last confirm
             self.send(MRP.serialize(PacketType.ConfirmData,
                       self.id, 0, self.window_number - 1, self.last_window_confirm))
-            log.critical(
-                f"F:{self.id} W:{self.window_number} Resend confirm <- {self.dst}\n")
-        else:
-            self.window.sort(key=lambda packet: packet.number_in_window)
-            payload = self.get_sum_confirm()
-            packet = MRP.serialize(
-                PacketType.ConfirmData, self.id, 0, self.window_number, payload)
-            self.send(packet)
-
-    def get_sum_confirm(self) -> bytes:
-        result = 0
-        for packet in self.window:
-            result |= 1 << (self.window_size - packet.number_in_window - 1)
-        let = result.to_bytes(self.window_size // 8, "big")
-        if len(let) != self.window_size // 8:
-            raise ValueError("Wrong size")
-
-        return let
+            log.info("F:%d W:%d Resend confirm <- %s\n", self.id, self.window_number, self.dst)
+
+        # Confirm of the received packets of the current window, the whole window could be lost too
+        self.start_rtt_probe(self.window_number)
+        self.send(MRP.serialize(PacketType.ConfirmData, self.id, 0,
+                                self.window_number, self.get_sum_confirm()))
+        # Selective confirms of the windows buffered from the sliding window sender,
+        # complete ones are skipped as a full confirm means all windows till it are written
+        for window_number, window in self.future_windows.items():
+            if window.is_full():
+                continue
+            self.send(MRP.serialize(PacketType.ConfirmData, self.id, 0,
+                                    window_number, self.get_sum_confirm(window)))
+        # Repair requests or the repaired fragments were lost
+        for chunk in self.repairs:
+            self.send(MRP.serialize(PacketType.RepairRequest, self.id, 0, chunk, b""))
+
+    def get_sum_confirm(self, window: WindowSlots | None = None) -> bytes:
+        # Every bit is a packet in the window, 1 = received, 0 = not received
+        return (self.window if window is None else window).bits.to_bytes(self.window_size // 8, "big")
 
     def add_packet(self, packet: MRP):
         self.last_packet_time = time_ms()
         if self.state == ReceiveState.Wait_init and packet.type == PacketType.Init_file_transfer:
-            self.init_data_end_window = int.from_bytes(
-                packet.payload, "big")
+            self.init_data_end_window = packet.payload[0] if len(packet.payload) > 0 else 0
+            self.trailing_hash = len(packet.payload) > 1 and bool(packet.payload[1] & INIT_TRAILING_HASH)
+            self.chunked = len(packet.payload) > 1 and bool(packet.payload[1] & INIT_CHUNK_HASHES)
             self.id = packet.transfer_id
             self.window_size = packet.number_in_window
             self.fragment_len = packet.window_number
-            self.window_timeout = (
-                self.window_size * self.fragment_len**2) // 700000
-            if self.window_timeout < 100:
-                self.window_timeout = 100
+            self.window = WindowSlots(self.window_size)
             self.state = ReceiveState.Wait_window
-            self.send(MRP.serialize(
-                PacketType.ConfirmInit_file_transfer, self.id, 0, 0, b""))
-        elif self.state == ReceiveState.Wait_window:
-            self.window.append(packet)
+            if len(packet.payload) > 1 and packet.payload[1] & INIT_RESUMABLE:
+                self.load_journal(packet)
+            self.confirm_init()
+        elif self.state == ReceiveState.Wait_window and packet.type == PacketType.Data:
+            self.add_window_packet(packet)
+        elif self.state == ReceiveState.Wait_window and packet.type == PacketType.Integrity:
+            if self.trailing_hash:
+                self.hash = bytes(packet.payload).hex()
+            # Chunked transfer is confirmed only after all chunks are verified
+            if not self.chunked or self.is_received():
+                self.send(MRP.serialize(
+                    PacketType.ConfirmIntegrity, self.id, 0, packet.window_number, b""))
+        elif self.state == ReceiveState.Wait_window and packet.type == PacketType.RepairData:
+            if self.chunked and self.inited:
+                self.add_repair_packet(packet)
+        elif self.state == ReceiveState.Wait_window and packet.type == PacketType.Init_file_transfer:
+            # Confirm of the init was lost
+            self.confirm_init()
+
+    def load_journal(self, packet: MRP):
+        """Find the progress of the previous attempt by the file hash and size from the init packet"""
+        file_hash = bytes(packet.payload[2:34])
+        size = int.from_bytes(packet.payload[34:42], "big")
+        self.journal = TransferJournal(file_hash, size, self.window_size, self.fragment_len)
+        # Resumed data is written at its offset, so positional writes are needed
+        if self.positional and self.journal.load() and os.path.isfile(self.journal.file_name):
+            self.resume_window = self.journal.completed_windows()
+
+    def confirm_init(self):
+        payload = self.resume_window.to_bytes(4, "big") if self.journal is not None else b""
+        self.send(MRP.serialize(
+            PacketType.ConfirmInit_file_transfer, self.id, 0, 0, payload))
+
+    def add_window_packet(self, packet: MRP):
+        ahead = packet.window_number - self.window_number
+        if ahead == 0:
+            # Ignore retransmitted duplicates
+            if not self.window.add(packet):
+                self.metrics.duplicates += 1
+                return
+            self.count_order(packet)
+            self.store_payload(packet)
+            self.backoff = 0
+            if self.rtt_probe is not None and self.rtt_probe[0] == packet.window_number:
+                if self.rtt_probe[2]:
+                    self.rtt.add_sample(time_ms() - self.rtt_probe[1])
+                self.rtt_probe = None
+        elif 0 < ahead <= MAX_WINDOWS_AHEAD:
+            self.backoff = 0
+            window = self.future_windows.get(packet.window_number)
+            if window is None:
+                window = self.future_windows[packet.window_number] = WindowSlots(self.window_size)
+                # Sender moved to the next window, so the missing packets of the current one are lost
+                if 0 < self.window.count < self.window_size:
+                    self.send(MRP.serialize(PacketType.ConfirmData, self.id, 0,
+                                            self.window_number, self.get_sum_confirm()))
+            if window.add(packet):
+                self.count_order(packet)
+                self.store_payload(packet)
+            else:
+                self.metrics.duplicates += 1
+            return
+        else:
+            # Packet of already confirmed window or too far ahead
+            self.metrics.duplicates += ahead < 0
+            if (ahead == -1 and self.last_window_confirm != b""
+                    and time_ms() - self.confirm_resend_time > self.window_timeout):
+                # Sender didn't get the confirm of the previous window
+                self.confirm_resend_time = time_ms()
+                self.send(MRP.serialize(PacketType.ConfirmData, self.id, 0,
+                                        self.window_number - 1, self.last_window_confirm))
+            return
+
+        window_number = self.window_number
+        self.handle_window()
+        # Continue with the buffered windows after the current one was completed
+        while (self.window_number != window_number and self.window_number in self.future_windows
+               and self.state == ReceiveState.Wait_window):
+            window_number = self.window_number
+            self.window = self.future_windows.pop(window_number)
             self.handle_window()
 
+        # Window by window sender sends the next window after the confirm arrives
+        if self.window_number != window_number and self.window.count == 0:
+            self.start_rtt_probe(self.window_number)
+
+    def count_order(self, packet: MRP):
+        """New packet sent before the highest one received so far is out of order"""
+        sequence = packet.window_number * self.window_size + packet.number_in_window
+        if sequence < self.highest_sequence:
+            self.metrics.out_of_order += 1
+        else:
+            self.highest_sequence = sequence
+
+    def start_rtt_probe(self, window_number: int):
+        """Measure the time from a confirm to the next packet of `window_number`"""
+        if self.rtt_probe is not None and self.rtt_probe[0] == window_number:
+            # Karn's algorithm, the answer can belong to any of the sent confirms
+            self.rtt_probe = (window_number, self.rtt_probe[1], False)
+        else:
+            self.rtt_probe = (window_number, time_ms(), True)
+
     def rename_file(self, full_name: str):
         postfix = full_name.split('.')[-1]
         # Remove / and . from the full name
@@ -230,10 +656,17 @@ class ReceiveFile:
         return f'./src/save/!{file_name}!.{postfix}'
 
     def close(self):
+        if self.state == ReceiveState.End_transfer:
+            return
         if self.size > self.received_bytes:
             self.handle_error_transfer()
         else:
             log.warn(f"File transfer complete {self.path}\n")
-        self.file.close()
+            self.jobs.submit(self.close_file, None, False)
+            self.end_time = time_ms()
         self.state = ReceiveState.End_transfer
         self.last_packet_time = time_ms()
+
+    def stats(self) -> TransferStats:
+        return TransferStats(self.id, self.dst, self.path, self.size if self.inited else 0, self.start_time,
+                             self.end_time or time_ms(), self.succeeded)
@@ -0,0 +1,57 @@
+from metrics import Histogram
+
+INITIAL_RTO: int = 300  # ms
+"""Retransmission timeout before the first RTT sample"""
+MIN_RTO: int = 20  # ms
+MAX_RTO: int = 5000  # ms
+CLOCK_GRANULARITY: int = 1  # ms
+RTT_ALPHA: float = 1 / 8
+RTT_BETA: float = 1 / 4
+
+
+class RttEstimator:
+    """Smoothed round trip time of the connection, RFC 6298
+
+    Samples are taken from confirms of packets that were sent only once (Karn's algorithm),
+    users keep their own backoff counter and pass it to `get_timeout`.
+    """
+
+    def __init__(self, histogram: Histogram | None = None) -> None:
+        self.histogram = histogram
+        """Gets every sample, the RTT distribution of the metrics"""
+        self.srtt: float | None = None  # ms
+        self.rttvar: float = 0  # ms
+        self.rto: float = INITIAL_RTO  # ms
+        self.samples: int = 0
+        self.last_sample: int | None = None  # ms
+        self.min_sample: int | None = None  # ms
+        """Shortest round trip, a confirm sooner than it after a resend answers the original"""
+
+    def add_sample(self, rtt: int):
+        rtt = max(rtt, 0)
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar), MIN_RTO), MAX_RTO)
+        self.samples += 1
+        self.last_sample = rtt
+        self.min_sample = rtt if self.min_sample is None else min(self.min_sample, rtt)
+        if self.histogram is not None:
+            self.histogram.observe(rtt)
+
+    def get_timeout(self, backoff: int = 0) -> int:
+        """Return the retransmission timeout in ms doubled `backoff` times"""
+        return int(min(self.rto * 2 ** backoff, MAX_RTO))
+
+    def stats(self) -> dict[str, float | int | None]:
+        return {
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "rto": self.rto,
+            "samples": self.samples,
+            "last_sample": self.last_sample,
+            "min_sample": self.min_sample,
+        }
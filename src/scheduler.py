@@ -0,0 +1,143 @@
+from collections import deque
+from enum import IntEnum
+from math import ceil
+from typing import TYPE_CHECKING
+
+from services import time_ms
+from congestion import CongestionController
+
+if TYPE_CHECKING:
+    from sendFile import SendFile
+
+QUANTUM: int = 1500  # B
+"""Bytes a transfer may send per round, a packet may overdraw it and the rest is paid in the next rounds"""
+MAX_ACTIVE_TRANSFERS: int = 64
+"""Sending transfers started at once, the rest waits, so thousands of init packets don't go out in one burst"""
+
+
+class Priority(IntEnum):
+    """Lower class is served only when no transfer of a higher class has packets to send"""
+    High = 0
+    Normal = 1
+    Bulk = 2
+
+
+class TransferScheduler:
+    """Decides which sending transfer of the connection puts the next new packet on the wire
+
+    Deficit round robin between the transfers of one priority class, strict priority between
+    the classes. All transfers share the congestion window and the pacer of the connection,
+    retransmissions are sent by the transfers directly.
+    """
+
+    def __init__(self, congestion: CongestionController) -> None:
+        self.congestion = congestion
+        self.queues: dict[Priority, deque["SendFile"]] = {priority: deque() for priority in Priority}
+        """Transfers with new packets ready, the head of the queue is served next"""
+        self.deficit: dict[int, int] = {}
+        """Bytes each queued transfer may still send in its round, by transfer id"""
+        self.active: set[int] = set()
+        """Ids of the started transfers"""
+        self.waiting: dict[Priority, deque["SendFile"]] = {priority: deque() for priority in Priority}
+        """Transfers not started yet, they start in order of priority when an active one ends"""
+        self.running: bool = False
+
+    def add(self, transfer: "SendFile"):
+        """New transfer starts at once or waits for a free slot"""
+        if len(self.active) < MAX_ACTIVE_TRANSFERS:
+            self.active.add(transfer.id)
+            transfer.admitted = True
+        else:
+            self.waiting[transfer.priority].append(transfer)
+
+    def wake(self, transfer: "SendFile"):
+        """Transfer has new packets, queue it and send what the congestion control allows"""
+        if not transfer.queued:
+            transfer.queued = True
+            self.deficit[transfer.id] = 0
+            self.queues[transfer.priority].append(transfer)
+        self.run()
+
+    def remove(self, transfer: "SendFile"):
+        """Forget the ended transfer and start the next waiting one"""
+        if transfer.queued:
+            transfer.queued = False
+            self.queues[transfer.priority].remove(transfer)
+            del self.deficit[transfer.id]
+        if transfer.admitted:
+            self.active.discard(transfer.id)
+        elif transfer in self.waiting[transfer.priority]:
+            self.waiting[transfer.priority].remove(transfer)
+        for queue in self.waiting.values():
+            while queue and len(self.active) < MAX_ACTIVE_TRANSFERS:
+                waiting = queue.popleft()
+                self.active.add(waiting.id)
+                waiting.admitted = True
+
+    def run(self):
+        if self.running:
+            return
+        self.running = True
+        try:
+            blocked = False
+            for queue in self.queues.values():
+                # Pacer stops all classes, a full congestion window stops only new windows
+                served = self.serve(queue, blocked)
+                if served is None:
+                    return
+                blocked |= not served
+        finally:
+            self.running = False
+
+    def serve(self, queue: deque["SendFile"], blocked: bool) -> bool | None:
+        """Send packets of the class till its transfers are idle
+
+        Return `None` if the pacer stopped it, `False` if the congestion window did. `blocked` means
+        a higher class waits for the congestion window.
+        """
+        while queue:
+            transfer = queue[0]
+            if self.deficit[transfer.id] <= 0:
+                self.deficit[transfer.id] += QUANTUM
+            # A window by window transfer is confirmed only as a whole, so its window is not interleaved
+            while self.deficit[transfer.id] > 0 or transfer.mid_window:
+                if not self.congestion.pacer.can_send(time_ms()):
+                    return None
+                if not self.window_allowed(transfer, blocked):
+                    return False
+                sent = transfer.send_next()
+                if sent == 0:
+                    queue.popleft()
+                    transfer.queued = False
+                    del self.deficit[transfer.id]
+                    break
+                self.deficit[transfer.id] -= sent
+            else:
+                queue.rotate(-1)
+        return True
+
+    def window_allowed(self, transfer: "SendFile", blocked: bool = False) -> bool:
+        """Check the congestion window, never limited below one window of the transfer
+
+        Window by window transfers check it only before a new window, a started window needs all
+        its packets to be confirmed, so two half sent windows could block each other forever.
+        While a higher class is `blocked`, the transfer gets no window of its own, otherwise
+        a lower class with larger windows takes the room the higher class waits for.
+        """
+        if transfer.mid_window:
+            return True
+        if blocked:
+            return self.congestion.in_flight < self.congestion.cwnd
+        return self.congestion.in_flight < max(self.congestion.cwnd, transfer.window_size)
+
+    def next_deadline(self) -> int | None:
+        """Time when the pacer lets the next packet out, `None` if nothing waits or the congestion window is full"""
+        blocked = False
+        for queue in self.queues.values():
+            if not queue:
+                continue
+            # Transfer in the middle of its window or with its quantum left is always the head
+            if self.window_allowed(queue[0], blocked):
+                return ceil(self.congestion.pacer.next_send_time)
+            blocked = True
+        return None
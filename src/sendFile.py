@@ -1,11 +1,25 @@
+import hashlib
 import os
 
+from collections import deque
+from functools import partial
 from math import ceil
 from enum import Enum
+from time import perf_counter
 from typing import Any, Callable
 from fileData import FileData
-from packetParser import MRP, PacketType
-from services import MSG_SEND, log
+from ioPool import IoQueue
+from packetParser import MRP, PacketType, MAX_WINDOWS_AHEAD, INIT_TRAILING_HASH, INIT_CHUNK_HASHES, INIT_RESUMABLE
+from services import log, time_ms
+from rttEstimator import RttEstimator
+from congestion import CongestionController
+from scheduler import TransferScheduler, Priority
+from transferStats import TransferStats
+from metrics import Metrics
+from pathMtu import PathMtu, BASE_FRAGMENT_LEN
+
+READ_AHEAD_WINDOWS: int = 4
+"""Windows read from the disk before they are sent, so the network never waits for the disk"""
 
 
 class SendState(Enum):
@@ -14,49 +28,175 @@ class SendState(Enum):
     Sending_lost_packets = 2
     Wait_window_confirm = 3
     End_transfer = 4
+    Wait_integrity_confirm = 5
 
 
 class SendFile:
-    def __init__(self, destination: tuple[str, int], id: int, send: Callable[[bytes], None], file_path: str, window_size: int = 64, fragment_len: int = 100) -> None:
+    def __init__(self, destination: tuple[str, int], id: int, send: Callable[[bytes], None], file_path: str, window_size: int = 64, fragment_len: int | None = 100, max_in_flight: int | None = None, rtt: RttEstimator | None = None, congestion: CongestionController | None = None, trailing_hash: bool = True, chunked: bool = False, resumable: bool = False, scheduler: TransferScheduler | None = None, priority: Priority = Priority.Normal, run_io: Callable[..., None] | None = None, read_ahead: int = READ_AHEAD_WINDOWS, path_mtu: PathMtu | None = None) -> None:
         self.dst = f"{destination[0]}:{destination[1]}"
         self.id: int = id
         self.path: str = file_path
         self.window_size: int = window_size
-        self.fragment_len: int = fragment_len
+        self.fragment_len: int = fragment_len or 0
+        """Payload of a data packet, `0` until the automatic one is sized by `path_mtu`"""
+        self.path_mtu: PathMtu | None = path_mtu
         self.send: Callable[[bytes], None] = send
         self.state: SendState = SendState.Wait_init_confirm
         self.send_window: list[bytes] | None = []
         self.window_number = 0
         self.init_last_window = 0
         self.is_inited: bool = False
-        self.file: Any
+        self.file: Any = None
         self.file_data: FileData
+        self.max_in_flight: int | None = max_in_flight
+        """Amount of not confirmed packets in sliding window mode, `None` for window by window sending"""
+        self.in_flight: int = 0
+        self.sent_index: int = 0
+        """Index of the next packet of `send_window` in sliding window mode"""
+        self.unconfirmed: dict[int, list[bytes]] = {}
+        self.confirmed_bits: dict[int, int] = {}
+        self.rtt: RttEstimator = rtt if rtt is not None else RttEstimator()
+        self.backoff: int = 0
+        """Amount of retransmission timeouts without a confirm"""
+        self.last_send_time: int = 0  # ms
+        self.init_packet: bytes = b""
+        self.window_sent_time: dict[int, int] = {}
+        """Time when the last packet of the window was sent, used for RTT samples"""
+        self.retransmitted: set[int] = set()
+        """Windows with resent packets, they are not used for RTT samples"""
+        self.reported: set[int] = set()
+        """Windows resent once after a loss report, their confirm answers the resend and is sampled from it"""
+        self.congestion: CongestionController = congestion if congestion is not None else CongestionController(
+            fragment_len or BASE_FRAGMENT_LEN, self.rtt)
+        self.scheduler: TransferScheduler = scheduler if scheduler is not None else TransferScheduler(self.congestion)
+        """Shared by the sending transfers of the connection, it sends the new packets"""
+        self.priority: Priority = priority
+        self.queued: bool = False
+        """New packets of the transfer wait for the scheduler"""
+        self.admitted: bool = False
+        """Scheduler let the transfer start, only a limited amount of transfers runs at once"""
+        self.chunked: bool = chunked
+        """Send hashes of the file chunks in the init data, receiver verifies every chunk and asks for repairs"""
+        self.resumable: bool = resumable
+        """Identify the file by its hash in the init packet, the receiver may continue a failed transfer"""
+        self.trailing_hash: bool = trailing_hash and not chunked and not resumable
+        """Hash the file while sending and send it after the last window, instead of in the init data"""
+        self.hasher = hashlib.sha256()
+        self.integrity_packet: bytes = b""
+        self.jobs = IoQueue(run_io)
+        """Disk reads and hashing run in the pool of the server, in order"""
+        self.read_ahead: int = max(read_ahead, 1)
+        self.read_windows: deque[list[bytes]] = deque()
+        """Data windows read ahead, in order"""
+        self.read_position: int = 0
+        """Offset of the next window to read"""
+        self.reads: int = 0
+        """Reads submitted and not done yet"""
+        self.waits_read: bool = False
+        """Next window or the init data is not read yet, sending continues when it is"""
+        self.__size: int = 0
+        self.start_time: int = time_ms()  # ms
+        self.end_time: int = 0  # ms
+        self.succeeded: bool = False
+        """Receiver confirmed the whole file"""
+        self.metrics = Metrics()
+        self.stall_start: int | None = None  # ms
+        """Time the window got full, the next new packet ends the stall"""
+        self.scheduler.add(self)
 
     def run(self):
         if not self.is_inited:
-            self.init()
-            self.is_inited = True
+            if self.admitted and self.fragments_sized:
+                if self.fragment_len == 0:
+                    self.fragment_len = self.path_mtu.fragment_len if self.path_mtu is not None else BASE_FRAGMENT_LEN
+                self.init()
+                self.is_inited = True
+        elif time_ms() - self.last_send_time > self.retransmit_timeout and not self.waits_locally:
+            if self.state in (SendState.Wait_init_confirm, SendState.Wait_window_confirm,
+                              SendState.Wait_integrity_confirm):
+                self.handle_retransmit_timeout()
 
         return self.state != SendState.End_transfer
 
+    def next_deadline(self) -> int | None:
+        """Return time in ms when `run` has to be called next, `None` if it waits only for packets"""
+        if not self.is_inited:
+            return 0 if self.admitted and self.fragments_sized else None
+        if self.state == SendState.End_transfer:
+            return 0
+        deadline = None
+        if self.state in (SendState.Wait_init_confirm, SendState.Wait_window_confirm,
+                          SendState.Wait_integrity_confirm) and not self.waits_locally:
+            deadline = self.last_send_time + self.retransmit_timeout + 1
+
+        return deadline
+
+    @property
+    def fragments_sized(self) -> bool:
+        """Automatic fragments wait for the first round of the path MTU probes, the size is fixed by the init"""
+        return self.fragment_len > 0 or self.path_mtu is None or self.path_mtu.settled
+
+    @property
+    def waits_locally(self) -> bool:
+        """Nothing sent can be lost yet, the init packet waits for the hash of the file or the rest
+        of the window waits for the disk or for the pacer used by other transfers of the connection"""
+        if self.state == SendState.Wait_init_confirm:
+            return self.init_packet == b""
+        return (self.queued or self.waits_read) and self.max_in_flight is None
+
+    @property
+    def mid_window(self) -> bool:
+        """Window by window transfer has sent a part of its window"""
+        return (self.max_in_flight is None and self.send_window is not None
+                and 0 < self.sent_index < len(self.send_window))
+
+    @property
+    def retransmit_timeout(self) -> int:
+        """Receiver reports lost packets after one timeout, sender probes only after two"""
+        return self.rtt.get_timeout(self.backoff + 1)
+
+    def handle_retransmit_timeout(self):
+        self.backoff += 1
+        self.last_send_time = time_ms()
+        if self.state == SendState.Wait_init_confirm:
+            self.metrics.retransmits += 1
+            self.send(self.init_packet)
+            return
+        if self.state == SendState.Wait_integrity_confirm:
+            self.metrics.retransmits += 1
+            self.send(self.integrity_packet)
+            return
+        self.congestion.on_timeout(self.last_send_time)
+
+        # Resend the last sent packet of the oldest window, receiver answers with its confirm
+        if self.max_in_flight is None:
+            window_number, sent = self.window_number, self.window_size
+            window = self.send_window
+        elif self.unconfirmed:
+            window_number = min(self.unconfirmed)
+            sent = self.get_sent_amount(window_number)
+            window = self.unconfirmed[window_number]
+        else:
+            return
+        if window is not None and sent > 0:
+            self.retransmitted.add(window_number)
+            self.send_data(sent - 1, window_number, window[sent - 1], True)
+
     def init(self):
         try:
-            if self.path.endswith(".msg"):
-                self.file = open(self.path, "rb")
-                self.__size = os.path.getsize(self.path)
-                log.info(
-                    f"Send msg with size {self.__size} bytes -> {self.dst}\n")
-            else:
-                self.file = open(self.path, "rb")
-                self.__size = os.path.getsize(self.path)
-                log.info(
-                    f"Sending file:{self.id} {self.path}: {self.__size} bytes -> {self.dst}\n")
+            self.file = open(self.path, "rb")
+            self.__size = os.path.getsize(self.path)
+            log.info(
+                f"Sending file:{self.id} {self.path}: {self.__size} bytes -> {self.dst}\n")
 
             self.send_file_init()
 
         except Exception as e:
-            log.error(f"Error opening file: {e}\n")
-            self.state = SendState.End_transfer
+            self.handle_file_error(e)
+
+    def handle_file_error(self, e: BaseException):
+        log.error(f"Error opening file: {e}\n")
+        self.close()
 
     def get_window(self):
        # While cursore isnt at the end of the file, yield a window of data,
@@ -74,16 +214,77 @@ class SendFile:
                     current_window.append(b'')
 
             return current_window
-        elif self.file.tell() != self.__size:
-            result = [self.file.read(self.fragment_len)
-                      for _ in range(self.window_size)]
+        elif self.read_windows:
+            window = self.read_windows.popleft()
+            self.fill_read_ahead()
+            return window
+
+    def is_window_ready(self, window_number: int) -> bool:
+        """Window is in memory or the file has no more data"""
+        return (window_number <= self.init_last_window or bool(self.read_windows)
+                or (self.reads == 0 and self.read_position >= self.__size))
 
-            return result
+    def fill_read_ahead(self):
+        """Keep `read_ahead` data windows read, the reads run in the pool"""
+        window_bytes = self.window_size * self.fragment_len
+        while (self.state != SendState.End_transfer and len(self.read_windows) + self.reads < self.read_ahead
+               and self.read_position < self.__size):
+            offset = self.read_position
+            self.read_position += window_bytes
+            self.reads += 1
+            self.jobs.submit(self.read_window, self.handle_read, offset)
+
+    def read_window(self, offset: int) -> list[bytes]:
+        """Read the window at `offset` in fragments, runs in the pool, fragments after the end are empty"""
+        data = self.read_at(offset, self.window_size * self.fragment_len)
+        if self.trailing_hash:
+            # Reads of the transfer run in order, so the hash is computed while the file is read
+            start = perf_counter()
+            self.hasher.update(data)
+            self.metrics.hash_time.observe((perf_counter() - start) * 1000)
+        return [data[i:i + self.fragment_len]
+                for i in range(0, self.window_size * self.fragment_len, self.fragment_len)]
+
+    def handle_read(self, result: list[bytes] | BaseException):
+        self.reads -= 1
+        if self.state == SendState.End_transfer:
+            return
+        if isinstance(result, BaseException):
+            log.error(f"Error reading file: {result}\n")
+            self.close()
+            return
+        self.read_windows.append(result)
+        if self.waits_read:
+            self.waits_read = False
+            if self.max_in_flight is None:
+                self.send_next_window()
+            else:
+                self.scheduler.wake(self)
 
     def send_file_init(self):
-        # Get the init data
-        self.file_data = FileData(path=self.path)
-        self.send_init(len(self.file_data))
+        # Hashing the file takes long, the init is sent when it is done
+        self.jobs.submit(self.load_file_data, self.handle_file_data)
+        if not self.resumable:
+            # Resumed transfer knows its first window only from the confirm of the init
+            self.fill_read_ahead()
+
+    def load_file_data(self) -> FileData:
+        start = perf_counter()
+        file_data = FileData(path=self.path, with_hash=not self.trailing_hash and not self.chunked,
+                             chunked=self.chunked)
+        self.metrics.hash_time.observe((perf_counter() - start) * 1000)
+        return file_data
+
+    def handle_file_data(self, result: FileData | BaseException):
+        if self.state == SendState.End_transfer:
+            return
+        try:
+            if isinstance(result, BaseException):
+                raise result
+            self.file_data = result
+            self.send_init(len(self.file_data))
+        except Exception as e:
+            self.handle_file_error(e)
 
     def send_init(self, init_data_len: int):
         # Whole number of packets needed to send the JSON object
@@ -95,43 +296,197 @@ class SendFile:
             raise ValueError("Too many windows needed to send init data")
 
         self.init_last_window = window_amount - 1
+        payload = bytes([self.init_last_window, (INIT_TRAILING_HASH if self.trailing_hash else 0) |
+                         (INIT_CHUNK_HASHES if self.chunked else 0) | (INIT_RESUMABLE if self.resumable else 0)])
+        if self.resumable:
+            # Receiver finds the journal of the previous attempt before the init data arrives
+            payload += self.get_hash() + self.__size.to_bytes(8, "big")
         # Send init packet with the amount of windows needed to send the InitData structure
-        self.send(MRP.serialize(
-            PacketType.Init_file_transfer, self.id, self.window_size, self.fragment_len, self.init_last_window.to_bytes(1, "big")))
+        self.init_packet = MRP.serialize(
+            PacketType.Init_file_transfer, self.id, self.window_size, self.fragment_len, payload)
+        self.last_send_time = time_ms()
+        self.send(self.init_packet)
 
     def send_next_window(self):
+        if not self.is_window_ready(self.window_number):
+            self.waits_read = True
+            return
         # Update window
         self.send_window = self.get_window()
         if self.send_window is None:
+            self.handle_all_confirmed()
+        else:
+            self.sent_index = 0
+            self.scheduler.wake(self)
+
+    def send_next(self) -> int:
+        """Send the next new packet when the scheduler asks, return its size, `0` if it has to wait for a confirm"""
+        if self.state not in (SendState.Sending_window, SendState.Wait_window_confirm) or self.send_window is None:
+            return 0
+        if self.sent_index == len(self.send_window):
+            if self.max_in_flight is None:
+                return 0
+            # Receiver buffers only `MAX_WINDOWS_AHEAD` windows after the first not confirmed one
+            if self.unconfirmed and self.window_number - min(self.unconfirmed) >= MAX_WINDOWS_AHEAD:
+                self.start_stall()
+                return 0
+            if not self.is_window_ready(self.window_number + 1):
+                self.waits_read = True
+                return 0
+            self.window_number += 1
+            self.send_window = self.get_window()
+            self.sent_index = 0
+            if self.send_window is None:
+                if not self.unconfirmed:
+                    self.handle_all_confirmed()
+                return 0
+            self.unconfirmed[self.window_number] = self.send_window
+            self.confirmed_bits[self.window_number] = 0
+        elif self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            self.start_stall()
+            return 0
+
+        size = self.send_data(self.sent_index, self.window_number, self.send_window[self.sent_index])
+        self.sent_index += 1
+        self.in_flight += 1
+        self.last_send_time = time_ms()
+        if self.stall_start is not None:
+            self.metrics.window_stall.observe(self.last_send_time - self.stall_start)
+            self.stall_start = None
+        if self.sent_index == len(self.send_window):
+            self.window_sent_time[self.window_number] = self.last_send_time
+            if self.max_in_flight is None:
+                # Next window waits for the confirm of this one
+                self.stall_start = self.last_send_time
+        return size
+
+    def start_stall(self):
+        if self.stall_start is None:
+            self.stall_start = time_ms()
+
+    def send_data(self, index: int, window_number: int, payload: bytes, retransmit: bool = False) -> int:
+        packet = MRP.serialize(PacketType.Data, self.id, index, window_number, payload)
+        self.congestion.on_sent(len(packet), time_ms(), retransmit)
+        self.metrics.packets_out += 1
+        self.metrics.bytes_out += len(packet)
+        self.metrics.retransmits += retransmit
+        self.send(packet)
+        return len(packet)
+
+    def handle_all_confirmed(self):
+        if not self.trailing_hash and not self.chunked:
             self.handle_end_transfer()
+            return
+        # Receiver checks the file with the hash computed while sending, or confirms after all chunks are verified
+        self.integrity_packet = MRP.serialize(PacketType.Integrity, self.id, 0, self.window_number,
+                                              self.get_hash())
+        self.state = SendState.Wait_integrity_confirm
+        self.last_send_time = time_ms()
+        self.send(self.integrity_packet)
+
+    def get_hash(self) -> bytes:
+        if self.chunked:
+            return bytes.fromhex(self.file_data.root)
+        if self.trailing_hash:
+            return self.hasher.digest()
+        return bytes.fromhex(self.file_data.hash)
+
+    def resume(self, windows: int):
+        """Skip the data windows the receiver already has, window numbers continue as usual"""
+        if windows > 0:
+            offset = min(windows * self.window_size * self.fragment_len, self.__size)
+            self.read_position = offset
+            log.warn(f"F:{self.id} Resuming {self.path} from {offset} B -> {self.dst}\n")
+
+    def handle_repair_request(self, packet: MRP):
+        """Resend all fragments of the chunk the receiver found corrupted"""
+        chunk_size = self.file_data.chunk_size
+        start = packet.window_number * chunk_size
+        end = min(start + chunk_size, self.__size)
+        if start >= end:
+            return
+        log.warn(f"F:{self.id} Repairing chunk {packet.window_number} -> {self.dst}\n")
+        first = start // self.fragment_len
+        self.jobs.submit(self.read_at, partial(self.send_repair, first),
+                         first * self.fragment_len, end - first * self.fragment_len)
+
+    def send_repair(self, first: int, result: bytes | BaseException):
+        """Send the fragments of the repaired chunk read in the pool, the first one has number `first`"""
+        if self.state == SendState.End_transfer or isinstance(result, BaseException):
+            return
+        for index in range(0, len(result), self.fragment_len):
+            repair = MRP.serialize(PacketType.RepairData, self.id, 0, first + index // self.fragment_len,
+                                   result[index:index + self.fragment_len])
+            self.congestion.on_sent(len(repair), time_ms(), True)
+            self.metrics.packets_out += 1
+            self.metrics.bytes_out += len(repair)
+            self.metrics.retransmits += 1
+            self.send(repair)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        start = perf_counter()
+        if hasattr(os, "pread"):
+            data = os.pread(self.file.fileno(), size, offset)
         else:
-            for i, packet in enumerate(self.send_window):
-                self.send(MRP.serialize(PacketType.Data, self.id,
-                                        i, self.window_number, packet))
+            # Jobs of the transfer don't run at once, so the position can be moved
+            self.file.seek(offset)
+            data = self.file.read(size)
+        self.metrics.disk_time.observe((perf_counter() - start) * 1000)
+        return data
+
+    def close_file(self):
+        """Close the file after the disk jobs still running"""
+        if self.file is not None:
+            self.jobs.submit(self.file.close)
 
     def handle_end_transfer(self):
-        self.file.close()
-        if self.path != MSG_SEND:
-            log.critical(f"File sent successfully -> {self.dst}\n\
-                                \tFile: {self.path}\n\
-                                \tFragment size: {self.fragment_len}\n\
-                                \tWindow size: {self.window_size}\n\
-                                \tSHA256 hash: {self.file_data.hash}\n\n\
-                                \tFile size: {self.__size}B\n")
-        else:
-            os.remove(self.path)
+        self.close_file()
+        self.scheduler.remove(self)
+        self.congestion.release(self.in_flight)
+        self.in_flight = 0
+        log.critical(f"File sent successfully -> {self.dst}\n\
+                            \tFile: {self.path}\n\
+                            \tFragment size: {self.fragment_len}\n\
+                            \tWindow size: {self.window_size}\n\
+                            \tSHA256 hash: {self.get_hash().hex()}\n\n\
+                            \tFile size: {self.__size}B\n")
 
+        self.succeeded = True
+        self.end_time = time_ms()
         self.state = SendState.End_transfer
 
     def add_packet(self, packet: MRP):
         if self.state == SendState.Wait_init_confirm:
             if packet.type == PacketType.ConfirmInit_file_transfer:
+                if self.backoff == 0:
+                    self.rtt.add_sample(time_ms() - self.last_send_time)
+                self.backoff = 0
                 self.state = SendState.Sending_window
-                self.send_next_window()
-                self.state = SendState.Wait_window_confirm
+                if self.resumable and len(packet.payload) >= 4:
+                    self.resume(int.from_bytes(packet.payload[:4], "big"))
+                self.fill_read_ahead()
+                if self.max_in_flight is None:
+                    self.send_next_window()
+                else:
+                    self.send_window = self.get_window()
+                    self.unconfirmed[self.window_number] = self.send_window
+                    self.confirmed_bits[self.window_number] = 0
+                    self.send_sliding()
+                if self.state == SendState.Sending_window:
+                    self.state = SendState.Wait_window_confirm
         elif self.state == SendState.Wait_window_confirm:
             if packet.type == PacketType.ConfirmData:
-                self.handle_window_confirm(packet)
+                if self.max_in_flight is None:
+                    self.handle_window_confirm(packet)
+                else:
+                    self.handle_sliding_confirm(packet)
+        elif self.state == SendState.Wait_integrity_confirm:
+            if packet.type == PacketType.ConfirmIntegrity:
+                self.backoff = 0
+                self.handle_end_transfer()
+
+        if packet.type == PacketType.RepairRequest and self.chunked and self.state != SendState.End_transfer:
+            self.handle_repair_request(packet)
 
     def handle_window_confirm(self, packet: MRP):
         # Get the window number from the packet
@@ -146,22 +501,114 @@ class SendFile:
             # Every bit in the confirm is a packet in the window, 1 = received, 0 = not received
             # Check if all packets are received and resend the lost ones
             confirm_int = int.from_bytes(confirm, "big")
+            lost = 0
             for index in range(len(confirm)*8):
                 bit = 1 << (self.window_size - index - 1)
                 if (bit & confirm_int) == 0:
                     is_window_full = False
-                    # Resend lost packet
-                    if self.send_window is not None:
-                        self.send(MRP.serialize(
-                            PacketType.Data, self.id, index, self.window_number, self.send_window[index]))
+                    # Resend lost packet, packets still waiting for the pacer are not lost
+                    if self.send_window is not None and index < self.sent_index:
+                        lost += 1
+                        self.send_data(index, self.window_number, self.send_window[index], True)
 
             if is_window_full:
+                self.add_rtt_sample(self.window_number)
+                self.backoff = 0
+                self.congestion.on_ack(self.in_flight, time_ms())
+                self.in_flight = 0
                 self.state = SendState.Wait_window_confirm
                 self.window_number += 1
                 self.send_next_window()
             else:
-                log.info(
-                    f"F:{self.id} W:{self.window_number} resend some packets -> {self.dst}")
+                self.last_send_time = time_ms()
+                self.restart_rtt_sample(self.window_number, lost)
+                self.congestion.on_loss(lost, self.last_send_time)
+                log.info("F:%d W:%d resend some packets -> %s", self.id, self.window_number, self.dst)
+
+    def send_sliding(self):
+        """Send packets until `max_in_flight` of them are not confirmed, crossing window boundaries"""
+        if self.send_window is None and not self.unconfirmed:
+            self.handle_all_confirmed()
+        else:
+            self.scheduler.wake(self)
+
+    def handle_sliding_confirm(self, packet: MRP):
+        """Use the window confirm as selective acknowledgement, resend only the missing packets"""
+        window_number = packet.window_number
+        if window_number not in self.unconfirmed:
+            return
+
+        confirm_int = int.from_bytes(packet.payload, "big")
+        if confirm_int == 2 ** self.window_size - 1:
+            # Receiver completes windows in order, so the confirm is cumulative
+            self.add_rtt_sample(window_number)
+            self.backoff = 0
+            for number in [number for number in self.unconfirmed if number <= window_number]:
+                confirmed = self.get_sent_amount(number) - self.confirmed_bits[number].bit_count()
+                self.in_flight -= confirmed
+                self.congestion.on_ack(confirmed, time_ms())
+                del self.unconfirmed[number]
+                del self.confirmed_bits[number]
+                self.window_sent_time.pop(number, None)
+                self.retransmitted.discard(number)
+        else:
+            self.retransmitted.add(window_number)
+            self.last_send_time = time_ms()
+            sent = self.get_sent_amount(window_number)
+            sent_mask = (2 ** self.window_size - 1) ^ (2 ** (self.window_size - sent) - 1)
+            newly_confirmed = confirm_int & sent_mask & ~self.confirmed_bits[window_number]
+            self.in_flight -= newly_confirmed.bit_count()
+            self.congestion.on_ack(newly_confirmed.bit_count(), time_ms())
+            self.confirmed_bits[window_number] |= newly_confirmed
+            lost = 0
+            for index in range(sent):
+                if (confirm_int >> (self.window_size - index - 1)) & 1 == 0:
+                    lost += 1
+                    self.send_data(index, window_number, self.unconfirmed[window_number][index], True)
+            self.congestion.on_loss(lost, time_ms())
+            log.info("F:%d W:%d resend some packets -> %s", self.id, window_number, self.dst)
+
+        self.send_sliding()
+
+    def add_rtt_sample(self, window_number: int):
+        """Sample RTT from the full confirm of the window, only if none of its packets was resent by a timeout"""
+        sent_time = self.window_sent_time.pop(window_number, None)
+        if sent_time is not None and window_number not in self.retransmitted:
+            rtt = time_ms() - sent_time
+            if window_number not in self.reported or (self.rtt.min_sample is not None and rtt >= self.rtt.min_sample):
+                self.rtt.add_sample(rtt)
+        self.retransmitted.discard(window_number)
+        self.reported.discard(window_number)
+
+    def restart_rtt_sample(self, window_number: int, resent: int):
+        """Measure the RTT of the window from the resend of its reported losses
+
+        Window by window receiver reports losses only after its timeout, so the originals are usually lost and
+        the full confirm answers the resend. Without it a lossy link leaves almost no window for the samples and
+        the timeout stays stale. An original delayed past the report can still complete the window, a confirm
+        sooner than the shortest round trip after the resend is such one and is not sampled (RFC 8985).
+        A second report of the window makes the sample ambiguous, like a timeout.
+        """
+        if resent == 0:
+            return
+        if window_number in self.reported or window_number in self.retransmitted:
+            self.retransmitted.add(window_number)
+        else:
+            self.reported.add(window_number)
+            self.window_sent_time[window_number] = self.last_send_time
+
+    def get_sent_amount(self, window_number: int) -> int:
+        return self.sent_index if window_number == self.window_number else self.window_size
 
     def close(self):
-        self.file.close()
+        self.close_file()
+        self.scheduler.remove(self)
+        self.congestion.release(self.in_flight)
+        self.in_flight = 0
+        if self.state != SendState.End_transfer:
+            self.end_time = time_ms()
+        self.state = SendState.End_transfer
+
+    def stats(self) -> TransferStats:
+        return TransferStats(self.id, self.dst, self.path, self.__size, self.start_time, self.end_time or time_ms(),
+                             self.succeeded)
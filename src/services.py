@@ -1,9 +1,19 @@
+import atexit
 import hashlib
+import logging
+import os
 import colorlog
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 from time import time
+from typing import IO
 
-MSG_SEND: str = ".msg"
-MSG_RECV: str = ".msg"
+LOG_LEVEL: str = os.environ.get("MRP_LOG_LEVEL", "INFO")
+"""Level of the protocol logs at startup, `DEBUG` shows a line per window"""
+HOT_LOG_INTERVAL = 1000  # ms
+HOT_LOG_BURST: int = 5
+"""Debug and info records of one line of code written per interval, the rest are dropped and counted"""
 
 
 def time_ms() -> int:
@@ -21,6 +31,28 @@ def sha256_file(file_path: str) -> bytes:
         return hasher.digest()
 
 
+def sha256_chunks(file_path: str, chunk_size: int) -> list[bytes]:
+    """Return SHA-256 of every `chunk_size` bytes of the file, hashed in parallel
+
+    hashlib releases the GIL while hashing, so threads use all cores.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as afile:
+        fd = afile.fileno()
+
+        def hash_chunk(offset: int) -> bytes:
+            if hasattr(os, "pread"):
+                data = os.pread(fd, chunk_size, offset)
+            else:
+                with open(file_path, 'rb') as chunk_file:
+                    chunk_file.seek(offset)
+                    data = chunk_file.read(chunk_size)
+            return hashlib.sha256(data).digest()
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            return list(executor.map(hash_chunk, range(0, size, chunk_size)))
+
+
 formatter: colorlog.ColoredFormatter = colorlog.ColoredFormatter(
     fmt="\x1b[2K%(log_color)-8s%(reset)s %(log_color)s%(message)s%(reset)s\r",
     log_colors={
@@ -43,12 +75,97 @@ formatter: colorlog.ColoredFormatter = colorlog.ColoredFormatter(
     style='%',
     reset=True,
 )
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through `burst` debug and info records per `interval` from every line of code
+
+    Warnings and more severe records always pass. The first record of the next interval
+    tells how many were dropped.
+    """
+
+    def __init__(self, interval: int = HOT_LOG_INTERVAL, burst: int = HOT_LOG_BURST) -> None:
+        super().__init__()
+        self.interval = interval  # ms
+        self.burst = burst
+        self.sites: dict[tuple[str, int], list[int]] = {}
+        """Start of the interval and the amount of records of every call site"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time_ms()
+        state = self.sites.get(site)
+        if state is None or now - state[0] >= self.interval:
+            if state is not None and state[1] > self.burst:
+                record.msg = f"{record.msg} ({state[1] - self.burst} similar dropped)"
+            self.sites[site] = [now, 1]
+            return True
+        state[1] += 1
+        return state[1] <= self.burst
+
+
+class BackgroundHandler(QueueHandler):
+    """Queues records for the writer thread, the message is formatted there, not in the loop"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
 handler = colorlog.StreamHandler()
 handler.setFormatter(formatter)
 handler.terminator = '\r'
 
-colorlog.getLogger('').addHandler(handler)
+_installed: logging.Handler | None = None
+_listener: QueueListener | None = None
+
+
+def configure_logging(level: int | str = LOG_LEVEL, background: bool = True, stream: IO[str] | None = None):
+    """Set the level and the output of the logs, `stream` defaults to stderr
+
+    With `background` records are formatted and written by a thread, the callers only queue them.
+    """
+    global _installed, _listener
+    root = colorlog.getLogger('')
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _installed is not None:
+        root.removeHandler(_installed)
+    if stream is not None:
+        handler.setStream(stream)
+    if background:
+        queue: SimpleQueue = SimpleQueue()
+        _listener = QueueListener(queue, handler)
+        _listener.start()
+        _installed = BackgroundHandler(queue)
+    else:
+        _installed = handler
+    root.addHandler(_installed)
+    log.setLevel(level)
+
+
+def log_directly():
+    """Forked process has the queue but not the thread writing it and it may exit without `atexit`,
+    it writes its records itself unless it configures the logging again"""
+    global _listener
+    if _listener is not None:
+        _listener = None
+        configure_logging(log.level, background=False)
+
+
+@atexit.register
+def flush_logs():
+    """Write the queued records before the interpreter exits"""
+    if _listener is not None:
+        _listener.stop()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=log_directly)
 
 global log
 log = colorlog.getLogger(__name__)
-log.setLevel('DEBUG')
+log.addFilter(RateLimitFilter())
+configure_logging()
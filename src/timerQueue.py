@@ -0,0 +1,73 @@
+import heapq
+
+from itertools import count
+from typing import Any, Callable
+
+
+class Timer:
+    """Deadline registered in `TimerQueue`, `callback` is called with `args` when it expires"""
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline: int, callback: Callable[..., Any], args: tuple[Any, ...]) -> None:
+        self.deadline: int = deadline  # ms
+        self.callback = callback
+        self.args = args
+        self.cancelled: bool = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    """Min-heap of timers, cancelled timers are removed lazily when they reach the top
+
+    Scheduling and cancelling is O(log n), expired timers are popped in O(log n) each,
+    so the cost of handling timeouts does not depend on the number of idle timers.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[int, int, Timer]] = []
+        self._counter = count()
+        self._active: int = 0
+
+    def schedule(self, deadline: int, callback: Callable[..., Any], *args: Any) -> Timer:
+        timer = Timer(deadline, callback, args)
+        heapq.heappush(self._heap, (deadline, next(self._counter), timer))
+        self._active += 1
+        return timer
+
+    def cancel(self, timer: Timer | None):
+        if timer is not None and not timer.cancelled:
+            timer.cancel()
+            self._active -= 1
+            # Drop cancelled timers when they take most of the heap
+            if len(self._heap) > 2 * self._active + 64:
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+
+    def next_deadline(self) -> int | None:
+        """Return the deadline of the earliest active timer"""
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: int) -> list[Timer]:
+        """Remove and return all active timers with deadline <= `now`"""
+        expired: list[Timer] = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self._heap)
+            if not timer.cancelled:
+                timer.cancelled = True
+                self._active -= 1
+                expired.append(timer)
+        return expired
+
+    def run_expired(self, now: int) -> int:
+        """Call callbacks of all expired timers, return the amount of them"""
+        expired = self.pop_expired(now)
+        for timer in expired:
+            timer.callback(*timer.args)
+        return len(expired)
+
+    def __len__(self) -> int:
+        return self._active
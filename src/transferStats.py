@@ -0,0 +1,24 @@
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class TransferStats:
+    """Outcome of a finished file transfer, sent or received"""
+    id: int
+    peer: str
+    """ip:port of the other side"""
+    path: str
+    size: int  # B
+    start_time: int  # ms
+    end_time: int  # ms
+    succeeded: bool
+    """Whole file arrived and its hash matches, `False` for a failed or closed transfer"""
+
+    @property
+    def elapsed(self) -> int:
+        return self.end_time - self.start_time  # ms
+
+    @property
+    def speed(self) -> float:
+        """Average speed in B/s"""
+        return self.size * 1000 / max(self.elapsed, 1)
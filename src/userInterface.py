@@ -3,16 +3,20 @@ import sys
 
 from services import log
 from MainServer import Server
+from workerPool import WorkerPool
 from packetParser import MAX_WINDOW_NUMBER
+from pathMtu import BASE_FRAGMENT_LEN, MAX_FRAGMENT_LEN
 
 MAX_WINDOW_LEN = 248
-MAX_FRAME_LEN = 2040
+MAX_FRAME_LEN = MAX_FRAGMENT_LEN
 
-# is windows
-if sys.platform.startswith("win"):
-    default_stdin = open("CONIN$", "r")
-else:
-    default_stdin = open("/dev/tty", "r")
+
+def open_terminal():
+    """Terminal to read the commands from once the piped stdin ends, opened only then so the checks work without one"""
+    # is windows
+    if sys.platform.startswith("win"):
+        return open("CONIN$", "r")
+    return open("/dev/tty", "r")
 
 
 def d_input(default: str, msg: str) -> str:
@@ -22,7 +26,7 @@ def d_input(default: str, msg: str) -> str:
     return user_input
 
 
-def handle_commands(server: Server):
+def handle_commands(server: Server | WorkerPool):
     # Exit if user press CTRL-C
 
     user_input: str = ""
@@ -31,8 +35,9 @@ def handle_commands(server: Server):
     msg: str = ""
     ip: str = "127.0.0.1"
     port: int = 1000
-    frame_len: int = 50
+    frame_len: int = 0
     window_size: int = 16
+    in_flight: int = 0
 
     while True:
         try:
@@ -41,7 +46,7 @@ def handle_commands(server: Server):
             server.close()
         except EOFError:
             # set default input stdin
-            sys.stdin = default_stdin
+            sys.stdin = open_terminal()
 
         if user_input == "exit":
             server.close()
@@ -65,17 +70,19 @@ def handle_commands(server: Server):
                 window_size = int(
                     d_input(str(window_size), f"Window size ({window_size}): "))
                 frame_len = int(
-                    d_input(str(frame_len), f"Frame length ({frame_len}): "))
+                    d_input(str(frame_len), f"Frame length, 0 - fits the path MTU ({frame_len}): "))
                 if check_values(window_size, frame_len, file_len):
                     break
-            server.send_file(file_path, ip, port, window_size, frame_len)
+            in_flight = int(
+                d_input(str(in_flight), f"Packets in flight, 0 - window by window ({in_flight}): "))
+            server.send_file(file_path, ip, port, window_size,
+                             frame_len or None, in_flight or None)
         elif user_input.startswith("msg"):
             msg = input("Enter message: ")
             ip = d_input(ip, f"Client ip ({ip}): ")
             port = int(d_input(str(port), f"Client port ({port}): "))
-            window_size = 16
             frame_len = 50
-            server.send_message(msg, ip, port, window_size, frame_len)
+            server.send_message(msg, ip, port, frame_len)
         elif user_input.startswith("close"):
             ip = d_input(ip, f"Client ip ({ip}): ")
             port = int(d_input(str(port), f"Client port ({port}): "))
@@ -103,6 +110,9 @@ def check_file(file_path: str) -> bool | str:
 
 
 def check_values(window_size: int, fragment_len: int, file_len: int) -> bool:
+    """Check the sending values, `fragment_len` 0 is sized by the path MTU and never below `BASE_FRAGMENT_LEN`"""
+    if fragment_len == 0:
+        fragment_len = BASE_FRAGMENT_LEN
     if window_size < 1 or window_size > MAX_WINDOW_LEN:
         log.error("Window size must be between 1 and 248")
         return False
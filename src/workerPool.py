@@ -0,0 +1,137 @@
+import ctypes
+import os
+import socket
+
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import Connection
+from threading import Lock, Thread
+from typing import Any
+from MainServer import Server
+from services import log, configure_logging, flush_logs
+
+SO_ATTACH_REUSEPORT_CBPF: int = 51
+SKF_NET_OFF: int = -0x100000
+"""Offset of the IP header for classic BPF loads, the socket filter starts at the UDP payload"""
+
+
+class SockFilter(ctypes.Structure):
+    _fields_ = [("code", ctypes.c_uint16), ("jt", ctypes.c_uint8), ("jf", ctypes.c_uint8), ("k", ctypes.c_uint32)]
+
+
+class SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.POINTER(SockFilter))]
+
+
+def steer_by_source_port(sock: socket.socket, workers: int):
+    """Deliver every datagram to the socket `source port % workers` of the reuseport group
+
+    Sockets are numbered in the order they were bound. Without the filter the kernel hashes
+    the whole address, which the pool can't compute to route its own commands.
+    """
+    net_offset = SKF_NET_OFF & 0xFFFFFFFF
+    program = [
+        (0xB1, net_offset),  # ldx 4 * ([ip header] & 0xf), length of the IP header
+        (0x48, net_offset),  # ldh [ip header + x], UDP source port
+        (0x94, workers),     # mod #workers
+        (0x16, 0),           # ret a
+    ]
+    filters = (SockFilter * len(program))(*[SockFilter(code, 0, 0, k) for code, k in program])
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, bytes(SockFprog(len(program), filters)))
+
+
+def run_worker(index: int, host: str, port: int, workers: int, congestion: str, commands: Connection):
+    """Entry point of a worker process, reports its address (or the error) and runs the server"""
+    try:
+        server = Server(host, port, congestion=congestion, reuse_port=True)
+        if index == 0 and workers > 1:
+            # The filter belongs to the whole group, the first socket attaches it
+            steer_by_source_port(server.socket, workers)
+    except (OSError, AttributeError) as e:
+        commands.send(OSError(f"Worker {index} failed to start: {e}"))
+        return
+    commands.send(server.socket.getsockname())
+    Thread(target=handle_commands, args=(server, commands), daemon=True).start()
+    # Process exits without `atexit`, the queued records are written before it
+    configure_logging(log.level)
+    try:
+        server.start()
+    finally:
+        flush_logs()
+
+
+def handle_commands(server: Server, commands: Connection):
+    """Call the methods of the server sent by the pool, they are thread safe"""
+    while True:
+        try:
+            name, args, kwargs = commands.recv()
+        except (EOFError, OSError):
+            # Pool is gone
+            server.close()
+            return
+        getattr(server, name)(*args, **kwargs)
+        if name == "close":
+            return
+
+
+class WorkerPool:
+    """Sharded server, `workers` processes each run their own `Server` on the same port
+
+    Every peer is owned by one worker, chosen by its port, so the worker receiving its packets
+    is also the one sending to it. Has the sending methods of `Server`, they are routed to the owner.
+    Needs `SO_REUSEPORT` with BPF steering (Linux) for more than one worker.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, workers: int = os.cpu_count() or 1,
+                 congestion: str = "reno") -> None:
+        self.processes: list[Process] = []
+        self.commands: list[Connection] = []
+        self._lock = Lock()
+        """Commands may come from several threads, a pipe is not thread safe"""
+        for index in range(workers):
+            commands, worker_commands = Pipe()
+            process = Process(target=run_worker, args=(index, host, port, workers, congestion, worker_commands),
+                              daemon=True)
+            process.start()
+            worker_commands.close()
+            # Workers bind one by one, the order of binding is the order of the steering
+            address = commands.recv()
+            if isinstance(address, Exception):
+                process.join()
+                self.close()
+                raise address
+            self.processes.append(process)
+            self.commands.append(commands)
+            # Ephemeral port of the first worker is shared by the rest
+            host, port = address
+        self.address: tuple[str, int] = (host, port)
+
+    def owner(self, port: int) -> int:
+        """Index of the worker that receives the packets of a peer with this port"""
+        return port % len(self.commands)
+
+    def call(self, worker: int, name: str, *args: Any, **kwargs: Any):
+        with self._lock:
+            try:
+                self.commands[worker].send((name, args, kwargs))
+            except (BrokenPipeError, OSError):
+                log.error(f"Worker {worker} is not running\n")
+
+    def send_file(self, file_path: str, ip: str, port: int, *args: Any, **kwargs: Any):
+        """See `Server.send_file`"""
+        self.call(self.owner(port), "send_file", file_path, ip, port, *args, **kwargs)
+
+    def send_message(self, msg: str | bytes, ip: str, port: int, *args: Any, **kwargs: Any):
+        """See `Server.send_message`"""
+        self.call(self.owner(port), "send_message", msg, ip, port, *args, **kwargs)
+
+    def close_connection(self, ip: str, port: int):
+        self.call(self.owner(port), "close_connection", ip, port)
+
+    def start(self):
+        """Wait until all workers are closed"""
+        for process in self.processes:
+            process.join()
+
+    def close(self):
+        for worker in range(len(self.commands)):
+            self.call(worker, "close")